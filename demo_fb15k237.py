@@ -6,14 +6,14 @@ pyximport.install()
 
 from main.data.MIDFreebase15kReader import MIDFreebase15kReader
 from main.data.TypedRelationInstances import TypedRelationInstances
-from main.data.Vocabs import Vocabs
+from main.data.Vocabs import load_or_build_vocabs
 from main.graphs.AdjacencyGraph import AdjacencyGraph
 from main.features.PathExtractor import PathExtractor
 from main.data.Split import Split
 from main.features.PathReader import PathReader
 from main.experiments.CVSMDriver import CVSMDriver
 from main.experiments.PRADriver import PRADriver
-from main.playground.make_data_format import process_paths
+from main.playground.make_data_format import process_paths, process_extracted_paths
 from main.playground.model2.CompositionalVectorAlgorithm import CompositionalVectorAlgorithm
 
 # This script is used to run FB15k237 experiments (only our method) with 1:10 postive to negative ratio.
@@ -44,6 +44,7 @@ if __name__ == "__main__":
     PRA_PATH_DIR = os.path.join(DATASET_FOLDER, "pra_paths")
     RELATION_PATH_DIR = os.path.join(DATASET_FOLDER, "relation_paths")
     PATH_DIR = os.path.join(DATASET_FOLDER, "paths")
+    VOCAB_DIR = os.path.join(DATASET_FOLDER, "vocabs")
     NEW_PATH_DIR = os.path.join(DATASET_FOLDER, "new_paths")
     AUGMENT_PATH_DIR = os.path.join(DATASET_FOLDER, "paths_augment")
 
@@ -75,8 +76,7 @@ if __name__ == "__main__":
         typed_relation_instances.read_domains_and_ranges(DOMAIN_FILENAME, RANGE_FILENAME)
         typed_relation_instances.construct_from_labeled_edges(EDGES_FILENAME, entity_name_is_typed=False,
                                                               is_labeled=False)
-        vocabs = Vocabs()
-        vocabs.build_vocabs(typed_relation_instances)
+        vocabs = load_or_build_vocabs(VOCAB_DIR, typed_relation_instances)
         split = Split()
         split.read_splits(SPLIT_DIR, vocabs, entity_name_is_typed=True)
         graph = AdjacencyGraph()
@@ -95,8 +95,7 @@ if __name__ == "__main__":
         typed_relation_instances.read_domains_and_ranges(DOMAIN_FILENAME, RANGE_FILENAME)
         typed_relation_instances.construct_from_labeled_edges(EDGES_FILENAME, entity_name_is_typed=False,
                                                               is_labeled=False)
-        vocabs = Vocabs()
-        vocabs.build_vocabs(typed_relation_instances)
+        vocabs = load_or_build_vocabs(VOCAB_DIR, typed_relation_instances)
         split = Split()
         split.read_splits(SPLIT_DIR, vocabs, entity_name_is_typed=True)
         path_reader = PathReader(save_dir=PATH_DIR)
@@ -115,9 +114,12 @@ if __name__ == "__main__":
                       vocab_dir=os.path.join(CVSM_RET_DIR, "data/vocab"),
                       isOnlyRelation=False,
                       getOnlyRelation=False,
+                      # with coverage set, the two limits below are upper limits and each relation is padded to
+                      # the path length and number of types that keep 99.5% of paths and entity types untruncated
                       MAX_POSSIBLE_LENGTH_PATH=8,  # the max number of relations in a path + 1
                       NUM_ENTITY_TYPES_SLOTS=7,  # the number of types + 1 (the reason we +1 is to create a meaningless type for all entities)
-                      pre_padding=True)
+                      pre_padding=True,
+                      coverage=0.995)
 
     # 6. test run of the model
     # use $tensorboard --logdir runs to see the training progress
@@ -159,4 +161,30 @@ if __name__ == "__main__":
         cvsm = CompositionalVectorAlgorithm("freebase", CVSM_RET_DIR, None,
                                             pooling_method="lse", attention_method="specific",
                                             early_stopping_metric="map")
-        cvsm.train_and_test()
\ No newline at end of file
+        cvsm.train_and_test()
+
+    # 10. Vectorize paths directly for running the model (replaces steps 4 and 5)
+    #    Paths are read from the path store and vectorized in memory to arrays and vocabs without writing and reading
+    #    CVSM's text files. The path_extractor of step 3 can be passed instead of path_reader to skip the path store.
+    if run_step == 10:
+        typed_relation_instances = TypedRelationInstances()
+        typed_relation_instances.read_domains_and_ranges(DOMAIN_FILENAME, RANGE_FILENAME)
+        typed_relation_instances.construct_from_labeled_edges(EDGES_FILENAME, entity_name_is_typed=False,
+                                                              is_labeled=False)
+        vocabs = load_or_build_vocabs(VOCAB_DIR, typed_relation_instances)
+        split = Split()
+        split.read_splits(SPLIT_DIR, vocabs, entity_name_is_typed=True)
+        path_reader = PathReader(save_dir=PATH_DIR)
+        path_reader.read_paths(split)
+
+        process_extracted_paths(path_reader, split, vocabs,
+                                entity2types_filename=os.path.join(FREEBASE_DIR, "entity2types.json"),
+                                cvsm_data_dir=os.path.join(CVSM_RET_DIR, "data"),
+                                getOnlyRelation=False,
+                                MAX_POSSIBLE_LENGTH_PATH=8,
+                                NUM_ENTITY_TYPES_SLOTS=7,
+                                pre_padding=True,
+                                coverage=0.995,
+                                output_format="shard",
+                                # steps store entities and relations, and the model looks up types of entities
+                                entity_indexed_types=True)
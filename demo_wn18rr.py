@@ -6,13 +6,14 @@ pyximport.install()
 
 from main.data.WordnetReader import WordnetReader
 from main.data.TypedRelationInstances import TypedRelationInstances
-from main.data.Vocabs import Vocabs
+from main.data.Vocabs import load_or_build_vocabs
 from main.data.Split import Split
 from main.graphs.AdjacencyGraph import AdjacencyGraph
 from main.features.PathExtractor import PathExtractor
+from main.features.PathReader import PathReader
 from main.experiments.CVSMDriver import CVSMDriver
 from main.experiments.PRADriver import PRADriver
-from main.playground.make_data_format import process_paths
+from main.playground.make_data_format import process_paths, process_extracted_paths
 from main.playground.model2.CompositionalVectorAlgorithm import CompositionalVectorAlgorithm
 
 # This script is used to run WNRR18 experiments (only our method) with 1:10 postive to negative ratio.
@@ -42,6 +43,7 @@ if __name__ == "__main__":
     PRA_PATH_DIR = os.path.join(DATASET_FOLDER, "pra_paths")
     RELATION_PATH_DIR = os.path.join(DATASET_FOLDER, "relation_paths")
     PATH_DIR = os.path.join(DATASET_FOLDER, "paths")
+    VOCAB_DIR = os.path.join(DATASET_FOLDER, "vocabs")
     NEW_PATH_DIR = os.path.join(DATASET_FOLDER, "new_paths")
     AUGMENT_PATH_DIR = os.path.join(DATASET_FOLDER, "paths_augment")
 
@@ -72,8 +74,7 @@ if __name__ == "__main__":
         typed_relation_instances.read_domains_and_ranges(DOMAIN_FILENAME, RANGE_FILENAME)
         typed_relation_instances.construct_from_labeled_edges(EDGES_FILENAME, entity_name_is_typed=False,
                                                               is_labeled=False)
-        vocabs = Vocabs()
-        vocabs.build_vocabs(typed_relation_instances)
+        vocabs = load_or_build_vocabs(VOCAB_DIR, typed_relation_instances)
         split = Split()
         split.read_splits(SPLIT_DIR, vocabs, entity_name_is_typed=True)
         graph = AdjacencyGraph()
@@ -98,9 +99,12 @@ if __name__ == "__main__":
                       vocab_dir=os.path.join(CVSM_RET_DIR, "data/vocab"),
                       isOnlyRelation=False,
                       getOnlyRelation=False,
+                      # with coverage set, the two limits below are upper limits and each relation is padded to
+                      # the path length and number of types that keep 99.5% of paths and entity types untruncated
                       MAX_POSSIBLE_LENGTH_PATH=8,  # the max number of relations in a path + 1
                       NUM_ENTITY_TYPES_SLOTS=15,  # the number of types + 1 (the reason we +1 is to create a meaningless type for all entities)
-                      pre_padding=True)
+                      pre_padding=True,
+                      coverage=0.995)
 
     # 5. Run the model
     # use $tensorboard --logdir runs to see the training progress
@@ -120,4 +124,30 @@ if __name__ == "__main__":
                                             pooling_method="sat", attention_method="sat", early_stopping_metric="map",
                                             visualize=True, calculate_path_attn_stats=True, calculate_type_attn_stats=True,
                                             best_models={'verb_group': {'val_acc': 1.0, 'val_ap': 1.0, 'epoch': 0, 'test_ap': 1.0, 'test_acc': 1.0}, 'member_meronym': {'val_acc': 0.9431578947368421, 'val_ap': 0.7135667457942702, 'epoch': 19, 'test_ap': 0.6335514032344876, 'test_acc': 0.9408812046848857}, 'hypernym': {'val_acc': 0.989671984536826, 'val_ap': 0.9642082965792328, 'epoch': 16, 'test_ap': 0.9620883932417185, 'test_acc': 0.988660197755088}, 'also_see': {'val_acc': 0.9683306494900698, 'val_ap': 0.9301494111857955, 'epoch': 7, 'test_ap': 0.904053400950515, 'test_acc': 0.9729148753224419}, 'similar_to': {'val_acc': 0.9795918367346939, 'val_ap': 1.0, 'epoch': 3, 'test_ap': 1.0, 'test_acc': 0.9844961240310077}, 'member_of_domain_region': {'val_acc': 0.9590865842055185, 'val_ap': 0.7790840930128, 'epoch': 13, 'test_ap': 0.6968178289261723, 'test_acc': 0.954858454475899}, 'instance_hypernym': {'val_acc': 0.9630209965528047, 'val_ap': 0.8795758247163307, 'epoch': 8, 'test_ap': 0.8778889539424873, 'test_acc': 0.9612403100775194}, 'synset_domain_topic_of': {'val_acc': 0.9447174447174447, 'val_ap': 0.7312231001822086, 'epoch': 13, 'test_ap': 0.7427533669498867, 'test_acc': 0.9436564223798266}, 'derivationally_related_form': {'val_acc': 1.0, 'val_ap': 1.0, 'epoch': 0, 'test_ap': 1.0, 'test_acc': 1.0}, 'has_part': {'val_acc': 0.9431347849559114, 'val_ap': 0.7213513082273592, 'epoch': 13, 'test_ap': 0.6589302705002684, 'test_acc': 0.9376080691642651}, 'member_of_domain_usage': {'val_acc': 0.9627403846153846, 'val_ap': 0.9055411128578176, 'epoch': 6, 'test_ap': 0.8644352979656229, 'test_acc': 0.957487922705314}})
-        cvsm.train_and_test()
\ No newline at end of file
+        cvsm.train_and_test()
+
+    # 7. Vectorize paths directly for running the model (replaces step 4)
+    #    Paths are read from the path store and vectorized in memory to arrays and vocabs without writing and reading
+    #    CVSM's text files. The path_extractor of step 3 can be passed instead of path_reader to skip the path store.
+    if run_step == 7:
+        typed_relation_instances = TypedRelationInstances()
+        typed_relation_instances.read_domains_and_ranges(DOMAIN_FILENAME, RANGE_FILENAME)
+        typed_relation_instances.construct_from_labeled_edges(EDGES_FILENAME, entity_name_is_typed=False,
+                                                              is_labeled=False)
+        vocabs = load_or_build_vocabs(VOCAB_DIR, typed_relation_instances)
+        split = Split()
+        split.read_splits(SPLIT_DIR, vocabs, entity_name_is_typed=True)
+        path_reader = PathReader(save_dir=PATH_DIR)
+        path_reader.read_paths(split)
+
+        process_extracted_paths(path_reader, split, vocabs,
+                                entity2types_filename=os.path.join(WORDNET_DIR, "entity2types.json"),
+                                cvsm_data_dir=os.path.join(CVSM_RET_DIR, "data"),
+                                getOnlyRelation=False,
+                                MAX_POSSIBLE_LENGTH_PATH=8,
+                                NUM_ENTITY_TYPES_SLOTS=15,
+                                pre_padding=True,
+                                coverage=0.995,
+                                output_format="shard",
+                                # steps store entities and relations, and the model looks up types of entities
+                                entity_indexed_types=True)
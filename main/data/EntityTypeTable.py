@@ -0,0 +1,120 @@
+import os
+import json
+import numpy as np
+
+
+class EntityTypeTable:
+    """This class stores the type hierarchy of every entity as type ids, so that type features of an entity are
+    computed once per vocab instead of once for every step of every path.
+
+    Rows ``[0, len(entity_vocab))`` are indexed by entity ids. Entities that have types but are not in the entity vocab
+    get extra rows after that, and the last row is an entity without types.
+
+    :ivar sorted_type_ids: [num_rows, max_depth] type ids of each entity in ascending order, post-padded with the type
+                           #PAD_TOKEN
+    :ivar type_depths: [num_rows] the number of types of each entity
+    :ivar pad_index: the id of the type #PAD_TOKEN
+    :ivar entity_to_row: a dict mapping from an entity that is not in the entity vocab to its row
+    :ivar empty_row: the row of an entity without types
+    """
+
+    FILENAME = "entity_types.npz"
+
+    def __init__(self):
+        self.sorted_type_ids = None
+        self.type_depths = None
+        self.pad_index = None
+        self.entity_to_row = {}
+        self.empty_row = None
+
+    def build(self, entity_vocab, entity_type_vocab, entity_to_list_type):
+        """This function builds the table from vocabs in cvsm format.
+
+        :param entity_vocab: a dict mapping from an entity to its id
+        :param entity_type_vocab: a dict mapping from an entity type to its id
+        :param entity_to_list_type: a dict mapping from an entity to its list of types
+        """
+        self.pad_index = entity_type_vocab["#PAD_TOKEN"]
+        num_entities = max(entity_vocab.values()) + 1 if entity_vocab else 0
+        extra_entities = [entity for entity in entity_to_list_type if entity not in entity_vocab]
+        self.entity_to_row = {entity: num_entities + i for i, entity in enumerate(extra_entities)}
+        self.empty_row = num_entities + len(extra_entities)
+
+        row_to_types = {}
+        for entity, types in entity_to_list_type.items():
+            row = entity_vocab[entity] if entity in entity_vocab else self.entity_to_row[entity]
+            type_ids = []
+            for entity_type in types:
+                if entity_type in entity_type_vocab:
+                    type_ids.append(entity_type_vocab[entity_type])
+                else:
+                    type_ids.append(entity_type_vocab["#UNK_ENTITY_TYPE"])
+            row_to_types[row] = sorted(type_ids)
+
+        max_depth = max([len(type_ids) for type_ids in row_to_types.values()] + [1])
+        self.sorted_type_ids = np.full((self.empty_row + 1, max_depth), self.pad_index, dtype=np.int64)
+        self.type_depths = np.zeros(self.empty_row + 1, dtype=np.int64)
+        for row, type_ids in row_to_types.items():
+            self.sorted_type_ids[row, :len(type_ids)] = type_ids
+            self.type_depths[row] = len(type_ids)
+        return self
+
+    def save(self, vocab_dir):
+        extra_entities = sorted(self.entity_to_row, key=self.entity_to_row.get)
+        np.savez(os.path.join(vocab_dir, self.FILENAME), sorted_type_ids=self.sorted_type_ids,
+                 type_depths=self.type_depths, pad_index=self.pad_index,
+                 extra_entities=np.array(extra_entities, dtype=str))
+
+    def load(self, vocab_dir):
+        with np.load(os.path.join(vocab_dir, self.FILENAME)) as data:
+            self.sorted_type_ids = data["sorted_type_ids"]
+            self.type_depths = data["type_depths"]
+            self.pad_index = int(data["pad_index"])
+            extra_entities = data["extra_entities"].tolist()
+        self.empty_row = self.sorted_type_ids.shape[0] - 1
+        first_extra_row = self.empty_row - len(extra_entities)
+        self.entity_to_row = {entity: first_extra_row + i for i, entity in enumerate(extra_entities)}
+        return self
+
+    def get_row(self, entity, entity_vocab):
+        """
+        :return: the row of the entity. Entities without types share the empty row.
+        """
+        if entity in entity_vocab:
+            return entity_vocab[entity]
+        return self.entity_to_row.get(entity, self.empty_row)
+
+    def get_rows(self, num_slots):
+        """This function creates the type features of all entities. Same as how paths are vectorized, type ids of an
+        entity are sorted in ascending order, sliced to the number of slots, reversed, and then post-padded.
+
+        :param num_slots: the number of type slots for each entity
+        :return: [num_rows, num_slots]
+        """
+        length = np.minimum(self.type_depths, num_slots)[:, np.newaxis]
+        slots = np.arange(num_slots)[np.newaxis, :]
+        indices = np.clip(length - 1 - slots, 0, None)
+        rows = np.take_along_axis(self.sorted_type_ids, indices, axis=1)
+        return np.where(slots < length, rows, self.pad_index)
+
+
+def load_entity_type_table(vocab_dir):
+    """
+    Load the entity type table of a vocab folder in cvsm format. The table is built and saved if the vocab folder was
+    created before tables were persisted.
+
+    :param vocab_dir:
+    :return: :meth:`main.data.EntityTypeTable`
+    """
+    table = EntityTypeTable()
+    if os.path.exists(os.path.join(vocab_dir, EntityTypeTable.FILENAME)):
+        return table.load(vocab_dir)
+    with open(os.path.join(vocab_dir, "entity_vocab.txt"), "r") as fh:
+        entity_vocab = json.load(fh)
+    with open(os.path.join(vocab_dir, "entity_type_vocab.txt"), "r") as fh:
+        entity_type_vocab = json.load(fh)
+    with open(os.path.join(vocab_dir, "entity_to_list_type.json"), "r") as fh:
+        entity_to_list_type = json.load(fh)
+    table.build(entity_vocab, entity_type_vocab, entity_to_list_type)
+    table.save(vocab_dir)
+    return table
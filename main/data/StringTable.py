@@ -0,0 +1,232 @@
+import os
+import json
+import zlib
+import numpy as np
+from collections.abc import Mapping
+
+
+class StringTable(Mapping):
+    """This class maps strings to consecutive ids (and ids back to strings) without storing a Python object for each
+    string, so that vocabs of large knowledge graphs can be loaded in milliseconds and shared between processes.
+
+    A saved table consists of three arrays that are memory-mapped when loaded:
+
+        - <name>.strings.npy: utf-8 bytes of all strings concatenated in id order
+        - <name>.offsets.npy: [num_strings + 1] the start of each string in the bytes
+        - <name>.slots.npy: an open addressing hash table (crc32 with linear probing) from strings to ids. Empty slots
+          are -1.
+
+    Strings added after loading are kept in memory until the table is saved again.
+
+    The table can be used as a read-only dict from strings to ids, and :attr:`index` as a read-only dict from ids to
+    strings.
+    """
+
+    def __init__(self, strings=()):
+        """
+        :param strings: initial strings in id order
+        """
+        self._bytes = np.zeros(0, dtype=np.uint8)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._slots = np.full(1, -1, dtype=np.int64)
+        self._num_loaded = 0
+        self._filenames = None
+        self._added = {}
+        self._added_strings = []
+        self.index = StringTableIndex(self)
+        for string in strings:
+            self.add(string)
+
+    @staticmethod
+    def get_filenames(directory, name):
+        return [os.path.join(directory, name + suffix) for suffix in (".strings.npy", ".offsets.npy", ".slots.npy")]
+
+    @staticmethod
+    def exists(directory, name):
+        return all(os.path.exists(filename) for filename in StringTable.get_filenames(directory, name))
+
+    @staticmethod
+    def from_dict(string_to_id):
+        """
+        Create a table from a dict (e.g., a vocab in cvsm format) whose ids are 0, .., len - 1.
+        """
+        strings = sorted(string_to_id, key=string_to_id.get)
+        for idx, string in enumerate(strings):
+            if string_to_id[string] != idx:
+                raise Exception("Ids of {} and others are not consecutive from 0".format(string))
+        return StringTable(strings)
+
+    def add(self, string):
+        """
+        Add a string if it is not in the table.
+
+        :return: the id of the string
+        """
+        idx = self.get(string)
+        if idx is None:
+            idx = len(self)
+            self._added[string] = idx
+            self._added_strings.append(string)
+        return idx
+
+    def get_string(self, idx):
+        if idx < 0 or idx >= len(self):
+            raise KeyError(idx)
+        if idx >= self._num_loaded:
+            return self._added_strings[idx - self._num_loaded]
+        return self._bytes[self._offsets[idx]:self._offsets[idx + 1]].tobytes().decode("utf-8")
+
+    def _find(self, string):
+        if not self._num_loaded:
+            return None
+        encoded = string.encode("utf-8")
+        mask = len(self._slots) - 1
+        slot = zlib.crc32(encoded) & mask
+        while True:
+            idx = self._slots[slot]
+            if idx < 0:
+                return None
+            if self._bytes[self._offsets[idx]:self._offsets[idx + 1]].tobytes() == encoded:
+                return int(idx)
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, string):
+        idx = self._added.get(string)
+        if idx is None:
+            idx = self._find(string)
+            if idx is None:
+                raise KeyError(string)
+        return idx
+
+    def __contains__(self, string):
+        return string in self._added or self._find(string) is not None
+
+    def __len__(self):
+        return self._num_loaded + len(self._added_strings)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.get_string(idx)
+
+    def items(self):
+        return ((string, idx) for idx, string in enumerate(self))
+
+    def to_list(self):
+        """
+        Decode all strings at once, which is much faster than looking up strings one by one.
+
+        :return: a list of all strings in id order
+        """
+        all_bytes = self._bytes.tobytes()
+        offsets = self._offsets.tolist()
+        strings = [all_bytes[offsets[idx]:offsets[idx + 1]].decode("utf-8") for idx in range(self._num_loaded)]
+        return strings + self._added_strings
+
+    def copy(self):
+        """
+        :return: a dict from strings to ids
+        """
+        return {string: idx for idx, string in enumerate(self.to_list())}
+
+    def save(self, directory, name):
+        """
+        Save all strings, including added ones, and rebuild the hash table.
+        """
+        encoded = [string.encode("utf-8") for string in self._added_strings]
+        lengths = np.array([len(string) for string in encoded], dtype=np.int64)
+        all_bytes = np.concatenate([np.asarray(self._bytes),
+                                    np.frombuffer(b"".join(encoded), dtype=np.uint8)])
+        offsets = np.concatenate([np.asarray(self._offsets), self._offsets[-1] + np.cumsum(lengths)])
+        hashes = [zlib.crc32(all_bytes[offsets[idx]:offsets[idx + 1]].tobytes()) for idx in range(len(offsets) - 1)]
+        slots = build_hash_slots(np.array(hashes, dtype=np.int64))
+
+        for filename, array in zip(self.get_filenames(directory, name), (all_bytes, offsets, slots)):
+            # write to a temporary file first because the old arrays may be memory-mapped from the same file
+            np.save(filename + ".tmp.npy", array)
+            os.replace(filename + ".tmp.npy", filename)
+        return self.load(directory, name)
+
+    def load(self, directory, name):
+        filenames = self.get_filenames(directory, name)
+        self._bytes, self._offsets, self._slots = [np.load(filename, mmap_mode="r") for filename in filenames]
+        self._num_loaded = len(self._offsets) - 1
+        self._filenames = (directory, name)
+        self._added = {}
+        self._added_strings = []
+        return self
+
+    def __getstate__(self):
+        # loaded arrays are mapped again instead of being copied to other processes
+        if self._filenames is not None:
+            return {"filenames": self._filenames, "added_strings": self._added_strings}
+        return {"filenames": None, "added_strings": list(self)}
+
+    def __setstate__(self, state):
+        self.__init__()
+        if state["filenames"] is not None:
+            self.load(*state["filenames"])
+        for string in state["added_strings"]:
+            self.add(string)
+
+
+class StringTableIndex(Mapping):
+    """
+    A read-only dict from ids to strings of a :meth:`main.data.StringTable.StringTable`.
+    """
+
+    def __init__(self, string_table):
+        self.string_table = string_table
+
+    def __getitem__(self, idx):
+        return self.string_table.get_string(int(idx))
+
+    def __contains__(self, idx):
+        if not isinstance(idx, (int, np.integer)):
+            return False
+        return 0 <= idx < len(self.string_table)
+
+    def __len__(self):
+        return len(self.string_table)
+
+    def __iter__(self):
+        return iter(range(len(self.string_table)))
+
+
+def build_hash_slots(hashes):
+    """
+    Build an open addressing hash table with linear probing. Ids are inserted in rounds: in each round, every id not
+    inserted yet tries its next slot, and the smallest id wins a free slot.
+
+    :param hashes: [num_strings] the hash of each string
+    :return: [num_slots] the id stored in each slot, or -1
+    """
+    num_slots = 8
+    while num_slots < 2 * len(hashes):
+        num_slots *= 2
+    mask = num_slots - 1
+    slots = np.full(num_slots, -1, dtype=np.int64)
+    ids = np.arange(len(hashes))
+    positions = hashes & mask
+    while len(ids):
+        free = slots[positions] < 0
+        free_positions, first = np.unique(positions[free], return_index=True)
+        slots[free_positions] = ids[free][first]
+        inserted = np.zeros(len(ids), dtype=bool)
+        inserted[np.flatnonzero(free)[first]] = True
+        ids = ids[~inserted]
+        positions = (positions[~inserted] + 1) & mask
+    return slots
+
+
+def load_vocab(vocab_dir, name):
+    """
+    Memory-map the string table of a vocab, or read the json file if the vocab folder does not have string tables.
+
+    :param vocab_dir: a vocab folder written by :meth:`main.features.PathReader.write_cvsm_vocabs`
+    :param name: e.g., "relation_vocab", "entity_vocab", or "entity_type_vocab"
+    :return: a :meth:`main.data.StringTable.StringTable` or a dict from strings to ids
+    """
+    if StringTable.exists(vocab_dir, name):
+        return StringTable().load(vocab_dir, name)
+    with open(os.path.join(vocab_dir, name + ".txt"), "r") as fh:
+        return json.load(fh)
@@ -1,6 +1,15 @@
+import os
+import numpy as np
+
+from main.data.StringTable import StringTable
+
+
 class Vocabs:
     """This class manages the vocabularies of all entites and relations.
 
+    Entities and relations are stored in :meth:`main.data.StringTable`, so saved vocabs are memory-mapped when loaded
+    instead of being rebuilt from relation instances.
+
     :ivar idx_to_node: a dict mapping from an entity index to an entity
     :ivar node_to_idx: a dict mapping from an entity to an entity index
     :ivar idx_to_relation: a dict mapping from a relation index to a relation
@@ -9,10 +18,10 @@ class Vocabs:
     """
 
     def __init__(self):
-        self.idx_to_node = {}
-        self.node_to_idx = {}
-        self.idx_to_relation = {}
-        self.relation_to_idx = {}
+        self.node_to_idx = StringTable()
+        self.idx_to_node = self.node_to_idx.index
+        self.relation_to_idx = StringTable()
+        self.idx_to_relation = self.relation_to_idx.index
         self.idx_to_rev_relation_idx = {}
 
     def build_vocabs(self, typed_relation_instances):
@@ -22,20 +31,78 @@ class Vocabs:
         :type typed_relation_instances: :meth:`main.data.TypedRelationInstances`
         """
         for rel in typed_relation_instances.relation_to_instances:
-            if rel not in self.relation_to_idx:
-                self.relation_to_idx[rel] = len(self.relation_to_idx)
-                self.idx_to_relation[self.relation_to_idx[rel]] = rel
-                rev_rel = "_" + rel
-                self.relation_to_idx[rev_rel] = len(self.relation_to_idx)
-                self.idx_to_relation[self.relation_to_idx[rev_rel]] = rev_rel
+            self.add_relation(rel)
+            for subj, obj, _ in typed_relation_instances.relation_to_instances[rel]:
+                self.add_node(subj)
+                self.add_node(obj)
 
-                self.idx_to_rev_relation_idx[self.relation_to_idx[rel]] = self.relation_to_idx[rev_rel]
-                self.idx_to_rev_relation_idx[self.relation_to_idx[rev_rel]] = self.relation_to_idx[rel]
+    def add_node(self, node):
+        """This function adds an entity if it is not in the vocab, e.g., when relation instances are streamed in.
 
-            for subj, obj, _ in typed_relation_instances.relation_to_instances[rel]:
-                if subj not in self.node_to_idx:
-                    self.node_to_idx[subj] = len(self.node_to_idx)
-                    self.idx_to_node[self.node_to_idx[subj]] = subj
-                if obj not in self.node_to_idx:
-                    self.node_to_idx[obj] = len(self.node_to_idx)
-                    self.idx_to_node[self.node_to_idx[obj]] = obj
\ No newline at end of file
+        :return: the index of the entity
+        """
+        return self.node_to_idx.add(node)
+
+    def add_relation(self, rel):
+        """This function adds a relation and its reverse relation if they are not in the vocab.
+
+        :return: the index of the relation
+        """
+        if rel not in self.relation_to_idx:
+            rel_idx = self.relation_to_idx.add(rel)
+            rev_rel_idx = self.relation_to_idx.add("_" + rel)
+            self.idx_to_rev_relation_idx[rel_idx] = rev_rel_idx
+            self.idx_to_rev_relation_idx[rev_rel_idx] = rel_idx
+        return self.relation_to_idx[rel]
+
+    def save(self, vocab_dir):
+        if not os.path.exists(vocab_dir):
+            os.mkdir(vocab_dir)
+        self.node_to_idx.save(vocab_dir, "nodes")
+        self.relation_to_idx.save(vocab_dir, "relations")
+        rev_relations = np.array([self.idx_to_rev_relation_idx[idx] for idx in range(len(self.relation_to_idx))],
+                                 dtype=np.int64)
+        np.save(os.path.join(vocab_dir, "rev_relations.npy"), rev_relations)
+
+    def load(self, vocab_dir):
+        self.node_to_idx.load(vocab_dir, "nodes")
+        self.relation_to_idx.load(vocab_dir, "relations")
+        rev_relations = np.load(os.path.join(vocab_dir, "rev_relations.npy"))
+        self.idx_to_rev_relation_idx = dict(enumerate(rev_relations.tolist()))
+        return self
+
+    def to_dicts(self):
+        """This function decodes the string tables into plain dicts, which are about ten times faster to look up than
+        the memory-mapped tables. It is used by loops that look up every entity, e.g., building the graph and extracting
+        paths. Entities and relations can not be added to the returned vocabs.
+
+        :return: :meth:`main.data.Vocabs` whose mappings are dicts
+        """
+        if not isinstance(self.node_to_idx, StringTable):
+            return self
+        vocabs = Vocabs()
+        nodes = self.node_to_idx.to_list()
+        relations = self.relation_to_idx.to_list()
+        vocabs.node_to_idx = {node: idx for idx, node in enumerate(nodes)}
+        vocabs.idx_to_node = dict(enumerate(nodes))
+        vocabs.relation_to_idx = {rel: idx for idx, rel in enumerate(relations)}
+        vocabs.idx_to_relation = dict(enumerate(relations))
+        vocabs.idx_to_rev_relation_idx = self.idx_to_rev_relation_idx
+        return vocabs
+
+
+def load_or_build_vocabs(vocab_dir, typed_relation_instances):
+    """
+    Load vocabs saved in a folder, or build vocabs from relation instances and save them.
+
+    :param vocab_dir:
+    :param typed_relation_instances: :meth:`main.data.TypedRelationInstances`
+    :return: :meth:`main.data.Vocabs`
+    """
+    vocabs = Vocabs()
+    if StringTable.exists(vocab_dir, "nodes"):
+        print("Loading vocabs from", vocab_dir)
+        return vocabs.load(vocab_dir)
+    vocabs.build_vocabs(typed_relation_instances)
+    vocabs.save(vocab_dir)
+    return vocabs
@@ -0,0 +1,28 @@
+import unittest
+import tempfile
+import shutil
+from main.data.EntityTypeTable import EntityTypeTable
+
+
+class TestEntityTypeTable(unittest.TestCase):
+    def setUp(self):
+        self.entity_vocab = {"a": 0, "b": 1, "c": 2, "#PAD_TOKEN": 3}
+        self.entity_type_vocab = {"t0": 0, "t1": 1, "t2": 2, "#PAD_TOKEN": 3}
+        self.entity_to_list_type = {"a": ["t2", "t0"], "b": ["t1", "t2", "t0"], "d": ["t1"]}
+
+    def test_get_rows(self):
+        table = EntityTypeTable().build(self.entity_vocab, self.entity_type_vocab, self.entity_to_list_type)
+        rows = table.get_rows(2)
+        self.assertEqual(rows.shape, (6, 2))
+        self.assertEqual(rows[:4].tolist(), [[2, 0], [1, 0], [3, 3], [3, 3]])
+        self.assertEqual(rows[table.get_row("d", self.entity_vocab)].tolist(), [1, 3])
+        self.assertEqual(rows[table.get_row("e", self.entity_vocab)].tolist(), [3, 3])
+
+    def test_save_and_load(self):
+        vocab_dir = tempfile.mkdtemp()
+        table = EntityTypeTable().build(self.entity_vocab, self.entity_type_vocab, self.entity_to_list_type)
+        table.save(vocab_dir)
+        loaded = EntityTypeTable().load(vocab_dir)
+        shutil.rmtree(vocab_dir)
+        self.assertEqual(loaded.entity_to_row, table.entity_to_row)
+        self.assertEqual(loaded.get_rows(4).tolist(), table.get_rows(4).tolist())
@@ -0,0 +1,72 @@
+import unittest
+import shutil
+import os
+import pickle
+from main.data.StringTable import StringTable
+from main.data.Vocabs import Vocabs
+from main.data.TypedRelationInstances import TypedRelationInstances
+
+
+class StringTableTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = "test_data"
+        os.mkdir(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_load_and_add(self):
+        strings = ["object:bowl.n.01", "location:bowl.n.01", "#PAD_TOKEN", "café"] + [str(i) for i in range(100)]
+        table = StringTable(strings)
+        table.save(self.dir, "vocab")
+
+        table = StringTable().load(self.dir, "vocab")
+        assert len(table) == len(strings)
+        for idx, string in enumerate(strings):
+            assert table[string] == idx
+            assert table.index[idx] == string
+        assert "location:cup.n.01" not in table
+        with self.assertRaises(KeyError):
+            table["location:cup.n.01"]
+
+        # strings added after loading are kept after saving again
+        assert table.add("location:cup.n.01") == len(strings)
+        assert table.add("#PAD_TOKEN") == 2
+        assert table.index[len(strings)] == "location:cup.n.01"
+        table.save(self.dir, "vocab")
+        table = pickle.loads(pickle.dumps(StringTable().load(self.dir, "vocab")))
+        assert table["location:cup.n.01"] == len(strings)
+        assert list(table) == strings + ["location:cup.n.01"]
+
+    def test_vocabs(self):
+        typed_relation_instances = TypedRelationInstances()
+        typed_relation_instances.relation_to_instances["in"] = [("object:bowl", "location:table", 1),
+                                                                ("object:cup", "location:table", 1)]
+        typed_relation_instances.relation_to_instances["made_of"] = [("object:cup", "material:glass", 1)]
+        vocabs = Vocabs()
+        vocabs.build_vocabs(typed_relation_instances)
+        vocabs.save(self.dir)
+
+        loaded_vocabs = Vocabs().load(self.dir)
+        assert loaded_vocabs.node_to_idx.copy() == {"object:bowl": 0, "location:table": 1, "object:cup": 2,
+                                                    "material:glass": 3}
+        assert loaded_vocabs.relation_to_idx.copy() == {"in": 0, "_in": 1, "made_of": 2, "_made_of": 3}
+        assert loaded_vocabs.idx_to_rev_relation_idx == vocabs.idx_to_rev_relation_idx
+        assert loaded_vocabs.idx_to_relation[3] == "_made_of"
+
+        # lookups of the plain dicts are the same as the string tables
+        dict_vocabs = loaded_vocabs.to_dicts()
+        assert dict_vocabs.node_to_idx == loaded_vocabs.node_to_idx.copy()
+        assert dict_vocabs.idx_to_node == {idx: node for node, idx in dict_vocabs.node_to_idx.items()}
+        assert dict_vocabs.relation_to_idx["_made_of"] == 3
+        assert dict_vocabs.idx_to_relation[3] == "_made_of"
+        assert dict_vocabs.idx_to_rev_relation_idx == vocabs.idx_to_rev_relation_idx
+
+    def test_from_dict_and_index(self):
+        table = StringTable.from_dict({"b": 1, "a": 0})
+        assert list(table) == ["a", "b"]
+        with self.assertRaisesRegex(Exception, "Ids of c and others are not consecutive from 0"):
+            StringTable.from_dict({"a": 0, "c": 2})
+        assert 1 in table.index
+        assert 2 not in table.index
+        assert "a" not in table.index
@@ -35,7 +35,7 @@ class CVSMDriver:
 
     """
     def __init__(self, experiment_dir, cvsm_run_dir, dataset, include_entity=False, has_entity=False, augment_data=False,
-                 include_entity_type=False):
+                 include_entity_type=False, num_types=None):
         """
         Init
 
@@ -47,6 +47,8 @@ class CVSMDriver:
         :param augment_data: whether input path data are augmented. Also see :meth:`main.features.PathExtractor` for
                              more details about data augmentation.
         :param include_entity_type: whether to use entity type information
+        :param num_types: the number of entity types of each entity, used for relations whose statistics.json does not
+                          record the number of type slots. If not provided, values measured on each dataset are used.
         """
         # dirs
         self.experiment_dir = experiment_dir
@@ -64,15 +66,9 @@ class CVSMDriver:
         self.augment_data = augment_data
         assert dataset == "wordnet" or dataset == "robot" or dataset == "freebase" or dataset == "fbclueweb"
 
-        # ToDo: let the reader for the raw data create this param instead of specify it manually here
-        if dataset == "wordnet":
-            self.num_types = 14
-        elif dataset == "robot":
-            self.num_types = 10
-        elif dataset == "freebase":
-            self.num_types = 7
-        elif dataset == "fbclueweb":
-            self.num_types = 8
+        self.num_types = num_types
+        if self.num_types is None:
+            self.num_types = self.get_num_types(dataset)
 
         self.relation_vocab_size = 0
         self.entity_vocab_size = 0
@@ -81,6 +77,37 @@ class CVSMDriver:
             self.relation_vocab_size = 51390
             self.entity_vocab_size = 1542690
 
+    @staticmethod
+    def get_num_types(dataset):
+        """
+        :param dataset:
+        :return: the number of entity types measured on the dataset
+        """
+        if dataset == "wordnet":
+            return 14
+        elif dataset == "robot":
+            return 10
+        elif dataset == "freebase":
+            return 7
+        elif dataset == "fbclueweb":
+            return 8
+
+    def get_num_types_of_relation(self, rel_dir):
+        """
+        The number of type slots of a relation is chosen when its paths are vectorized (see
+        :meth:`main.playground.make_data_format.vectorize_relation`) and recorded in its statistics.json.
+
+        :param rel_dir: the data output folder of a relation
+        :return: the number of type slots of the vectorized paths, or num_types if it is not recorded
+        """
+        statistics_filename = os.path.join(rel_dir, "statistics.json")
+        if os.path.exists(statistics_filename):
+            with open(statistics_filename, "r") as fh:
+                statistics = json.load(fh)
+            if statistics.get("num_entity_types_slots") is not None:
+                return statistics["num_entity_types_slots"]
+        return self.num_types
+
     def setup_cvsm_dir(self):
         """
         This function is used to set up cvsm directory in the data folder. This uses a path reader to help read paths
@@ -273,6 +300,7 @@ class CVSMDriver:
             rel = cvsm_side_rel_dir.split("/")[-1]
             print("\n\n" + "#" * 200)
             print("Run CVSM model for relation", rel)
+            num_types = self.get_num_types_of_relation(os.path.join(cvsm_side_data_output_dir, cvsm_side_rel_dir))
 
             # a. modify train configs for training this relation
             cvsm_side_model_dir = os.path.join(run_wkdir,
@@ -311,11 +339,11 @@ class CVSMDriver:
                             elif "includeEntityTypes" in line:
                                 new_line = "includeEntityTypes=" + str(int(self.include_entity_type)) + "\n"
                             elif "numEntityTypes" in line:
-                                new_line = "numEntityTypes=" + str(self.num_types) + "\n"
+                                new_line = "numEntityTypes=" + str(num_types) + "\n"
                             elif "includeEntity" in line:
                                 new_line = "includeEntity=" + str(int(self.include_entity)) + "\n"
                             elif "numFeatureTemplates" in line:
-                                new_line = "numFeatureTemplates=" + str(2 + self.num_types) + "\n"
+                                new_line = "numFeatureTemplates=" + str(2 + num_types) + "\n"
                             elif "relationVocabSize" in line:
                                 # +1 for PAD_TOKEN, +1 for END_RELATION
                                 new_line = "relationVocabSize=" + str(self.relation_vocab_size + 2) + "\n"
@@ -86,6 +86,8 @@ class PathExtractor:
         :param vocabs: :meth:`main.data.Vocabs`
         :return:
         """
+        # entities and relations of every path are looked up, so the string tables are decoded once
+        vocabs = vocabs.to_dicts()
         for rel in split.relation_to_splits_to_instances:
             self.relation_to_path_types[rel] = set()
             self.relation_to_pairs_to_paths[rel] = {}
@@ -4,6 +4,9 @@ import collections
 import json
 import shutil
 
+from main.data.EntityTypeTable import EntityTypeTable
+from main.data.StringTable import StringTable
+
 
 class PathReader:
     def __init__(self, save_dir):
@@ -140,71 +143,7 @@ class PathReader:
 
         ####################################################################
         # 1. vocabs
-        # Important: CVSM expects vocab files to end with .gz
-        # 1.1. domain-label file. CVSM uses 0 and 1. We uses -1 and 1.
-        print("Write domain label file")
-        domain_label = {"domain":{"1":1, "-1":0}, "name":"label"}
-        domain_label_filename = os.path.join(vocab_dir, "domain-label")
-        with open(domain_label_filename, "w+") as fh:
-            json.dump(domain_label, fh)
-
-        # 1.2. relation_vocab.txt file
-        print("Write relation vocab file")
-        relation_vocab_filename = os.path.join(vocab_dir, "relation_vocab.txt")
-        # we can use vocabs.relation_to_idx, but we need to add #PAD_TOKEN to the dictionary
-        relation_vocab = vocabs.relation_to_idx.copy()
-        relation_vocab["#PAD_TOKEN"] = len(relation_vocab)
-        relation_vocab["#END_RELATION"] = len(relation_vocab)
-        with open(relation_vocab_filename, "w+") as fh:
-            json.dump(relation_vocab, fh)
-
-        # 1.3. entity_vocab.txt file
-        print("Write entity vocab file")
-        entity_vocab_filename = os.path.join(vocab_dir, "entity_vocab.txt")
-        # we can use vocabs.relation_to_idx, but we need to add #PAD_TOKEN to the dictionary
-        entity_vocab = vocabs.node_to_idx.copy()
-        entity_vocab["#PAD_TOKEN"] = len(entity_vocab)
-        with open(entity_vocab_filename, "w+") as fh:
-            json.dump(entity_vocab, fh)
-
-        # 1.4. entity_to_list_type.json file and entity_type_vocab.txt
-        # Important: entity2types are mapping entities with no type information (e.g., lid.n.02 instead of
-        #            object:lid.n.02) to type hiearchies. entity_to_list_type needs to be a map from entities with type
-        #            information to type hierarchies.
-        print("Writing entity to types file and entity type vocab file")
-        entity_to_list_type_filename = os.path.join(vocab_dir, "entity_to_list_type.json")
-        entity_type_vocab_filename = os.path.join(vocab_dir, "entity_type_vocab.txt")
-
-        # read entity2types
-        with open(entity2types_filename, "r") as fh:
-            entity2types = json.load(fh)
-        # we are going to use entity2types to generate entity_type_vocab and entity_to_list_type
-        entity_type_vocab = {}
-        entity_to_list_type = {}
-        for entity in entity2types:
-            types = entity2types[entity]
-            # a. construct type vocab
-            for type in types:
-                if type not in entity_type_vocab:
-                    entity_type_vocab[type] = len(entity_type_vocab)
-
-            # b. write entity to list of types
-            # Important: Because entity2types contain maps from entity (not typed) to its type hierarchies, we need to
-            #            find all typed entities that can use type hierarchies. For example, entity2types contain type
-            #            hierarchies for bowl, we need to write the type hierarchies to object:bowl and location:bowl in
-            #            entity_to_list_type.
-            typed_entities = []
-            for typed_entity in vocabs.node_to_idx:
-                if ":".join(typed_entity.split(":")[1:]) == entity:
-                    typed_entities.append(typed_entity)
-            for typed_entity in typed_entities:
-                entity_to_list_type[typed_entity] = types
-
-        entity_type_vocab["#PAD_TOKEN"] = len(entity_type_vocab)
-        with open(entity_type_vocab_filename, "w+") as fh:
-            json.dump(entity_type_vocab, fh)
-        with open(entity_to_list_type_filename, "w+") as fh:
-            json.dump(entity_to_list_type, fh)
+        write_cvsm_vocabs(vocab_dir, vocabs, entity2types_filename)
 
         ####################################################################
         # 2. Paths
@@ -297,6 +236,92 @@ class PathReader:
                                     fh.write(subj + "\t" + obj + "\t" + paths_str + "\t" + str(label) + "\n")
 
 
+def write_cvsm_vocabs(vocab_dir, vocabs, entity2types_filename):
+    """
+    Write vocabs in the cvsm format, i.e., domain-label, relation_vocab.txt, entity_vocab.txt,
+    entity_to_list_type.json, entity_type_vocab.txt, string tables of the vocabs, and entity_types.npz.
+
+    :param vocab_dir:
+    :param vocabs: :meth:`main.data.Vocabs`
+    :param entity2types_filename: a json file mapping from entities (without type prefixes) to type hierarchies
+    :return:
+    """
+    # Important: CVSM expects vocab files to end with .gz
+    # 1.1. domain-label file. CVSM uses 0 and 1. We uses -1 and 1.
+    print("Write domain label file")
+    domain_label = {"domain":{"1":1, "-1":0}, "name":"label"}
+    domain_label_filename = os.path.join(vocab_dir, "domain-label")
+    with open(domain_label_filename, "w+") as fh:
+        json.dump(domain_label, fh)
+
+    # 1.2. relation_vocab.txt file
+    print("Write relation vocab file")
+    relation_vocab_filename = os.path.join(vocab_dir, "relation_vocab.txt")
+    # we can use vocabs.relation_to_idx, but we need to add #PAD_TOKEN to the dictionary
+    relation_vocab = vocabs.relation_to_idx.copy()
+    relation_vocab["#PAD_TOKEN"] = len(relation_vocab)
+    relation_vocab["#END_RELATION"] = len(relation_vocab)
+    with open(relation_vocab_filename, "w+") as fh:
+        json.dump(relation_vocab, fh)
+
+    # 1.3. entity_vocab.txt file
+    print("Write entity vocab file")
+    entity_vocab_filename = os.path.join(vocab_dir, "entity_vocab.txt")
+    # we can use vocabs.relation_to_idx, but we need to add #PAD_TOKEN to the dictionary
+    entity_vocab = vocabs.node_to_idx.copy()
+    entity_vocab["#PAD_TOKEN"] = len(entity_vocab)
+    with open(entity_vocab_filename, "w+") as fh:
+        json.dump(entity_vocab, fh)
+
+    # 1.4. entity_to_list_type.json file and entity_type_vocab.txt
+    # Important: entity2types are mapping entities with no type information (e.g., lid.n.02 instead of
+    #            object:lid.n.02) to type hiearchies. entity_to_list_type needs to be a map from entities with type
+    #            information to type hierarchies.
+    print("Writing entity to types file and entity type vocab file")
+    entity_to_list_type_filename = os.path.join(vocab_dir, "entity_to_list_type.json")
+    entity_type_vocab_filename = os.path.join(vocab_dir, "entity_type_vocab.txt")
+
+    # read entity2types
+    with open(entity2types_filename, "r") as fh:
+        entity2types = json.load(fh)
+    # we are going to use entity2types to generate entity_type_vocab and entity_to_list_type
+    entity_type_vocab = {}
+    entity_to_list_type = {}
+    untyped_to_typed_entities = {}
+    for typed_entity in vocabs.node_to_idx:
+        untyped_to_typed_entities.setdefault(":".join(typed_entity.split(":")[1:]), []).append(typed_entity)
+    for entity in entity2types:
+        types = entity2types[entity]
+        # a. construct type vocab
+        for type in types:
+            if type not in entity_type_vocab:
+                entity_type_vocab[type] = len(entity_type_vocab)
+
+        # b. write entity to list of types
+        # Important: Because entity2types contain maps from entity (not typed) to its type hierarchies, we need to
+        #            find all typed entities that can use type hierarchies. For example, entity2types contain type
+        #            hierarchies for bowl, we need to write the type hierarchies to object:bowl and location:bowl in
+        #            entity_to_list_type.
+        for typed_entity in untyped_to_typed_entities.get(entity, []):
+            entity_to_list_type[typed_entity] = types
+
+    entity_type_vocab["#PAD_TOKEN"] = len(entity_type_vocab)
+    with open(entity_type_vocab_filename, "w+") as fh:
+        json.dump(entity_type_vocab, fh)
+    with open(entity_to_list_type_filename, "w+") as fh:
+        json.dump(entity_to_list_type, fh)
+
+    # 1.5. string tables of vocabs, which are memory-mapped by the model instead of loading the json files
+    for name, vocab in [("relation_vocab", relation_vocab), ("entity_vocab", entity_vocab),
+                        ("entity_type_vocab", entity_type_vocab)]:
+        StringTable.from_dict(vocab).save(vocab_dir, name)
+
+    # 1.6. entity_types.npz file
+    # Important: type ids of each entity are stored once here and reused for vectorizing paths and by the model.
+    print("Write entity type table")
+    EntityTypeTable().build(entity_vocab, entity_type_vocab, entity_to_list_type).save(vocab_dir)
+
+
 def compare_path_readers(path_reader1, path_reader2):
     print("Compare paths")
     pairs = set()
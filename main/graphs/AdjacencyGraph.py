@@ -30,6 +30,8 @@ class AdjacencyGraph:
         :param vocabs: :meth:`main.data.Vocabs`
         :return:
         """
+        # every entity is looked up, so the string tables are decoded once
+        vocabs = vocabs.to_dicts()
         for rel in typed_relation_instances.relation_to_instances:
             for subj, obj, label in typed_relation_instances.relation_to_instances[rel]:
                 if label == 1:
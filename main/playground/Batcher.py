@@ -1,11 +1,24 @@
 import torch
+import numpy as np
+
+from main.playground.PathEncoder import SHARD_INDEX_SUFFIX, read_shard
 
 
 class Batcher:
-    def __init__(self, filename, batch_size, shuffle):
+    def __init__(self, filename, batch_size, shuffle, group=0):
+        """
+        :param filename: a .int file, a .npz file, or the index file of a shard
+        :param batch_size:
+        :param shuffle:
+        :param group: the group of entity pairs with the same number of paths to read from a shard
+        """
         self.labels = None
         self.inputs = None
-        self.read_data(filename)
+        # [number_entity_pairs, number_of_paths] the number of real steps of each path. Not stored in .int files.
+        self.lengths = None
+        # the order entity pairs are batched in if shuffled
+        self.indices = None
+        self.read_data(filename, group)
         self.number_entity_pairs, self.number_of_paths, self.path_length, self.feature_size = self.inputs.shape
 
         self.shuffle = shuffle
@@ -18,7 +31,21 @@ class Batcher:
         # used to point to the current entity pair
         self.current_index = 0
 
-    def read_data(self, filename):
+    def read_data(self, filename, group=0):
+        if filename.endswith(SHARD_INDEX_SUFFIX):
+            # shards are memory-mapped, so only the entity pairs of each batch are read
+            labels, inputs, lengths = read_shard(filename, group)
+            self.inputs = torch.from_numpy(inputs)
+            self.labels = torch.from_numpy(labels)
+            self.lengths = torch.from_numpy(lengths)
+            return
+        if filename.endswith(".npz"):
+            # arrays written by make_data_format.process_extracted_paths() do not need to be parsed
+            with np.load(filename) as data:
+                self.inputs = torch.from_numpy(data["inputs"]).long()
+                self.labels = torch.from_numpy(data["labels"]).float()
+                self.lengths = torch.from_numpy(data["lengths"])
+            return
         with open(filename, "r") as fh:
             inputs = []
             labels = []
@@ -47,19 +74,24 @@ class Batcher:
 
     def shuffle_data(self):
         # only long type or byte type tensor can be used for index
-        indices = torch.randperm(self.number_entity_pairs).long()
-        self.inputs = self.inputs[indices]
-        self.labels = self.labels[indices]
+        # data is not permuted in place because memory-mapped data would be read and copied entirely
+        self.indices = torch.randperm(self.number_entity_pairs).long()
 
     def get_batch(self):
         start_index = self.current_index
         if start_index >= self.number_entity_pairs:
             return None
         end_index = min(start_index+self.batch_size-1, self.number_entity_pairs-1)
-        batch_inputs = self.inputs[start_index:end_index+1]
-        batch_labels = self.labels[start_index:end_index+1]
+        if self.indices is None:
+            batch_inputs = self.inputs[start_index:end_index+1]
+            batch_labels = self.labels[start_index:end_index+1]
+        else:
+            batch_indices = self.indices[start_index:end_index+1]
+            batch_inputs = self.inputs[batch_indices]
+            batch_labels = self.labels[batch_indices]
         self.current_index = end_index + 1
-        return batch_inputs, batch_labels
+        # shards store features with the smallest integer type
+        return batch_inputs.long(), batch_labels.float()
 
     def reset(self):
         self.current_index = 0
@@ -69,6 +101,40 @@ class Batcher:
     def get_size(self):
         return self.number_entity_pairs, self.number_of_paths, self.path_length, self.feature_size
 
+    @staticmethod
+    def read_size(filename, group=0):
+        """
+        Read the size of a file without loading its data, e.g., to allocate space before the file is loaded.
+
+        :param filename: a .int file, a .npz file, or the index file of a shard
+        :param group: the group of entity pairs to read from a shard
+        :return: number_entity_pairs, number_of_paths, path_length, feature_size
+        """
+        if filename.endswith(SHARD_INDEX_SUFFIX):
+            return read_shard(filename, group)[1].shape
+        if filename.endswith(".npz"):
+            with np.load(filename) as data:
+                with data.zip.open("inputs.npy") as fh:
+                    version = np.lib.format.read_magic(fh)
+                    if version == (1, 0):
+                        shape, _, _ = np.lib.format.read_array_header_1_0(fh)
+                    else:
+                        shape, _, _ = np.lib.format.read_array_header_2_0(fh)
+            return shape
+        # only the first entity pair is parsed. All entity pairs in a .int file have the same number of paths.
+        number_entity_pairs = 0
+        first_line = None
+        with open(filename, "r") as fh:
+            for line in fh:
+                line = line.strip()
+                if len(line) != 0:
+                    number_entity_pairs += 1
+                    if first_line is None:
+                        first_line = line
+        paths = first_line.split("\t")[1].split(";")
+        steps = paths[0].split(" ")
+        return number_entity_pairs, len(paths), len(steps), len(steps[0].split(","))
+
 
 if __name__ == "__main__":
     batcher = Batcher("/home/weiyu/Research/ChainsOfReasoningWithAbstractEntities/data/_architecture_structure_address/train/train.txt.2.int", 3, False)
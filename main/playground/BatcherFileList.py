@@ -1,16 +1,40 @@
 from main.playground.Batcher import Batcher
+from main.playground.PathEncoder import SHARD_INDEX_SUFFIX
+from main.playground.device import get_device
 import torch
+import numpy as np
 import os
+import math
+from concurrent.futures import ThreadPoolExecutor
 
 # Debug: Not finished
 
 class BatcherFileList:
-    def __init__(self, data_dir, batch_size, shuffle, max_number_batchers_on_gpu):
+    def __init__(self, data_dir, batch_size, shuffle, max_number_batchers_on_gpu, device=None, lazy=False):
+        """
+        :param data_dir: a folder of .int files, .npz files, or shards
+        :param batch_size:
+        :param shuffle:
+        :param max_number_batchers_on_gpu: the size of the window of batchers whose batches are staged on the device
+        :param device: the device batches are staged on. Default uses the gpu if available.
+        :param lazy: if true, only files of batchers in the current window are loaded. Batchers are evicted when the
+                     window moves on, and files of the next window are read in a background thread, so memory is
+                     bounded by two windows instead of the whole split.
+        """
         self.do_shuffle = shuffle
         self.batch_size = batch_size
+        # batches are staged on this device, which is the gpu unless specified
+        self.device = get_device(device)
+        self.lazy = lazy
 
-        # batchers store all batchers
+        # sources store (filename, group) of all batchers and sizes store their sizes, in the same order as batchers
+        self.sources = []
+        self.sizes = []
+        # batchers store all batchers. In lazy mode, batchers not loaded are None.
         self.batchers = []
+        # futures of batchers of the next window being loaded in the background, by their sources
+        self.read_ahead = {}
+        self.executor = ThreadPoolExecutor(max_workers=1) if lazy else None
         self.initialize_batchers(data_dir)
         self.number_batchers_on_gpu = min(max_number_batchers_on_gpu, len(self.batchers))
         if self.do_shuffle:
@@ -26,9 +50,55 @@ class BatcherFileList:
 
     def initialize_batchers(self, data_dir):
         print("Reading files from", data_dir)
-        for file in os.listdir(data_dir):
-            if file[-3:] == "int":
-                self.batchers.append(Batcher(os.path.join(data_dir, file), self.batch_size, self.do_shuffle))
+        files = os.listdir(data_dir)
+        shard_index_files = [file for file in files if file.endswith(SHARD_INDEX_SUFFIX)]
+        if shard_index_files:
+            # shards converted from .int files replace them
+            for file in shard_index_files:
+                filename = os.path.join(data_dir, file)
+                for group in range(len(np.load(filename)) - 1):
+                    self.sources.append((filename, group))
+        else:
+            for file in files:
+                if file[-3:] == "int" or file[-3:] == "npz":
+                    self.sources.append((os.path.join(data_dir, file), 0))
+
+        for source in self.sources:
+            if self.lazy:
+                self.sizes.append(Batcher.read_size(*source))
+                self.batchers.append(None)
+            else:
+                batcher = self.load_batcher(source)
+                self.sizes.append(batcher.get_size())
+                self.batchers.append(batcher)
+
+    def load_batcher(self, source):
+        filename, group = source
+        return Batcher(filename, self.batch_size, self.do_shuffle, group)
+
+    def load_window(self):
+        """
+        Load batchers in the current window, evict the others, and start reading batchers of the next window in the
+        background.
+        """
+        window = range(self.current_index, min(self.current_index + self.number_batchers_on_gpu, len(self.batchers)))
+        next_window = range(window.stop, min(window.stop + self.number_batchers_on_gpu, len(self.batchers)))
+        for i in range(len(self.batchers)):
+            if i not in window:
+                self.batchers[i] = None
+        for i in window:
+            if self.batchers[i] is None:
+                future = self.read_ahead.pop(self.sources[i], None)
+                self.batchers[i] = future.result() if future is not None else self.load_batcher(self.sources[i])
+
+        next_sources = [self.sources[i] for i in next_window]
+        # batchers read ahead for another order of batchers (e.g., before the batchers are shuffled) are dropped
+        for source in list(self.read_ahead):
+            if source not in next_sources:
+                self.read_ahead.pop(source).cancel()
+        for source in next_sources:
+            if source not in self.read_ahead:
+                self.read_ahead[source] = self.executor.submit(self.load_batcher, source)
 
     def preallocate_gpu(self):
         """
@@ -38,16 +108,18 @@ class BatcherFileList:
         """
         self.gpu_labels = []
         self.gpu_inputs = []
+        if self.lazy:
+            self.load_window()
         # Important: min(self.current_index + self.number_batchers_on_gpu, len(self.batchers)) is used to deal with
         #            the last group of batchers that may be less than number_batchers_on_gpu.
         #            e.g., for example, when we have 100 batchers, the number_batchers_on_gpu is 30, we need to deal
         #            the last 10 batchers.
         for i in range(self.current_index, min(self.current_index + self.number_batchers_on_gpu, len(self.batchers))):
-            batcher = self.batchers[i]
-            number_entity_pairs, number_of_paths, path_length, feature_size = batcher.get_size()
-            # here we create gpu tensors of specified dimensions
-            self.gpu_inputs.append(torch.cuda.LongTensor(self.batch_size, number_of_paths, path_length, feature_size))
-            self.gpu_labels.append(torch.cuda.FloatTensor(self.batch_size, 1))
+            number_entity_pairs, number_of_paths, path_length, feature_size = self.sizes[i]
+            # here we create device tensors of specified dimensions
+            self.gpu_inputs.append(torch.empty(self.batch_size, number_of_paths, path_length, feature_size,
+                                               dtype=torch.long, device=self.device))
+            self.gpu_labels.append(torch.empty(self.batch_size, 1, device=self.device))
         self.populate_gpu()
 
     def populate_gpu(self):
@@ -69,10 +141,10 @@ class BatcherFileList:
             self.gpu_labels[i % self.number_batchers_on_gpu].resize_(labels.shape).copy_(labels)
 
     def shuffle_batchers(self):
-        shuffled_batchers = []
-        for i in torch.randperm(len(self.batchers)):
-            shuffled_batchers.append(self.batchers[i])
-        self.batchers = shuffled_batchers
+        order = torch.randperm(len(self.batchers)).tolist()
+        self.batchers = [self.batchers[i] for i in order]
+        self.sources = [self.sources[i] for i in order]
+        self.sizes = [self.sizes[i] for i in order]
 
     def get_batch(self):
         # Important: the outer loop is to iterate through all data.
@@ -92,10 +164,11 @@ class BatcherFileList:
                     self.current_gpu_index += 1
                     continue
 
-                # return the content from the current batcher
+                # return the content from the current batcher. All paths are real, so there is no path mask, and path
+                # lengths are not read.
                 inputs, labels = self.gpu_inputs[self.current_gpu_index], self.gpu_labels[self.current_gpu_index]
                 self.current_gpu_index += 1
-                return inputs, labels
+                return inputs, labels, None, None
             # batchers on gpu has all been used up
             if len(self.empty_batcher_indices) < len(self.batchers):
                 self.current_index = self.current_index + self.number_batchers_on_gpu
@@ -105,6 +178,22 @@ class BatcherFileList:
         self.reset()
         return None
 
+    def __len__(self):
+        """
+        :return: the number of batches in an epoch, computed from the sizes of all batchers
+        """
+        return sum(math.ceil(size[0] / self.batch_size) for size in self.sizes)
+
+    def __iter__(self):
+        """
+        Iterate through the remaining batches of the current epoch. The batcher list is reset at the end.
+        """
+        while True:
+            data = self.get_batch()
+            if data is None:
+                return
+            yield data
+
     def reset(self):
         self.current_index = 0
         self.current_gpu_index = 0
@@ -112,5 +201,20 @@ class BatcherFileList:
         if self.do_shuffle:
             self.shuffle_batchers()
         for batcher in self.batchers:
-            batcher.reset()
-        self.preallocate_gpu()
\ No newline at end of file
+            if batcher is not None:
+                batcher.reset()
+        self.preallocate_gpu()
+
+    def close(self):
+        """
+        Release the preallocated gpu tensors, and in lazy mode, stop reading ahead and evict all batchers.
+        """
+        self.gpu_inputs = []
+        self.gpu_labels = []
+        if self.lazy:
+            # files not being read yet are not read
+            for future in self.read_ahead.values():
+                future.cancel()
+            self.executor.shutdown(wait=True)
+            self.read_ahead = {}
+            self.batchers = [None] * len(self.batchers)
@@ -0,0 +1,359 @@
+from main.playground.Batcher import Batcher
+from main.playground.PathEncoder import SHARD_INDEX_SUFFIX, read_pre_padding
+from main.playground.device import get_device
+import torch
+import numpy as np
+import os
+import time
+import queue
+import threading
+
+
+class BucketBatcher:
+    """
+    This class batches entity pairs with different numbers of paths together. Files of a split have one group of
+    entity pairs for each number of paths. Groups are merged into a few buckets with similar numbers of entity pairs,
+    and paths of entity pairs in a batch are padded to the largest number of paths in their bucket. Padded paths copy
+    the first path of the entity pair and are excluded by a path mask, which the model uses in pooling.
+
+    Compared with :meth:`main.playground.BatcherFileList`, all batches except the last batch of each bucket have
+    batch_size entity pairs.
+
+    If path lengths are stored (.npz files and shards), entity pairs in each bucket are also sorted by their longest
+    paths and the steps of each batch are trimmed to its longest path, so the model does not run on steps that are
+    padding in every path of the batch. Batches then also have the length of each path, so that the model can skip
+    padded steps of shorter paths, see :meth:`main.playground.model2.CompositionalVectorSpaceModel`.
+
+    Batches are assembled by a background thread while the model computes, and up to queue_depth batches wait in a
+    queue. When batches go to a GPU, they are assembled in pinned memory and copied asynchronously. If assembling a
+    batch fails, get_batch() raises the error on this and every later call until the batcher is reset.
+
+    If max_path_steps is given, batches are formed against a budget of path steps (entity pairs x padded paths x steps)
+    instead of a fixed number of entity pairs, so that batches of pairs with few short paths are larger than batches
+    of pairs with many long paths. batch_size then bounds the number of entity pairs in a batch.
+
+    For data parallel training, each of world_size processes creates a batcher with its rank. All batchers shuffle with
+    the same seed, and each rank gets every world_size-th batch of the epoch, so ranks have disjoint batches and their
+    numbers of batches differ by at most one.
+
+    :ivar data_wait_time: seconds get_batch() waited for the background thread in the current epoch
+    """
+
+    def __init__(self, data_dir, batch_size, shuffle, number_of_buckets=4, trim_steps=True, pre_padding=None,
+                 queue_depth=4, device=None, max_path_steps=None, rank=0, world_size=1, seed=0):
+        """
+        :param data_dir: a folder of .int files, .npz files, or shards
+        :param batch_size:
+        :param shuffle: whether shuffle entity pairs in each bucket and the order of batches
+        :param number_of_buckets: the max number of buckets
+        :param trim_steps: whether sort entity pairs by their longest paths and trim steps of each batch
+        :param pre_padding: whether paths are pre-padded, i.e., padding steps are trimmed from the front. If None, it is
+                            read from statistics.json of the relation (the parent folder of data_dir).
+        :param queue_depth: the max number of batches assembled ahead. If 0, batches are assembled in get_batch().
+        :param device: the device batches are moved to. Default uses the gpu if available.
+        :param max_path_steps: the max number of path steps in a batch. A pair with more path steps is batched alone.
+                               If None, batches have batch_size entity pairs.
+        :param rank: the rank of this process in data parallel training
+        :param world_size: the number of processes in data parallel training
+        :param seed: the seed of shuffling shared by all ranks. Only used if world_size is greater than 1.
+        """
+        self.batch_size = batch_size
+        self.max_path_steps = max_path_steps
+        self.do_shuffle = shuffle
+        self.queue_depth = queue_depth
+        self.device = get_device(device)
+        self.pin_memory = self.device.type == "cuda"
+        self.rank = rank
+        self.world_size = world_size
+        # all ranks draw the same permutations, so that they agree on the batches of every epoch
+        self.generator = None
+        if world_size > 1:
+            self.generator = torch.Generator()
+            self.generator.manual_seed(seed)
+
+        # each group is a batcher for all entity pairs with the same number of paths
+        self.groups = []
+        self.initialize_groups(data_dir)
+        self.trim_steps = trim_steps and len(self.groups) > 0 and all(batcher.lengths is not None
+                                                                      for batcher in self.groups)
+        if pre_padding is None:
+            pre_padding = read_pre_padding(os.path.dirname(os.path.normpath(data_dir)))
+            if pre_padding is None and self.trim_steps:
+                # trimming steps from the wrong side would drop real steps
+                raise Exception("Padding of paths in {} is not recorded in statistics.json. Vectorize the paths again "
+                                "or pass pre_padding.".format(data_dir))
+        self.pre_padding = pre_padding
+        # each bucket is (max number of paths, group of each entity pair, row of each entity pair in its group,
+        #                 longest path of each entity pair)
+        self.buckets = []
+        self.initialize_buckets(number_of_buckets)
+
+        # each batch is (bucket index, start, end)
+        self.batches = []
+        # the order of entity pairs in each bucket
+        self.bucket_orders = []
+        self.current_index = 0
+        self.data_wait_time = 0
+        self.batch_queue = None
+        self.stop_event = None
+        self.worker = None
+        # the error of the background thread, raised by get_batch() until reset
+        self.failure = None
+        self.reset()
+        if self.trim_steps:
+            self.report_trimmed_steps()
+
+    def initialize_groups(self, data_dir):
+        print("Reading files from", data_dir)
+        files = os.listdir(data_dir)
+        shard_index_files = [file for file in files if file.endswith(SHARD_INDEX_SUFFIX)]
+        if shard_index_files:
+            for file in shard_index_files:
+                filename = os.path.join(data_dir, file)
+                for group in range(len(np.load(filename)) - 1):
+                    self.groups.append(Batcher(filename, self.batch_size, False, group))
+        else:
+            for file in files:
+                if file[-3:] == "int" or file[-3:] == "npz":
+                    self.groups.append(Batcher(os.path.join(data_dir, file), self.batch_size, False))
+        self.groups.sort(key=lambda batcher: batcher.number_of_paths)
+
+    def initialize_buckets(self, number_of_buckets):
+        """
+        Split groups sorted by their numbers of paths into buckets at quantiles of entity pairs.
+        """
+        total_pairs = sum(batcher.number_entity_pairs for batcher in self.groups)
+        bucket_groups = []
+        pairs_in_buckets = 0
+        for group_index, batcher in enumerate(self.groups):
+            if not bucket_groups or pairs_in_buckets >= total_pairs * len(bucket_groups) / number_of_buckets:
+                bucket_groups.append([])
+            bucket_groups[-1].append(group_index)
+            pairs_in_buckets += batcher.number_entity_pairs
+
+        for group_indices in bucket_groups:
+            pair_groups = np.concatenate([np.full(self.groups[i].number_entity_pairs, i) for i in group_indices])
+            pair_rows = np.concatenate([np.arange(self.groups[i].number_entity_pairs) for i in group_indices])
+            max_number_of_paths = self.groups[group_indices[-1]].number_of_paths
+            pair_max_lengths = None
+            if self.trim_steps:
+                pair_max_lengths = torch.cat([self.groups[i].lengths.max(dim=1)[0].long() for i in group_indices])
+            self.buckets.append((max_number_of_paths, torch.from_numpy(pair_groups), torch.from_numpy(pair_rows),
+                                 pair_max_lengths))
+        print("Bucketed {} entity pairs with {} numbers of paths into buckets of up to {} paths".format(
+            total_pairs, len(self.groups), [bucket[0] for bucket in self.buckets]))
+
+    def __len__(self):
+        """
+        :return: the number of batches in an epoch
+        """
+        return len(self.batches)
+
+    def __iter__(self):
+        """
+        Iterate through the remaining batches of the current epoch. The batcher is reset at the end.
+        """
+        while True:
+            data = self.get_batch()
+            if data is None:
+                return
+            yield data
+
+    def reset(self):
+        self.stop_prefetching()
+        self.failure = None
+        self.current_index = 0
+        self.data_wait_time = 0
+        self.batches = []
+        self.bucket_orders = []
+        for bucket_index, (max_number_of_paths, pair_groups, _, pair_max_lengths) in enumerate(self.buckets):
+            number_of_pairs = len(pair_groups)
+            if self.do_shuffle:
+                order = torch.randperm(number_of_pairs, generator=self.generator)
+            else:
+                order = torch.arange(number_of_pairs)
+            if self.trim_steps:
+                # a stable sort keeps entity pairs with the same longest path shuffled
+                order = order[torch.sort(pair_max_lengths[order], stable=True)[1]]
+            self.bucket_orders.append(order)
+            if self.max_path_steps is None:
+                for start in range(0, number_of_pairs, self.batch_size):
+                    self.batches.append((bucket_index, start, min(start + self.batch_size, number_of_pairs)))
+            else:
+                ordered_max_lengths = pair_max_lengths[order].tolist() if self.trim_steps else None
+                for start, end in self.split_by_budget(max_number_of_paths, number_of_pairs, ordered_max_lengths):
+                    self.batches.append((bucket_index, start, end))
+        if self.do_shuffle:
+            self.batches = [self.batches[i] for i in torch.randperm(len(self.batches), generator=self.generator)]
+        if self.world_size > 1:
+            self.batches = self.batches[self.rank::self.world_size]
+        self.start_prefetching()
+
+    def split_by_budget(self, max_number_of_paths, number_of_pairs, ordered_max_lengths):
+        """
+        Greedily split ordered entity pairs of a bucket into batches of at most max_path_steps path steps and at most
+        batch_size entity pairs.
+
+        :param max_number_of_paths: the number of paths every entity pair of the bucket is padded to
+        :param number_of_pairs:
+        :param ordered_max_lengths: the longest path of each entity pair in batching order, or None if steps are not
+                                    trimmed
+        :return: a list of (start, end)
+        """
+        path_length = self.groups[0].path_length
+        batches = []
+        start = 0
+        while start < number_of_pairs:
+            end = start + 1
+            number_of_steps = ordered_max_lengths[start] if ordered_max_lengths is not None else path_length
+            while end < number_of_pairs and end - start < self.batch_size:
+                if ordered_max_lengths is not None:
+                    number_of_steps = max(number_of_steps, ordered_max_lengths[end])
+                if (end + 1 - start) * max_number_of_paths * number_of_steps > self.max_path_steps:
+                    break
+                end += 1
+            batches.append((start, end))
+            start = end
+        return batches
+
+    def start_prefetching(self):
+        if self.queue_depth <= 0:
+            return
+        self.batch_queue = queue.Queue(maxsize=self.queue_depth)
+        self.stop_event = threading.Event()
+        self.worker = threading.Thread(target=self.prefetch, args=(self.batch_queue, self.stop_event), daemon=True)
+        self.worker.start()
+
+    def stop_prefetching(self):
+        if self.worker is None:
+            return
+        self.stop_event.set()
+        self.worker.join()
+        self.worker = None
+        self.batch_queue = None
+
+    def close(self):
+        """
+        Stop the background thread. The batcher should not be used afterwards.
+        """
+        self.stop_prefetching()
+
+    def prefetch(self, batch_queue, stop_event):
+        """
+        Assemble all batches of the current epoch in order and put them in the queue, followed by None. Errors are put in
+        the queue to be raised by get_batch().
+        """
+        try:
+            for batch_index in range(len(self.batches)):
+                if not self.put(batch_queue, stop_event, self.assemble_batch(batch_index)):
+                    return
+            item = None
+        except Exception as exception:
+            item = exception
+        self.put(batch_queue, stop_event, item)
+
+    @staticmethod
+    def put(batch_queue, stop_event, item):
+        while not stop_event.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get_batch(self):
+        """
+        :return: inputs [batch_size, max number of paths in the bucket, num_steps, num_feats], labels [batch_size],
+                 path_mask [batch_size, max number of paths in the bucket] where padded paths are False, and lengths
+                 [batch_size, max number of paths in the bucket], the number of real steps of each path, or None if
+                 path lengths are not stored. num_steps is the longest path of the batch if steps are trimmed. None is
+                 returned at the end of an epoch, and the batcher is reset.
+        """
+        if self.failure is not None:
+            raise self.failure
+        if self.queue_depth > 0:
+            start_time = time.time()
+            data = self.get_prefetched()
+            self.data_wait_time += time.time() - start_time
+            if isinstance(data, Exception):
+                # the thread has stopped, so later calls would wait forever for batches
+                self.failure = data
+                self.stop_prefetching()
+                raise data
+        elif self.current_index < len(self.batches):
+            data = self.assemble_batch(self.current_index)
+        else:
+            data = None
+        if data is None:
+            self.reset()
+            return None
+        self.current_index += 1
+        return tuple(tensor.to(self.device, non_blocking=self.pin_memory) if tensor is not None else None
+                     for tensor in data)
+
+    def get_prefetched(self):
+        """
+        Wait for the next item of the queue, or return an error if the background thread stopped without putting one.
+        """
+        while True:
+            try:
+                return self.batch_queue.get(timeout=0.1)
+            except queue.Empty:
+                # the thread may have put its last item just before it stopped
+                if not self.worker.is_alive() and self.batch_queue.empty():
+                    return Exception("The thread assembling batches stopped unexpectedly")
+
+    def assemble_batch(self, batch_index):
+        """
+        Gather entity pairs of a batch from their groups into new (pinned if batches go to a GPU) cpu tensors.
+        """
+        bucket_index, start, end = self.batches[batch_index]
+        max_number_of_paths, pair_groups, pair_rows, pair_max_lengths = self.buckets[bucket_index]
+        pairs = self.bucket_orders[bucket_index][start:end]
+        batch_groups = pair_groups[pairs]
+        batch_rows = pair_rows[pairs]
+        _, _, path_length, feature_size = self.groups[0].get_size()
+        steps = slice(None)
+        if self.trim_steps:
+            number_of_steps = pair_max_lengths[pairs].max().item()
+            if self.pre_padding:
+                steps = slice(path_length - number_of_steps, None)
+            else:
+                steps = slice(None, number_of_steps)
+            path_length = number_of_steps
+        inputs = torch.empty(len(pairs), max_number_of_paths, path_length, feature_size, dtype=torch.long,
+                             pin_memory=self.pin_memory)
+        labels = torch.empty(len(pairs), pin_memory=self.pin_memory)
+        path_mask = torch.zeros(len(pairs), max_number_of_paths, dtype=torch.bool, pin_memory=self.pin_memory)
+        lengths = None
+        if self.trim_steps:
+            lengths = torch.empty(len(pairs), max_number_of_paths, dtype=torch.long, pin_memory=self.pin_memory)
+        for group_index in torch.unique(batch_groups).tolist():
+            batcher = self.groups[group_index]
+            positions = (batch_groups == group_index).nonzero().squeeze(1)
+            group_inputs = batcher.inputs[batch_rows[positions], :, steps].long()
+            inputs[positions, :batcher.number_of_paths] = group_inputs
+            inputs[positions, batcher.number_of_paths:] = group_inputs[:, :1]
+            labels[positions] = batcher.labels[batch_rows[positions]].float()
+            path_mask[positions, :batcher.number_of_paths] = True
+            if lengths is not None:
+                group_lengths = batcher.lengths[batch_rows[positions]].long()
+                lengths[positions, :batcher.number_of_paths] = group_lengths
+                lengths[positions, batcher.number_of_paths:] = group_lengths[:, :1]
+        return inputs, labels, path_mask, lengths
+
+    def report_trimmed_steps(self):
+        """
+        Print how many path steps an epoch runs with trimmed steps compared with steps padded to the full length.
+        """
+        _, _, path_length, _ = self.groups[0].get_size()
+        steps = 0
+        full_steps = 0
+        for bucket_index, start, end in self.batches:
+            max_number_of_paths, _, _, pair_max_lengths = self.buckets[bucket_index]
+            pairs = self.bucket_orders[bucket_index][start:end]
+            steps += len(pairs) * max_number_of_paths * pair_max_lengths[pairs].max().item()
+            full_steps += len(pairs) * max_number_of_paths * path_length
+        print("Trimmed steps of each batch: {} of {} steps per epoch ({:.1f}% saved)".format(
+            steps, full_steps, 100.0 * (1 - steps / max(full_steps, 1))))
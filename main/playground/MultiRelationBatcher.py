@@ -0,0 +1,69 @@
+import torch
+
+
+class MultiRelationBatcher:
+    """
+    This class interleaves batches of several target relations, so that one model can be trained on all relations in
+    one pass. Each relation has its own batcher, e.g., :meth:`main.playground.BucketBatcher`, and every batch comes from
+    one relation. An epoch has all batches of every relation, in shuffled order if shuffle is true, so relations are
+    mixed in proportion to their numbers of batches.
+    """
+
+    def __init__(self, batchers, shuffle):
+        """
+        :param batchers: a list of batchers. The index of a batcher is the target relation of its batches.
+        :param shuffle: whether shuffle the order of relations in an epoch
+        """
+        self.batchers = batchers
+        self.do_shuffle = shuffle
+        # the relation of each batch in an epoch
+        self.schedule = []
+        self.current_index = 0
+        self.reset()
+
+    def __len__(self):
+        """
+        :return: the number of batches in an epoch
+        """
+        return sum(len(batcher) for batcher in self.batchers)
+
+    def __iter__(self):
+        """
+        Iterate through the remaining batches of the current epoch. The batcher is reset at the end.
+        """
+        while True:
+            data = self.get_batch()
+            if data is None:
+                return
+            yield data
+
+    def reset(self):
+        for batcher in self.batchers:
+            batcher.reset()
+        self.schedule = [relation for relation, batcher in enumerate(self.batchers) for _ in range(len(batcher))]
+        if self.do_shuffle:
+            self.schedule = [self.schedule[i] for i in torch.randperm(len(self.schedule)).tolist()]
+        self.current_index = 0
+
+    def get_batch(self):
+        """
+        :return: inputs, labels, path_mask, and lengths of a batch of one relation (see the batcher of the relation),
+                 followed by target_relations [batch_size] filled with the index of the relation. None is returned at
+                 the end of an epoch, and the batcher is reset.
+        """
+        while self.current_index < len(self.schedule):
+            relation = self.schedule[self.current_index]
+            self.current_index += 1
+            data = self.batchers[relation].get_batch()
+            if data is None:
+                # the batcher of this relation has ended its epoch and reset itself
+                continue
+            labels = data[1]
+            target_relations = torch.full((len(labels),), relation, dtype=torch.long, device=labels.device)
+            return tuple(data) + (target_relations,)
+        self.reset()
+        return None
+
+    def close(self):
+        for batcher in self.batchers:
+            batcher.close()
@@ -0,0 +1,444 @@
+import os
+import json
+import numpy as np
+from collections import Counter
+
+from main.data.EntityTypeTable import load_entity_type_table
+
+# the file listing the groups of a shard. Batcher is given this file to read a shard.
+SHARD_INDEX_SUFFIX = ".index.npy"
+
+
+class PathEncoder:
+    """
+    This class vectorizes paths in CVSM's text format (created by write_cvsm_files() in main/features/PathReader.py).
+    Tokens are mapped through vocab lookup tables directly to integers, so no feature strings are built for paths.
+
+    Each step of a path is encoded as one row of features:
+
+        - type_1, .., type_{num_entity_types_slots}, entity, relation (default)
+        - entity_row, relation (if entity_indexed_types). Type features are not stored in every step. The model gathers
+          them from row entity_row of the type features of all entities (see :meth:`read_entity_type_rows`), which is
+          the entity id for entities in the entity vocab.
+        - relation (if is_only_relation or get_only_relation)
+
+    :ivar num_feats: the number of features for each step
+    :ivar entity_type_table: :meth:`main.data.EntityTypeTable`
+    :ivar entity_type_rows: [num_rows, num_entity_types_slots] type features of all entities
+    :ivar pad_step: the encoded step used to pad a path
+    :ivar path_length_counts: a dict mapping from a path length (number of steps) to the number of encountered paths
+    """
+
+    def __init__(self, vocab_dir, is_only_relation, get_only_relation, num_entity_types_slots,
+                 entity_indexed_types=False):
+        """
+        :param vocab_dir: vocab folder in cvsm format
+        :param is_only_relation: whether paths contain only relations
+        :param get_only_relation: whether only use relations in paths
+        :param num_entity_types_slots: the max number of types for an entity + 1
+        :param entity_indexed_types: whether steps store the row of the entity in the entity type table instead of
+                                     type features and the entity
+        """
+        self.is_only_relation = is_only_relation
+        self.get_only_relation = get_only_relation
+        self.num_entity_types_slots = num_entity_types_slots
+        self.entity_indexed_types = entity_indexed_types
+
+        self.entity_type_vocab = None
+        self.entity_vocab = None
+        self.relation_vocab = None
+        self.label2int = None
+        self.load_vocabs(vocab_dir)
+        self.path_length_counts = Counter()
+
+        self.entity_type_table = None
+        self.entity_type_rows = None
+        if self.is_only_relation or self.get_only_relation:
+            self.num_feats = 1
+            self.pad_step = (self.relation_vocab['#PAD_TOKEN'],)
+        else:
+            # type features of all entities are gathered from this cache
+            self.entity_type_table = load_entity_type_table(vocab_dir)
+            self.set_num_entity_types_slots(num_entity_types_slots)
+            self.pad_step = (self.entity_type_table.empty_row, self.entity_vocab['#PAD_TOKEN'],
+                             self.relation_vocab['#PAD_TOKEN'])
+
+    def set_num_entity_types_slots(self, num_entity_types_slots):
+        """
+        Change the number of type slots. Paths already in the intermediate form can be expanded with the new number.
+        """
+        self.num_entity_types_slots = num_entity_types_slots
+        self.num_feats = 2 if self.entity_indexed_types else num_entity_types_slots + 2
+        self.entity_type_rows = self.entity_type_table.get_rows(num_entity_types_slots)
+
+    def load_vocabs(self, vocab_dir):
+        if not self.is_only_relation:
+            print('reading entity type vocab')
+            with open(os.path.join(vocab_dir, "entity_type_vocab.txt"), 'r') as fh:
+                self.entity_type_vocab = json.load(fh)
+            print('reading entity vocab')
+            with open(os.path.join(vocab_dir, "entity_vocab.txt"), 'r') as fh:
+                self.entity_vocab = json.load(fh)
+        relation_vocab_file = os.path.join(vocab_dir, "relation_vocab.txt")
+        print('reading relation vocab: ' + relation_vocab_file)
+        with open(relation_vocab_file, 'r') as fh:
+            self.relation_vocab = json.load(fh)
+        print('Reading label vocab')
+        with open(os.path.join(vocab_dir, "domain-label"), 'r') as fh:
+            self.label2int = json.load(fh)
+
+    def get_max_feature_value(self):
+        """
+        :return: the largest id any feature of a step can have
+        """
+        if self.is_only_relation or self.get_only_relation:
+            return max(self.relation_vocab.values())
+        if self.entity_indexed_types:
+            # entity rows index the entity type table
+            return max(max(self.relation_vocab.values()), self.entity_type_table.empty_row)
+        vocabs = [self.relation_vocab, self.entity_vocab, self.entity_type_vocab]
+        return max(max(vocab.values()) for vocab in vocabs)
+
+    def get_label(self, label):
+        return self.label2int['domain'][label.strip()]
+
+    def get_path_length(self, path):
+        """
+        Compute the number of steps of a path from its string. This is the length used to find the max length of all
+        paths, so it intentionally ignores get_only_relation.
+
+        :param path: a path string, e.g., rel1-ent2-rel2
+        :return:
+        """
+        path_len = len(path.split('-'))
+        if not self.is_only_relation:
+            # ent1 - rel1 - ent2 - rel2 - ent3 - #END_RELATION has length 3
+            # path will be rel1-ent2-rel2
+            path_len = int(path_len / 2) + 2
+        return path_len
+
+    def get_relation_id(self, relation):
+        if relation in self.relation_vocab:
+            return self.relation_vocab[relation]
+        return self.relation_vocab['#UNK_RELATION']
+
+    def get_entity_id(self, entity):
+        if entity in self.entity_vocab:
+            return self.entity_vocab[entity]
+        try:
+            return self.entity_vocab['#UNK_ENTITY']
+        except KeyError:
+            raise Exception(entity)
+
+    def encode_path(self, e1, e2, path):
+        """
+        Encode the real (unpadded) steps of a path. Each step is (type_row, entity, relation), where type_row indexes
+        self.entity_type_rows, or (relation) if only relations are used.
+
+        :param e1: source entity
+        :param e2: target entity
+        :param path: a path string without source and target, e.g., rel1-ent2-rel2
+        :return: a list of steps
+        """
+        tokens = path.split('-')
+        if self.is_only_relation:
+            return [(self.get_relation_id(relation),) for relation in tokens]
+
+        steps = []
+        prev_entity = e1
+        for token_counter, token in enumerate(tokens):
+            if token_counter % 2 == 0:  # relation
+                if self.get_only_relation:
+                    steps.append((self.get_relation_id(token),))
+                else:
+                    steps.append((self.entity_type_table.get_row(prev_entity, self.entity_vocab),
+                                  self.get_entity_id(prev_entity), self.get_relation_id(token)))
+            else:  # this is an entity
+                prev_entity = token
+        if not self.get_only_relation:
+            # take care of e2 (target entity) now
+            steps.append((self.entity_type_table.get_row(e2, self.entity_vocab), self.get_entity_id(e2),
+                          self.get_relation_id('#END_RELATION')))
+        return steps
+
+    def expand_steps(self, steps):
+        """
+        Expand encoded steps to feature rows by gathering type features of entities.
+
+        :param steps: [..., 3] or [..., 1] if only relations are used
+        :return: [..., num_feats]
+        """
+        if self.is_only_relation or self.get_only_relation:
+            return steps
+        if self.entity_indexed_types:
+            return steps[..., [0, 2]]
+        return np.concatenate([self.entity_type_rows[steps[..., 0]], steps[..., 1:]], axis=-1)
+
+    def encode_paths(self, e1, e2, paths, max_length):
+        """
+        Encode all paths between an entity pair into the intermediate integer form without padding. Paths longer than
+        max_length are ignored.
+
+        :param e1: source entity
+        :param e2: target entity
+        :param paths: a list of path strings
+        :param max_length: the max number of steps of a path
+        :return: steps [total_steps, step_size] of all paths concatenated, lengths [num_paths], and the max length of
+                 all paths (including ignored ones) computed by get_path_length()
+        """
+        encoded_steps = []
+        lengths = []
+        max_path_length = -1
+        for path in paths:
+            path = path.strip()
+            path_len = self.get_path_length(path)
+            max_path_length = max(max_path_length, path_len)
+            if not self.is_only_relation and self.get_only_relation:
+                path_len = path_len - 1
+            self.path_length_counts[path_len] += 1
+            if path_len > max_length:
+                continue
+            steps = self.encode_path(e1, e2, path)
+            # malformed paths (e.g., ending with an entity) do not have the expected number of steps
+            if len(steps) != path_len:
+                print("Error: path", path, "has", len(steps), "steps instead of", path_len)
+                continue
+            encoded_steps.extend(steps)
+            lengths.append(path_len)
+        steps = np.array(encoded_steps, dtype=np.int64).reshape(-1, len(self.pad_step))
+        return steps, np.array(lengths, dtype=np.int64), max_path_length
+
+    def pad_paths(self, steps, lengths, max_length, pre_padding, out=None):
+        """
+        Pad encoded paths of an entity pair to max_length steps.
+
+        :param steps: [total_steps, step_size] returned by encode_paths()
+        :param lengths: [num_paths], all lengths need to be no greater than max_length
+        :param max_length:
+        :param pre_padding: whether use pre-padding
+        :param out: an optional [num_paths, max_length, step_size] array to write to
+        :return: [num_paths, max_length, step_size]
+        """
+        if out is None:
+            out = np.empty((len(lengths), max_length, len(self.pad_step)), dtype=np.int64)
+        out[:] = self.pad_step
+        path_indices = np.repeat(np.arange(len(lengths)), lengths)
+        starts = np.cumsum(lengths) - lengths
+        step_indices = np.arange(len(steps)) - np.repeat(starts, lengths)
+        if pre_padding:
+            step_indices += np.repeat(max_length - lengths, lengths)
+        out[path_indices, step_indices] = steps
+        return out
+
+    def encode_pair(self, e1, e2, paths, max_length, pre_padding):
+        """
+        Encode and pad all paths between an entity pair. Paths longer than max_length are ignored.
+
+        :param e1: source entity
+        :param e2: target entity
+        :param paths: a list of path strings
+        :param max_length: the number of steps every path is padded to
+        :param pre_padding: whether use pre-padding
+        :return: inputs [num_paths, max_length, num_feats] and lengths [num_paths], or None if no path is kept
+        """
+        steps, lengths, _ = self.encode_paths(e1, e2, paths, max_length)
+        if len(lengths) == 0:
+            return None
+        return self.expand_steps(self.pad_paths(steps, lengths, max_length, pre_padding)), lengths
+
+
+def write_int_file(filename, labels, inputs, lengths, pre_padding):
+    """
+    Write vectorized entity pairs with the same number of paths to a file in the .int text format. Each line is
+    "label\\tpath;..;path", where steps of a path are separated by spaces and features of a step by commas. With
+    post-padding, the first step of each path is its length.
+
+    :param filename:
+    :param labels: [num_ent_pairs]
+    :param inputs: [num_ent_pairs, num_paths, num_steps, num_feats]
+    :param lengths: [num_ent_pairs, num_paths]
+    :param pre_padding:
+    :return:
+    """
+    with open(filename, 'w') as fh:
+        for label, pair_inputs, pair_lengths in zip(labels.tolist(), inputs.tolist(), lengths.tolist()):
+            paths = []
+            for steps, path_len in zip(pair_inputs, pair_lengths):
+                steps = [','.join(map(str, step)) for step in steps]
+                if not pre_padding:
+                    steps.insert(0, str(path_len))
+                paths.append(' '.join(steps))
+            fh.write(str(label) + '\t' + ';'.join(paths) + '\n')
+
+
+def write_npz_file(filename, labels, inputs, lengths):
+    """
+    Write vectorized entity pairs with the same number of paths to a numpy file that can be read by Batcher without
+    parsing text.
+
+    :param filename:
+    :param labels: [num_ent_pairs]
+    :param inputs: [num_ent_pairs, num_paths, num_steps, num_feats]
+    :param lengths: [num_ent_pairs, num_paths]
+    :return:
+    """
+    np.savez(filename, labels=labels, inputs=inputs, lengths=lengths)
+
+
+def read_int_file(filename, pre_padding, relation_pad_index):
+    """
+    Read a file in the .int text format written by :meth:`write_int_file`.
+
+    :param filename:
+    :param pre_padding:
+    :param relation_pad_index: the id of the relation #PAD_TOKEN, used to count the steps of pre-padded paths
+    :return: labels [num_ent_pairs], inputs [num_ent_pairs, num_paths, num_steps, num_feats], and lengths
+             [num_ent_pairs, num_paths]
+    """
+    labels = []
+    inputs = []
+    lengths = []
+    with open(filename, "r") as fh:
+        for line in fh:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            label, paths = line.split("\t")
+            labels.append(int(label))
+            pair_inputs = []
+            pair_lengths = []
+            for path in paths.split(";"):
+                steps = path.split(" ")
+                if not pre_padding:
+                    pair_lengths.append(int(steps.pop(0)))
+                pair_inputs.append([[int(f) for f in step.split(",")] for step in steps])
+            inputs.append(pair_inputs)
+            if pre_padding:
+                pair_lengths = (np.array(pair_inputs)[:, :, -1] != relation_pad_index).sum(axis=1).tolist()
+            lengths.append(pair_lengths)
+    return np.array(labels, dtype=np.int64), np.array(inputs, dtype=np.int64), np.array(lengths, dtype=np.int64)
+
+
+def get_int_dtype(max_value):
+    """
+    :return: the smallest signed integer dtype that can store values from 0 to max_value
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def open_shard(output_prefix, group_sizes, num_steps, num_feats, max_feature_value):
+    """
+    Create a shard that stores all vectorized entity pairs of a split in a few memory-mapped numpy files, so that
+    Batcher can load them without parsing or copying:
+
+        - output_prefix.inputs.npy: [total_paths, num_steps, num_feats] paths of all pairs, using the smallest integer
+          dtype that fits max_feature_value
+        - output_prefix.lengths.npy: [total_paths]
+        - output_prefix.labels.npy: [total_ent_pairs]
+        - output_prefix.index.npy: [num_groups + 1, 3] the number of paths per pair, the first pair, and the first path
+          of each group of pairs with the same number of paths. The last row stores the totals.
+
+    :param output_prefix: e.g., data_output/rel/train/train
+    :param group_sizes: a list of (number of paths per pair, number of pairs)
+    :param num_steps:
+    :param num_feats:
+    :param max_feature_value: the largest id of all features
+    :return: labels, inputs, and lengths to be filled in, and the index
+    """
+    index = np.zeros((len(group_sizes) + 1, 3), dtype=np.int64)
+    for group_counter, (number_of_paths_per_pair, number_of_pairs) in enumerate(group_sizes):
+        index[group_counter, 0] = number_of_paths_per_pair
+        index[group_counter + 1, 1] = index[group_counter, 1] + number_of_pairs
+        index[group_counter + 1, 2] = index[group_counter, 2] + number_of_pairs * number_of_paths_per_pair
+    total_pairs, total_paths = int(index[-1, 1]), int(index[-1, 2])
+    np.save(output_prefix + SHARD_INDEX_SUFFIX, index)
+    labels = np.lib.format.open_memmap(output_prefix + ".labels.npy", mode="w+", dtype=np.int8, shape=(total_pairs,))
+    inputs = np.lib.format.open_memmap(output_prefix + ".inputs.npy", mode="w+", dtype=get_int_dtype(max_feature_value),
+                                       shape=(total_paths, num_steps, num_feats))
+    lengths = np.lib.format.open_memmap(output_prefix + ".lengths.npy", mode="w+", dtype=get_int_dtype(num_steps),
+                                        shape=(total_paths,))
+    return labels, inputs, lengths, index
+
+
+def read_shard(index_filename, group):
+    """
+    Memory-map one group of a shard created by :meth:`open_shard`. No data is read until it is used.
+
+    :param index_filename: output_prefix.index.npy
+    :param group: the index of the group
+    :return: labels [num_ent_pairs], inputs [num_ent_pairs, num_paths, num_steps, num_feats], and lengths
+             [num_ent_pairs, num_paths]
+    """
+    output_prefix = index_filename[:-len(SHARD_INDEX_SUFFIX)]
+    index = np.load(index_filename)
+    number_of_paths_per_pair, first_pair, first_path = index[group]
+    last_pair, last_path = index[group + 1, 1:]
+    # copy-on-write mapping gives writable arrays (required by torch.from_numpy) without changing the files
+    labels = np.load(output_prefix + ".labels.npy", mmap_mode="c")[first_pair:last_pair]
+    inputs = np.load(output_prefix + ".inputs.npy", mmap_mode="c")[first_path:last_path]
+    lengths = np.load(output_prefix + ".lengths.npy", mmap_mode="c")[first_path:last_path]
+    inputs = inputs.reshape((last_pair - first_pair, number_of_paths_per_pair) + inputs.shape[1:])
+    return labels, inputs, lengths.reshape(last_pair - first_pair, number_of_paths_per_pair)
+
+
+def read_pre_padding(relation_dir):
+    """
+    :param relation_dir: the output folder of a relation, which has statistics.json
+    :return: whether paths of the relation are pre-padded, or None if the padding is not recorded
+    """
+    if not os.path.exists(os.path.join(relation_dir, "statistics.json")):
+        return None
+    with open(os.path.join(relation_dir, "statistics.json"), "r") as fh:
+        stats = json.load(fh)
+    return stats.get("pre_padding")
+
+
+def read_entity_type_rows(relation_dir, vocab_dir):
+    """
+    Read type features of all entities for a relation vectorized with entity_indexed_types, using the number of type
+    slots chosen for the relation.
+
+    :param relation_dir: the output folder of a relation, which has statistics.json
+    :param vocab_dir: vocab folder in cvsm format
+    :return: [num_rows, num_entity_types_slots] or None if steps of the relation store type features
+    """
+    if not os.path.exists(os.path.join(relation_dir, "statistics.json")):
+        return None
+    with open(os.path.join(relation_dir, "statistics.json"), "r") as fh:
+        stats = json.load(fh)
+    if not stats.get("entity_indexed_types", False):
+        return None
+    return load_entity_type_table(vocab_dir).get_rows(stats["num_entity_types_slots"])
+
+
+def read_shared_entity_type_rows(relation_dirs, vocab_dir):
+    """
+    Read type features of all entities for relations scored by one model. Relations vectorized with
+    entity_indexed_types store no type features in steps, but their numbers of type slots can differ if the slots are
+    chosen by coverage. Rows then have the largest number of slots, so no relation loses types of entities, and
+    relations with fewer slots also see deeper types.
+
+    :param relation_dirs: output folders of relations, which have statistics.json
+    :param vocab_dir: vocab folder in cvsm format
+    :return: [num_rows, largest num_entity_types_slots] or None if steps of the relations store type features
+    """
+    num_entity_types_slots = []
+    for relation_dir in relation_dirs:
+        stats = {}
+        if os.path.exists(os.path.join(relation_dir, "statistics.json")):
+            with open(os.path.join(relation_dir, "statistics.json"), "r") as fh:
+                stats = json.load(fh)
+        if stats.get("entity_indexed_types", False):
+            num_entity_types_slots.append(stats["num_entity_types_slots"])
+    if not num_entity_types_slots:
+        return None
+    if len(num_entity_types_slots) != len(relation_dirs):
+        raise Exception("Relations have different input formats: only {} of {} relations are vectorized with "
+                        "entity_indexed_types".format(len(num_entity_types_slots), len(relation_dirs)))
+    if len(set(num_entity_types_slots)) > 1:
+        print("Relations have {} type slots. Type features of entities have {} slots".format(
+            sorted(set(num_entity_types_slots)), max(num_entity_types_slots)))
+    return load_entity_type_table(vocab_dir).get_rows(max(num_entity_types_slots))
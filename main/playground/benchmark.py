@@ -0,0 +1,217 @@
+import os
+import sys
+import time
+import multiprocessing
+import torch
+import torch.distributed as dist
+import torch.multiprocessing
+from torch.nn.parallel import DistributedDataParallel
+
+from main.data.StringTable import load_vocab
+from main.playground.BucketBatcher import BucketBatcher
+from main.playground.device import get_device, configure_cpu, get_cpu_count, data_parallel_init_method
+from main.playground.PathEncoder import read_entity_type_rows, read_pre_padding
+from main.playground.model2.CompositionalVectorSpaceModel import CompositionalVectorSpaceModel
+
+
+def measure_throughput(model, batcher, train=False, max_batches=None, warmup_batches=2):
+    """
+    Measure how many entity pairs per second the model processes over one epoch of a batcher.
+
+    :param model: :meth:`main.playground.model2.CompositionalVectorSpaceModel`
+    :param batcher: a batcher that yields (inputs, labels, path_mask, lengths), e.g.,
+                    :meth:`main.playground.BucketBatcher`
+    :param train: if true, time forward and backward passes with an optimizer step. Otherwise, time forward passes
+                  without gradients.
+    :param max_batches: stop after this many timed batches
+    :param warmup_batches: the number of batches run before timing starts
+    :return: a dict of pairs, batches, seconds, and pairs_per_second
+    """
+    model.train(train)
+    optimizer = torch.optim.Adam(model.parameters()) if train else None
+    criterion = torch.nn.BCELoss()
+    pairs = 0
+    batches = 0
+    start = None
+    for batch_index, (inputs, labels, path_mask, lengths) in enumerate(batcher):
+        if batch_index == warmup_batches:
+            start = time.time()
+        with torch.set_grad_enabled(train):
+            probs, _, _ = model(inputs, path_mask, lengths)
+            if train:
+                model.zero_grad()
+                criterion(probs, labels).backward()
+                optimizer.step()
+        if start is not None:
+            pairs += len(labels)
+            batches += 1
+            if max_batches is not None and batches >= max_batches:
+                break
+    if next(model.parameters()).is_cuda:
+        torch.cuda.synchronize()
+    seconds = time.time() - start if start is not None else 0.0
+    if isinstance(batcher, BucketBatcher):
+        # an epoch left unfinished is restarted so the background thread does not keep assembling it
+        batcher.reset()
+    return {"pairs": pairs, "batches": batches, "seconds": seconds,
+            "pairs_per_second": pairs / seconds if seconds > 0 else 0.0}
+
+
+def measure_latency(model, inputs, path_mask=None, lengths=None, repeats=50, warmup=5):
+    """
+    Measure the latency of scoring one batch without gradients, e.g., a single entity pair or a full batch.
+
+    :param model: a model or a TorchScript model from :meth:`main.playground.model2.ScriptableModel.export_torchscript`
+    :param inputs: [num_ent_pairs, num_paths, num_steps, num_feats]
+    :param path_mask: [num_ent_pairs, num_paths] or None
+    :param lengths: [num_ent_pairs, num_paths] or None
+    :param repeats: the number of timed forward passes
+    :param warmup: the number of forward passes before timing starts. TorchScript optimizes models in the first passes.
+    :return: the median latency in milliseconds
+    """
+    model.eval()
+    latencies = []
+    with torch.no_grad():
+        for repeat in range(warmup + repeats):
+            start = time.perf_counter()
+            model(inputs, path_mask, lengths)
+            if inputs.is_cuda:
+                torch.cuda.synchronize()
+            if repeat >= warmup:
+                latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return 1000 * latencies[len(latencies) // 2]
+
+
+def create_model(files_dir, vocab_dir):
+    """
+    :param files_dir: a split folder of a relation
+    :param vocab_dir:
+    :return: :meth:`main.playground.model2.CompositionalVectorSpaceModel` with the default sizes for freebase
+    """
+    relation_dir = os.path.dirname(os.path.normpath(files_dir))
+    entity_type_rows = read_entity_type_rows(relation_dir, vocab_dir)
+    pre_padding = read_pre_padding(relation_dir)
+    relation_vocab = load_vocab(vocab_dir, "relation_vocab")
+    entity_vocab = load_vocab(vocab_dir, "entity_vocab")
+    entity_type_vocab = load_vocab(vocab_dir, "entity_type_vocab")
+    return CompositionalVectorSpaceModel(relation_vocab_size=len(relation_vocab),
+                                         entity_vocab_size=len(entity_vocab),
+                                         entity_type_vocab_size=len(entity_type_vocab),
+                                         relation_embedding_dim=50,
+                                         entity_embedding_dim=0,
+                                         entity_type_embedding_dim=50,
+                                         entity_type_vocab=entity_type_vocab,
+                                         entity_type2vec_filename=None,
+                                         attention_dim=50,
+                                         relation_encoder_dim=150,
+                                         full_encoder_dim=150,
+                                         pre_padding=pre_padding if pre_padding is not None else True,
+                                         entity_type_rows=entity_type_rows)
+
+
+def measure_data_parallel_scaling(files_dir, vocab_dir, world_sizes, number_of_epochs=2):
+    """
+    Measure the training throughput of data parallel training on cpus with different numbers of processes. The cpus
+    are shared equally by the processes of a run.
+
+    :param files_dir: a split folder of a relation
+    :param vocab_dir:
+    :param world_sizes: the numbers of processes to measure
+    :param number_of_epochs: the number of epochs of each run. Only the last epoch is timed.
+    :return: a dict of world_size to the result of :meth:`train_data_parallel_on_rank`
+    """
+    results = {}
+    for world_size in world_sizes:
+        result_queue = multiprocessing.get_context("spawn").SimpleQueue()
+        with data_parallel_init_method() as init_method:
+            torch.multiprocessing.spawn(train_data_parallel_on_rank, nprocs=world_size,
+                                        args=(world_size, init_method, files_dir, vocab_dir, number_of_epochs,
+                                              result_queue))
+        results[world_size] = result_queue.get()
+    return results
+
+
+def train_data_parallel_on_rank(rank, world_size, init_method, files_dir, vocab_dir, number_of_epochs, result_queue):
+    """
+    Train a model on a shard of batches in a process of :meth:`measure_data_parallel_scaling`. Rank 0 puts a dict of
+    pairs, seconds, and pairs_per_second of the last epoch in result_queue.
+    """
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=world_size)
+    configure_cpu(max(get_cpu_count() // world_size, 1))
+    model = DistributedDataParallel(create_model(files_dir, vocab_dir))
+    batcher = BucketBatcher(files_dir, batch_size=16, shuffle=True, device="cpu", rank=rank, world_size=world_size)
+    optimizer = torch.optim.Adam(model.parameters())
+    criterion = torch.nn.BCELoss()
+    pairs = 0
+    for epoch in range(number_of_epochs):
+        dist.barrier()
+        start = time.time()
+        pairs = 0
+        with model.join():
+            for inputs, labels, path_mask, lengths in batcher:
+                model.zero_grad()
+                probs, _, _ = model(inputs, path_mask, lengths)
+                criterion(probs, labels).backward()
+                optimizer.step()
+                pairs += len(labels)
+        dist.barrier()
+        seconds = time.time() - start
+    pairs = torch.tensor(pairs)
+    dist.all_reduce(pairs)
+    if rank == 0:
+        result_queue.put({"pairs": pairs.item(), "seconds": seconds, "pairs_per_second": pairs.item() / seconds})
+    batcher.close()
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    # usage: python -m main.playground.benchmark <split folder> <vocab folder> [device] [num_threads]
+    #        [max number of processes of data parallel training]
+    from main.playground.model2.ScriptableModel import export_torchscript
+    from main.playground.model2.RelationPathCache import RelationPathCache
+
+    files_dir, vocab_dir = sys.argv[1], sys.argv[2]
+    device = get_device(sys.argv[3] if len(sys.argv) > 3 else None)
+    if device.type == "cpu":
+        configure_cpu(int(sys.argv[4]) if len(sys.argv) > 4 and sys.argv[4] != "None" else None)
+
+    model = create_model(files_dir, vocab_dir).to(device)
+    batcher = BucketBatcher(files_dir, batch_size=16, shuffle=True, device=device)
+    # padded steps are only skipped if the batcher has path lengths
+    for skip_padded_steps, deduplicate_paths in ((False, False), (True, False), (True, True)):
+        model.skip_padded_steps = skip_padded_steps
+        model.deduplicate_paths = deduplicate_paths
+        for train in (False, True):
+            result = measure_throughput(model, batcher, train=train)
+            print("{} on {}{}{}: {:.0f} pairs/s ({} pairs in {:.2f}s)".format(
+                "Training" if train else "Inference", device, " skipping padded steps" if skip_padded_steps else "",
+                " deduplicating paths" if deduplicate_paths else "", result["pairs_per_second"], result["pairs"],
+                result["seconds"]))
+    print("Encoded {} unique paths of {} paths ({:.1f}% deduplicated)".format(
+        model.number_of_unique_paths, model.number_of_paths,
+        100.0 * (1 - model.number_of_unique_paths / max(model.number_of_paths, 1))))
+
+    # latency of scoring a single entity pair and a full batch
+    scripted_model = export_torchscript(model)
+    inputs, labels, path_mask, lengths = max(batcher, key=lambda data: len(data[1]))
+    if lengths is None:
+        lengths = torch.full(path_mask.shape, inputs.shape[2], dtype=torch.long, device=device)
+    for name, batch in (("single pair", (inputs[:1], path_mask[:1], lengths[:1])),
+                        ("batch", (inputs, path_mask, lengths))):
+        print("Latency of a {} ({} paths x {} steps): {:.2f}ms eager, {:.2f}ms TorchScript".format(
+            name, batch[0].shape[0] * batch[0].shape[1], batch[0].shape[2], measure_latency(model, *batch),
+            measure_latency(scripted_model, *batch)))
+    # relation sequences of the batch are cached in the first pass
+    model.relation_path_cache = RelationPathCache()
+    print("Latency of a batch with cached relation paths: {:.2f}ms eager".format(
+        measure_latency(model, inputs, path_mask, lengths)))
+    batcher.close()
+
+    if len(sys.argv) > 5:
+        # scaling of data parallel training on cpus with 1, 2, 4, ... processes
+        world_sizes = [2 ** i for i in range(int(sys.argv[5]).bit_length()) if 2 ** i <= int(sys.argv[5])]
+        results = measure_data_parallel_scaling(files_dir, vocab_dir, world_sizes)
+        for world_size, result in results.items():
+            print("Data parallel training with {} processes: {:.0f} pairs/s ({:.2f}x of 1 process)".format(
+                world_size, result["pairs_per_second"], result["pairs_per_second"] / results[1]["pairs_per_second"]))
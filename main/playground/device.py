@@ -0,0 +1,56 @@
+import os
+import tempfile
+import contextlib
+import torch
+
+
+def get_device(device=None):
+    """
+    :param device: a torch.device or a name such as "cuda", "cuda:1", or "cpu". If None, the gpu is used if available.
+    :return: a torch.device
+    """
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return torch.device(device)
+
+
+def get_cpu_count():
+    """
+    :return: the number of cpus available to this process
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def configure_cpu(num_threads=None):
+    """
+    Tune PyTorch for running the model on cpus: use one intra-op thread per core, enable MKL-DNN kernels, and flush
+    denormal floats, which LSTM gates produce often and which are slow on x86 cpus.
+
+    :param num_threads: the number of intra-op threads. Default uses all cpus available to this process.
+    :return:
+    """
+    if num_threads is None:
+        num_threads = get_cpu_count()
+    torch.set_num_threads(num_threads)
+    torch.backends.mkldnn.enabled = True
+    torch.set_flush_denormal(True)
+    print("Running on cpu with {} threads (MKL-DNN available: {})".format(
+        torch.get_num_threads(), torch.backends.mkldnn.is_available()))
+
+
+@contextlib.contextmanager
+def data_parallel_init_method():
+    """
+    Give the init_method of torch.distributed for processes of data parallel training on this host. If MASTER_ADDR and
+    MASTER_PORT are set by the caller, processes connect to them. Otherwise processes rendezvous through a file in a
+    temporary folder, which is removed on exit, so that no free port has to be picked before rank 0 binds it.
+
+    :return: a context manager giving the init_method
+    """
+    if "MASTER_ADDR" in os.environ and "MASTER_PORT" in os.environ:
+        yield "env://"
+        return
+    with tempfile.TemporaryDirectory() as rendezvous_dir:
+        yield "file://" + os.path.join(rendezvous_dir, "rendezvous")
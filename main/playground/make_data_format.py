@@ -5,310 +5,331 @@ import argparse
 from collections import defaultdict
 import random
 import gzip
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from main.data.EntityTypeTable import load_entity_type_table
+from main.features.PathReader import write_cvsm_vocabs
+from main.playground.PathEncoder import PathEncoder, write_int_file, write_npz_file, read_int_file, open_shard
+from main.playground.path_statistics import choose_limit, count_type_depths, report_padding_savings
 
 # Copied from Ras's repo to decouple it with other prepocessing steps.
 
+# dont change the ordering or remove entries. This is bad coding, I know.
+INPUT_FILES = ['/positive_matrix.tsv.translated', '/negative_matrix.tsv.translated', '/dev_matrix.tsv.translated',
+               '/test_matrix.tsv.translated']
+# the output split each input file is written to
+OUTPUT_SPLITS = ['train', 'train', 'dev', 'test']
 
-def process_paths_for_relation(input_dir, out_dir, vocab_dir, isOnlyRelation, getOnlyRelation, MAX_POSSIBLE_LENGTH_PATH,
-                               NUM_ENTITY_TYPES_SLOTS, pre_padding):
-    entity_type_vocab_file = os.path.join(vocab_dir, "entity_type_vocab.txt")
-    relation_vocab_file = os.path.join(vocab_dir, "relation_vocab.txt")
-    entity_vocab_file = os.path.join(vocab_dir, "entity_vocab.txt")
-    entity_type_map_file = os.path.join(vocab_dir, "entity_to_list_type.json")
-    label_vocab_file = os.path.join(vocab_dir, "domain-label")
 
-    if not isOnlyRelation:
-        print('reading entity type vocab')
-        entity_type_vocab = {}
-        with open(entity_type_vocab_file, 'r') as vocab:
-            entity_type_vocab = json.load(vocab)
-        print('reading entity vocab')
-        entity_vocab = {}
-        with open(entity_vocab_file, 'r') as vocab:
-            entity_vocab = json.load(vocab)
-        print('reading entity to type list')
-        entity_type_map = {}
-        with open(entity_type_map_file, 'r') as f:
-            entity_type_map = json.load(f)
-    print('reading relation vocab: ' + relation_vocab_file)
-    relation_vocab = {}
-    with open(relation_vocab_file, 'r') as vocab:
-        relation_vocab = json.load(vocab)
-    print('Reading label vocab')
-    with open(label_vocab_file, 'r') as label_vocab:
-        label2int = json.load(label_vocab)
-
-    # Gets the maximum length of paths
-    max_length = -1
-    train_files = ['/positive_matrix.tsv.translated', '/negative_matrix.tsv.translated', '/dev_matrix.tsv.translated',
-                   '/test_matrix.tsv.translated']  ##dont change the ordering or remove entries. This is bad coding, I know.
-    for counter, input_file in enumerate(train_files):
-        input_file = input_dir + input_file
-        print('Processing ' + input_file)
-        with open(input_file) as f:
-            for entity_count, line in enumerate(f):  # each entity pair
+def read_translated_pairs(input_dir):
+    """
+    Read entity pairs of a relation from its *.translated files in cvsm format.
+
+    :param input_dir: path data of a relation in cvsm format
+    :return: a generator of (input_file_counter, e1, e2, label, paths), where input_file_counter indexes INPUT_FILES
+    """
+    label = ''
+    for input_file_counter, input_file_name in enumerate(INPUT_FILES):
+        if input_file_counter == 0:
+            label = '1'
+        if input_file_counter == 1:
+            label = '-1'
+        with open(input_dir + input_file_name) as f:
+            for line in f:  # each entity pair
                 split = line.split('\t')
-                e1 = split[0].strip()
-                e2 = split[1].strip()
-                paths = split[2].strip()
-                split = paths.split('###')
-                for path in split:
-                    path_len = len(path.split('-'))
-                    if not isOnlyRelation:
-                        # ent1 - rel1 - ent2 - rel2 - ent3 - #END_RELATION has length 3
-                        # path will be rel1-ent2-rel2
-                        path_len = int(path_len / 2) + 2
-                    if path_len > max_length:
-                        max_length = path_len
-    print("Max length of all paths are", max_length)
-    max_length = min(MAX_POSSIBLE_LENGTH_PATH, max_length)
-    print('Max length will be min(max length of all paths, specificed lenght limit):', str(max_length))
-
-    # function input "length" is the maximum number of entity types for an entity
-    # this function return a string of ints separated by ","
-    def get_entity_types_in_order(entity_types, length):
-        assert (length <= len(entity_types))
-        type_int_list = []
-        for entity_type in entity_types:
-            if entity_type in entity_type_vocab:
-                type_int_list.append(entity_type_vocab[entity_type])
-            else:
-                type_int_list.append(entity_type_vocab['#UNK_ENTITY_TYPE'])
-        # sort in ascending order
-        type_int_list = sorted(type_int_list)
-        type_int_list = type_int_list[:length]  # slice of that length
-        type_int_list = type_int_list[::-1]  # reverse
-        return ','.join(str(i) for i in type_int_list)
-
-    # will be called on data with just relations
-    def get_feature_vector_only_relation(relation):
-        feature_vector = ''
-        # Now add the id for the relation
-        if relation in relation_vocab:
-            feature_vector = feature_vector + str(relation_vocab[relation])
-        else:
-            feature_vector = feature_vector + str(relation_vocab['#UNK_RELATION'])
-        assert (len(feature_vector.split(' ')) == 1)
-        return feature_vector
-
-    def get_feature_vector(prev_entity, relation):
-        type_feature_vector = ''
-        # get the entity types of the vector
-        if prev_entity in entity_type_map:
-            entity_types = entity_type_map[prev_entity]
-            if len(entity_types) == 0:
-                for i in range(
-                        NUM_ENTITY_TYPES_SLOTS):  # we dont have type for this entity the feature vector would be all UNKNOWN TYPE token
-                    # Weiyu: I replaced #UNK_ENTITY_TYPE with #PAD_TOKEN
-                    type_feature_vector = type_feature_vector + str(
-                        entity_type_vocab['#PAD_TOKEN']) + ','  # str(entity_type_vocab['#UNK_ENTITY_TYPE']) +','
-            else:
-                # if len(entity_types) <= NUM_ENTITY_TYPES_SLOTS:
-                # create the feature vector
-                length = min(NUM_ENTITY_TYPES_SLOTS, len(entity_types))
-                extra_padding_length = NUM_ENTITY_TYPES_SLOTS - len(entity_types)
-                for i in range(extra_padding_length):
-                    type_feature_vector = type_feature_vector + str(entity_type_vocab['#PAD_TOKEN']) + ','
-                # Weiyu: I change padding for types from pre to post
-                # type_feature_vector = type_feature_vector + get_entity_types_in_order(entity_types, length) + ','
-                type_feature_vector = get_entity_types_in_order(entity_types, length) + ',' + type_feature_vector
-        else:
-            for i in range(
-                    NUM_ENTITY_TYPES_SLOTS):  # we dont have type for this entity the feature vector would be all UNKNOWN TYPE token
-                # Weiyu: I replaced #UNK_ENTITY_TYPE with #PAD_TOKEN
-                type_feature_vector = type_feature_vector + str(
-                    entity_type_vocab['#PAD_TOKEN']) + ','  # str(entity_type_vocab['#UNK_ENTITY_TYPE']) +','
-        # NEW: add the id for the entity
-        if prev_entity in entity_vocab:
-            type_feature_vector = type_feature_vector + str(entity_vocab[prev_entity]) + ','
-        else:
-            try:
-                type_feature_vector = type_feature_vector + str(entity_vocab['#UNK_ENTITY']) + ','
-            except:
-                raise Exception(prev_entity)
-        # Now add the id for the relation
-        if relation in relation_vocab:
-            type_feature_vector = type_feature_vector + str(relation_vocab[relation])
-        else:
-            type_feature_vector = type_feature_vector + str(relation_vocab['#UNK_RELATION'])
+                if len(split) == 4:
+                    # only test and dev have label for each entity pair.
+                    assert (input_file_counter == 2 or input_file_counter == 3)
+                    label = str(split[3].strip())
+                # path are seperated by ###
+                yield input_file_counter, split[0].strip(), split[1].strip(), label, split[2].split('###')
 
-        assert (len(
-            type_feature_vector.split(',')) == NUM_ENTITY_TYPES_SLOTS + 2)  # +2 - because of entity and entity_type
-        return type_feature_vector
 
-    # Create the feature for PAD token for a path using PAD token of entity, relation, entity type.
-    # pad_feature = relation_pad_token (if only using relation
-    # pad_feature = type_pad_token, .., type_pad_token, entity_pad_token, relation_pad_token (if not only using relation and
+def get_extracted_pairs(rel, relation_to_pairs_to_paths, split, multiple_instances_per_pair):
+    """
+    Get entity pairs of a relation from paths in memory, in the same order and with the same paths as
+    write_cvsm_files() in main/features/PathReader.py would write them to *.translated files.
 
-    pad_feature = ''
-    if isOnlyRelation or getOnlyRelation:
-        pad_feature = str(relation_vocab['#PAD_TOKEN'])
-    else:
-        for i in range(NUM_ENTITY_TYPES_SLOTS):
-            if i == 0:
-                pad_feature = pad_feature + str(entity_type_vocab['#PAD_TOKEN'])
-            else:
-                pad_feature = pad_feature + ',' + str(entity_type_vocab['#PAD_TOKEN'])
-        pad_feature = pad_feature + ',' + str(entity_vocab['#PAD_TOKEN'])
-        pad_feature = pad_feature + ',' + str(relation_vocab['#PAD_TOKEN'])
-
-    def get_padding(num_pad_features):
-        path_feature_vector = ''
-        for i in range(num_pad_features):
-            if path_feature_vector == '':
-                path_feature_vector = pad_feature
+    :param rel: the relation
+    :param relation_to_pairs_to_paths: paths extracted by :meth:`main.features.PathExtractor` or read by
+                                       :meth:`main.features.PathReader`
+    :param split: :meth:`main.data.Split`
+    :param multiple_instances_per_pair: whether an entity pair has a list of path sets
+    :return: a generator of (input_file_counter, e1, e2, label, paths), where input_file_counter indexes INPUT_FILES
+    """
+    pairs_to_paths = relation_to_pairs_to_paths[rel]
+    splits_to_instances = split.relation_to_splits_to_instances[rel]
+    # positive and negative training pairs come from the same split
+    inputs = [("training", 1), ("training", -1), ("development", None), ("testing", None)]
+    for input_file_counter, (spt, training_label) in enumerate(inputs):
+        for subj, obj, label in splits_to_instances.get(spt, []):
+            if training_label is not None and label != training_label:
+                continue
+            if (subj, obj) not in pairs_to_paths:
+                continue
+            if not multiple_instances_per_pair:
+                paths_list = [pairs_to_paths[(subj, obj)]]
             else:
-                path_feature_vector = path_feature_vector + ' ' + pad_feature
-        return path_feature_vector
-
-    missed_entity_count = 0  # entity pair might be ignored when we are putting constraints on the max length of the path.
-    input_files = ['/positive_matrix.tsv.translated', '/negative_matrix.tsv.translated', '/dev_matrix.tsv.translated',
-                   '/test_matrix.tsv.translated']
-    # clean the directory
-    dirs = ['train', 'dev', 'test']
-    for directory in dirs:
-        output_dir = out_dir + '/' + directory
+                paths_list = pairs_to_paths[(subj, obj)]
+            for paths in paths_list:
+                # Important: CVSM takes paths without source and target if paths contain entities.
+                cutted_paths = ["-".join(path.split("-")[1:-1]) for path in paths]
+                # ignore pairs without paths
+                if cutted_paths:
+                    yield input_file_counter, subj, obj, str(label), cutted_paths
+
+
+def process_paths_for_relation(input_dir, out_dir, vocab_dir, isOnlyRelation, getOnlyRelation, MAX_POSSIBLE_LENGTH_PATH,
+                               NUM_ENTITY_TYPES_SLOTS, pre_padding, coverage=None, output_format="int",
+                               entity_indexed_types=False):
+    """
+    Vectorize paths of one relation in a single pass over the input files.
+
+    :return: a dict of statistics for reporting progress and throughput
+    """
+    encoder = PathEncoder(vocab_dir, isOnlyRelation, getOnlyRelation, NUM_ENTITY_TYPES_SLOTS, entity_indexed_types)
+    rel = os.path.basename(os.path.normpath(input_dir))
+    return vectorize_relation(rel, read_translated_pairs(input_dir), out_dir, encoder, MAX_POSSIBLE_LENGTH_PATH,
+                              NUM_ENTITY_TYPES_SLOTS, pre_padding, coverage, output_format)
+
+
+def vectorize_relation(rel, pairs, out_dir, encoder, MAX_POSSIBLE_LENGTH_PATH, NUM_ENTITY_TYPES_SLOTS, pre_padding,
+                       coverage=None, output_format="int"):
+    """
+    Vectorize entity pairs of one relation. Paths are parsed into an intermediate integer form while the max length of
+    all paths is collected, and are then padded in memory.
+
+    If coverage is given, the number of steps and the number of type slots are chosen from the path length and type
+    depth distributions of this relation so that the coverage fraction of paths (steps) are not truncated.
+    MAX_POSSIBLE_LENGTH_PATH and NUM_ENTITY_TYPES_SLOTS are then upper limits.
+
+    :param rel: the name of the relation
+    :param pairs: an iterable of (input_file_counter, e1, e2, label, paths)
+    :param out_dir: the output folder of this relation
+    :param encoder: :meth:`main.playground.PathEncoder`
+    :param MAX_POSSIBLE_LENGTH_PATH:
+    :param NUM_ENTITY_TYPES_SLOTS:
+    :param pre_padding:
+    :param coverage:
+    :param output_format: "int" for text files read by Batcher, "npz" for numpy arrays, or "shard" for one
+                          memory-mapped shard for each split
+    :return: a dict of statistics for reporting progress and throughput
+    """
+    start_time = time.time()
+
+    # 1. parse all pairs once. Paths longer than MAX_POSSIBLE_LENGTH_PATH can never be kept, so they are not encoded.
+    # {split name: [(label, steps, lengths)]}
+    split_to_pairs = defaultdict(list)
+    max_length = -1
+    file_counts = [0] * len(INPUT_FILES)
+    for input_file_counter, e1, e2, label, paths in pairs:
+        steps, lengths, max_path_length = encoder.encode_paths(e1, e2, paths, MAX_POSSIBLE_LENGTH_PATH)
+        max_length = max(max_length, max_path_length)
+        split_to_pairs[OUTPUT_SPLITS[input_file_counter]].append((encoder.get_label(label), steps, lengths))
+        file_counts[input_file_counter] += 1
+    number_of_pairs = sum(file_counts)
+    parse_time = time.time() - start_time
+    print("[{}] parsed {} entity pairs ({} positive, {} negative, {} dev, {} test) in {:.2f}s ({:.0f} pairs/s)".format(
+        rel, number_of_pairs, *file_counts, parse_time, number_of_pairs / max(parse_time, 1e-6)))
+    print("[{}] Max length of all paths are {}".format(rel, max_length))
+    max_length = min(MAX_POSSIBLE_LENGTH_PATH, max_length)
+    print("[{}] Max length will be min(max length of all paths, specificed lenght limit): {}".format(rel, max_length))
+
+    padding_stats = {}
+    if coverage is not None:
+        fixed_length = max_length
+        # paths longer than fixed_length are dropped with any limit, so coverage is over the paths that can be kept
+        kept_length_counts = {path_len: count for path_len, count in encoder.path_length_counts.items()
+                              if path_len <= fixed_length}
+        max_length = choose_limit(kept_length_counts, coverage, fixed_length)
+        type_depth_counts = {}
+        if encoder.entity_type_table is not None:
+            all_steps = [steps for pairs in split_to_pairs.values() for _, steps, _ in pairs]
+            if all_steps:
+                type_depth_counts = count_type_depths(np.concatenate(all_steps), encoder.entity_type_table)
+            encoder.set_num_entity_types_slots(choose_limit(type_depth_counts, coverage, NUM_ENTITY_TYPES_SLOTS))
+        padding_stats = report_padding_savings(rel, encoder.path_length_counts, type_depth_counts, fixed_length,
+                                               NUM_ENTITY_TYPES_SLOTS, max_length, encoder.num_entity_types_slots,
+                                               include_types=encoder.entity_type_table is not None)
+
+    # 2. pad in memory and write each split
+    # entity pair might be ignored when we are putting constraints on the max length of the path.
+    missed_entity_count = 0
+    number_of_paths = 0
+    for split_name in ['train', 'dev', 'test']:
+        output_dir = os.path.join(out_dir, split_name)
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
+        # clean the directory
         for f in os.listdir(output_dir):
-            if os.path.exists(output_dir + '/' + f):
-                os.remove(output_dir + '/' + f)
+            os.remove(os.path.join(output_dir, f))
+        missed, paths = write_split(os.path.join(output_dir, split_name), split_to_pairs[split_name], encoder,
+                                    max_length, pre_padding, output_format)
+        missed_entity_count += missed
+        number_of_paths += paths
 
-    label = ''
-    for input_file_counter, input_file_name in enumerate(input_files):
-        if input_file_counter == 0 or input_file_counter == 1:
-            output_dir = out_dir + '/train'
-            output_file = output_dir + '/' + 'train.txt'
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-            if input_file_counter == 0:
-                label = '1'
-            if input_file_counter == 1:
-                label = '-1'
-        if input_file_counter == 2:
-            output_dir = out_dir + '/dev'
-            output_file = output_dir + '/' + 'dev.txt'
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-        if input_file_counter == 3:
-            output_dir = out_dir + '/test'
-            output_file = output_dir + '/' + 'test.txt'
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-        print('Output dir changed to ' + output_dir)
-        input_file = input_dir + input_file_name
-        with open(input_file) as f:
-            print(input_file)
-            for entity_count, line in enumerate(f):  # each entity pair
-                split = line.split('\t')
-                if len(split) == 4:
-                    # only test and dev have label for each entity pair.
-                    assert (input_file_counter == 2 or input_file_counter == 3)
-                    label = str(split[3].strip())
-                e1 = split[0].strip()
-                e2 = split[1].strip()
-                prev_entity = e1
-                # path are seperated by ###
-                split = split[2].split('###')
-                flag = 0
-                # string for all paths between an entity pair
-                output_line = ''
-                for path_counter, each_path in enumerate(split):
-                    prev_entity = e1
-                    each_path = each_path.strip()
-                    relation_types = each_path.split('-')
-                    path_len = len(relation_types)
-                    if not isOnlyRelation:
-                        path_len = int(path_len/2) + 2  # so 3 months after writing the main, I was wondering why the + 2 - the answer is even if for a one hop path e1 r1 e2 we consider (e1, r1)->(e2, UNK_RELATION); hence path length is atleast 2
-                        if getOnlyRelation:
-                            path_len = path_len - 1
-                    if path_len > max_length:
-                        continue
-                    # Important: we have the option to pre-pad a path to a specific length or post-pad it
-                    # Important: features for steps in a path are seperated by spaces
-                    num_pad_features = max_length - path_len
-                    # string for a path
-                    if not pre_padding:
-                        path_feature_vector = str(path_len)
-                    else:
-                        path_feature_vector = get_padding(num_pad_features)
-                    # iterating through every node in the path
-                    for token_counter, token in enumerate(relation_types):
-                        if not isOnlyRelation:
-                            if token_counter % 2 == 0:  # relation
-                                relation = token
-                                if getOnlyRelation:
-                                    type_feature_vector = get_feature_vector_only_relation(relation)
-                                else:
-                                    type_feature_vector = get_feature_vector(prev_entity, relation)
-                                # at the first step of the path
-                                if token_counter == 0 and path_feature_vector == '':
-                                    path_feature_vector = path_feature_vector + type_feature_vector
-                                else:
-                                    path_feature_vector = path_feature_vector + ' ' + type_feature_vector
-                            else:  # this is an entity
-                                prev_entity = token
-                        else:
-                            relation = token
-                            type_feature_vector = get_feature_vector_only_relation(relation)
-                            # at the first step of the path
-                            if token_counter == 0 and path_feature_vector == '':
-                                path_feature_vector = path_feature_vector + type_feature_vector
-                            else:
-                                path_feature_vector = path_feature_vector + ' ' + type_feature_vector
-                    if not isOnlyRelation and not getOnlyRelation:
-                        # take care of e2 (target entity) now
-                        path_feature_vector = path_feature_vector + ' ' + get_feature_vector(e2, '#END_RELATION')
-                    if not pre_padding:
-                        if num_pad_features > 0:
-                            path_feature_vector = path_feature_vector + ' ' + get_padding(num_pad_features)
-                    try:
-                        if pre_padding:
-                            assert (len(path_feature_vector.split(' ')) == max_length)
-                        else:
-                            # bc the first value will be the length of the path
-                            assert (len(path_feature_vector.split(' ')) - 1 == max_length)
-                    except AssertionError:
-                        print("Error")
-                        print(each_path)
-                        print(num_pad_features)
-                        print(len(path_feature_vector.split(' ')))
-                        print(path_feature_vector.split(' '))
-                        print(max_length)
-                        print(path_feature_vector)
-                        print('===============')
-                        # sys.stderr.write("line:\t"+line)
-                        # sys.stderr.write("path:\t"+each_path)
-                        continue
-
-                    if path_counter == 0 or flag == 0:  # i put the flag check because the first path might be eliminated because it is greater than max_length but path_counter wont be 0
-                        flag = 1
-                        output_line = output_line + path_feature_vector
-                    else:
-                        output_line = output_line + ';' + path_feature_vector
-                path_counter = len(output_line.split(';'))
-                int_label = ''
-                int_label = str(label2int['domain'][label.strip()])
-                output_line = output_line.strip()
-                if len(output_line) == 0:  # this might happen when an entity pair has no paths lesser than length k (eg 3)
-                    missed_entity_count = missed_entity_count + 1
-                    continue
-                output_line = int_label + '\t' + output_line
-                output_line = output_line.strip()
-                if path_counter != 0:
-                    output_file_with_pathlen = output_file + '.' + str(path_counter) + '.int'
-                    # with write option a, all entity pairs with same length of paths will be write to the same file.
-                    with open(output_file_with_pathlen, 'a') as out:
-                        out.write(output_line + '\n')
-                if entity_count % 100 == 0:
-                    print('Processed ' + str(entity_count) + ' entity pairs')
-    print("Missed entity pair count " + str(missed_entity_count))
+    stats = {"relation": rel, "entity_pairs": number_of_pairs, "paths": number_of_paths,
+             "missed_entity_pairs": missed_entity_count, "max_length": max_length, "pre_padding": pre_padding,
+             "num_entity_types_slots": encoder.num_entity_types_slots,
+             "entity_indexed_types": encoder.entity_indexed_types and encoder.entity_type_table is not None,
+             "path_length_counts": dict(encoder.path_length_counts), "padding": padding_stats,
+             "seconds": time.time() - start_time}
+    with open(os.path.join(out_dir, "statistics.json"), "w+") as fh:
+        json.dump(stats, fh)
+    print("[{}] Missed entity pair count {}".format(rel, missed_entity_count))
+    return stats
+
+
+def write_split(output_prefix, pairs, encoder, max_length, pre_padding, output_format="int"):
+    """
+    Group entity pairs by their number of paths, pad each group into one preallocated array, and write each array to
+    its file once. All entity pairs with N paths are written to output_prefix.txt.N.int or output_prefix.N.npz, or all
+    groups are written to one shard.
+
+    :param output_prefix: e.g., data_output/rel/train/train
+    :param pairs: a list of (label, steps, lengths) returned by :meth:`main.playground.PathEncoder.encode_paths`
+    :param encoder: :meth:`main.playground.PathEncoder`
+    :param max_length: the number of steps every path is padded to
+    :param pre_padding:
+    :param output_format: "int", "npz", or "shard" for one shard of all pairs
+    :return: the number of entity pairs without any kept path and the number of kept paths
+    """
+    missed_entity_count = 0
+    number_of_paths = 0
+    path_number_to_pairs = defaultdict(list)
+    for label, steps, lengths in pairs:
+        keep = lengths <= max_length
+        if not keep.any():  # this might happen when an entity pair has no paths lesser than length k (eg 3)
+            missed_entity_count += 1
+            continue
+        if not keep.all():
+            steps = steps[np.repeat(keep, lengths)]
+            lengths = lengths[keep]
+        path_number_to_pairs[len(lengths)].append((label, steps, lengths))
+        number_of_paths += len(lengths)
+
+    if output_format == "shard":
+        if path_number_to_pairs:
+            write_shard(output_prefix, path_number_to_pairs, encoder, max_length, pre_padding)
+        return missed_entity_count, number_of_paths
+
+    for number_of_paths_per_pair, group in path_number_to_pairs.items():
+        labels = np.empty(len(group), dtype=np.int64)
+        encoded = np.empty((len(group), number_of_paths_per_pair, max_length, len(encoder.pad_step)), dtype=np.int64)
+        lengths = np.empty((len(group), number_of_paths_per_pair), dtype=np.int64)
+        for pair_counter, (label, pair_steps, pair_lengths) in enumerate(group):
+            labels[pair_counter] = label
+            lengths[pair_counter] = pair_lengths
+            encoder.pad_paths(pair_steps, pair_lengths, max_length, pre_padding, out=encoded[pair_counter])
+        if output_format == "int":
+            write_int_file(output_prefix + '.txt.' + str(number_of_paths_per_pair) + '.int', labels,
+                           encoder.expand_steps(encoded), lengths, pre_padding)
+        elif output_format == "npz":
+            write_npz_file(output_prefix + '.' + str(number_of_paths_per_pair) + '.npz', labels,
+                           encoder.expand_steps(encoded), lengths)
+        else:
+            raise Exception("Output format not recognized.")
+    return missed_entity_count, number_of_paths
+
+
+def write_shard(output_prefix, path_number_to_pairs, encoder, max_length, pre_padding):
+    """
+    Pad groups of entity pairs directly into a shard (see :meth:`main.playground.PathEncoder.open_shard`). Entity
+    pairs of each group are sorted by their longest paths.
+
+    :param output_prefix: e.g., data_output/rel/train/train
+    :param path_number_to_pairs: a dict mapping from a number of paths to a list of (label, steps, lengths)
+    :param encoder: :meth:`main.playground.PathEncoder`
+    :param max_length: the number of steps every path is padded to
+    :param pre_padding:
+    :return:
+    """
+    # pairs with similar longest paths are stored together, so that batches sorted by length read nearby pages
+    for number_of_paths_per_pair in path_number_to_pairs:
+        path_number_to_pairs[number_of_paths_per_pair].sort(key=lambda pair: pair[2].max())
+    group_sizes = [(number_of_paths_per_pair, len(path_number_to_pairs[number_of_paths_per_pair]))
+                   for number_of_paths_per_pair in sorted(path_number_to_pairs)]
+    labels, inputs, lengths, index = open_shard(output_prefix, group_sizes, max_length, encoder.num_feats,
+                                                encoder.get_max_feature_value())
+    for group_counter, (number_of_paths_per_pair, _) in enumerate(group_sizes):
+        first_pair, first_path = index[group_counter, 1:]
+        encoded = np.empty((number_of_paths_per_pair, max_length, len(encoder.pad_step)), dtype=np.int64)
+        for pair_counter, (label, pair_steps, pair_lengths) in enumerate(path_number_to_pairs[number_of_paths_per_pair]):
+            labels[first_pair + pair_counter] = label
+            start = first_path + pair_counter * number_of_paths_per_pair
+            lengths[start:start + number_of_paths_per_pair] = pair_lengths
+            encoder.pad_paths(pair_steps, pair_lengths, max_length, pre_padding, out=encoded)
+            inputs[start:start + number_of_paths_per_pair] = encoder.expand_steps(encoded)
+    labels.flush()
+    inputs.flush()
+    lengths.flush()
+
+
+def convert_int_files(data_output_dir, vocab_dir, pre_padding, remove_int_files=False):
+    """
+    Convert vectorized data in the .int text format (written by :meth:`process_paths`) to one shard for each split of
+    each relation. Batcher reads shards instead of .int files in the same folder.
+
+    :param data_output_dir: vectorized path data in cvsm format
+    :param vocab_dir: vocab folder in cvsm format
+    :param pre_padding: whether the .int files use pre-padding
+    :param remove_int_files: whether delete the .int files after conversion
+    :return:
+    """
+    with open(os.path.join(vocab_dir, "relation_vocab.txt"), "r") as fh:
+        relation_pad_index = json.load(fh)["#PAD_TOKEN"]
+    for rel in sorted(os.listdir(data_output_dir)):
+        start_time = time.time()
+        for split_name in ['train', 'dev', 'test']:
+            split_dir = os.path.join(data_output_dir, rel, split_name)
+            if not os.path.isdir(split_dir):
+                continue
+            int_filenames = [os.path.join(split_dir, f) for f in os.listdir(split_dir) if f.endswith(".int")]
+            if not int_filenames:
+                continue
+            groups = []
+            for filename in int_filenames:
+                group_labels, group_inputs, group_lengths = read_int_file(filename, pre_padding, relation_pad_index)
+                # same as write_shard(), entity pairs are sorted by their longest paths
+                order = np.argsort(group_lengths.max(axis=1), kind="stable")
+                groups.append((group_labels[order], group_inputs[order], group_lengths[order]))
+            groups.sort(key=lambda group: group[1].shape[1])
+            num_steps, num_feats = groups[0][1].shape[2:]
+            max_feature_value = max(int(inputs.max()) for _, inputs, _ in groups)
+            labels, inputs, lengths, index = open_shard(os.path.join(split_dir, split_name),
+                                                        [(group[1].shape[1], len(group[0])) for group in groups],
+                                                        num_steps, num_feats, max_feature_value)
+            for group_counter, (group_labels, group_inputs, group_lengths) in enumerate(groups):
+                (first_pair, first_path), (last_pair, last_path) = index[group_counter, 1:], index[group_counter + 1, 1:]
+                labels[first_pair:last_pair] = group_labels
+                inputs[first_path:last_path] = group_inputs.reshape((-1, num_steps, num_feats))
+                lengths[first_path:last_path] = group_lengths.reshape(-1)
+            labels.flush()
+            inputs.flush()
+            lengths.flush()
+            if remove_int_files:
+                for filename in int_filenames:
+                    os.remove(filename)
+        # batchers read the padding of shards from the statistics of the relation
+        statistics_filename = os.path.join(data_output_dir, rel, "statistics.json")
+        stats = {}
+        if os.path.exists(statistics_filename):
+            with open(statistics_filename, "r") as fh:
+                stats = json.load(fh)
+        stats["pre_padding"] = pre_padding
+        with open(statistics_filename, "w+") as fh:
+            json.dump(stats, fh)
+        print("Converted {} in {:.2f}s".format(rel, time.time() - start_time))
 
 
 def process_paths(input_dir, output_dir, vocab_dir, isOnlyRelation, getOnlyRelation, MAX_POSSIBLE_LENGTH_PATH,
-                  NUM_ENTITY_TYPES_SLOTS, pre_padding):
+                  NUM_ENTITY_TYPES_SLOTS, pre_padding, num_workers=None, coverage=None, output_format="int",
+                  entity_indexed_types=False):
     """
-    This function triggers another function to vectorize text data.
+    This function triggers another function to vectorize text data. Relations are vectorized concurrently in a
+    process pool.
 
     input: data and vocabs in CVSM's input format (can be created by write_cvsm_files() in main/features/PathReader.py)
     output: vectorized data
@@ -322,18 +343,124 @@ def process_paths(input_dir, output_dir, vocab_dir, isOnlyRelation, getOnlyRelat
     :param NUM_ENTITY_TYPES_SLOTS: the max number of types for an entity + 1
                                    (the reason we +1 is to create a meaningless type for all entities)
     :param pre_padding: whether use pre-padding. pre-padding zeros prevents RNN from forgetting
+    :param num_workers: the number of processes. Default uses all cpus. If set to 1, relations are processed serially
+                        in this process.
+    :param coverage: if set (e.g., 0.995), padding limits are chosen for each relation so that this fraction of paths
+                     and entity types are not truncated. MAX_POSSIBLE_LENGTH_PATH and NUM_ENTITY_TYPES_SLOTS become
+                     upper limits.
+    :param output_format: "int" for .int text files or "shard" for one memory-mapped shard for each split
+    :param entity_indexed_types: if true, each step stores (entity row, relation) and the model looks up type features
+                                 of entities itself. See :meth:`main.playground.PathEncoder`.
     :return:
     """
     if not os.path.exists(output_dir):
         os.mkdir(output_dir)
     else:
         raise Exception("Output directory already exists.")
-    for rel in os.listdir(input_dir):
+    if not isOnlyRelation:
+        # make sure the entity type table is built once before workers read it
+        load_entity_type_table(vocab_dir)
+
+    jobs = []
+    for rel in sorted(os.listdir(input_dir)):
         rel_input_dir = os.path.join(input_dir, rel)
         rel_output_dir = os.path.join(output_dir, rel)
         os.mkdir(rel_output_dir)
-        process_paths_for_relation(rel_input_dir, rel_output_dir, vocab_dir, isOnlyRelation, getOnlyRelation,
-                                   MAX_POSSIBLE_LENGTH_PATH, NUM_ENTITY_TYPES_SLOTS, pre_padding)
+        jobs.append((rel_input_dir, rel_output_dir, vocab_dir, isOnlyRelation, getOnlyRelation,
+                     MAX_POSSIBLE_LENGTH_PATH, NUM_ENTITY_TYPES_SLOTS, pre_padding, coverage, output_format,
+                     entity_indexed_types))
+
+    start_time = time.time()
+    all_stats = []
+    if num_workers == 1:
+        for job in jobs:
+            all_stats.append(process_paths_for_relation(*job))
+            print_relation_stats(all_stats[-1], len(all_stats), len(jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(process_paths_for_relation, *job) for job in jobs]
+            for future in as_completed(futures):
+                all_stats.append(future.result())
+                print_relation_stats(all_stats[-1], len(all_stats), len(jobs))
+    total_time = time.time() - start_time
+    total_pairs = sum(stats["entity_pairs"] for stats in all_stats)
+    print("Vectorized {} entity pairs of {} relations in {:.2f}s ({:.0f} pairs/s)".format(
+        total_pairs, len(all_stats), total_time, total_pairs / max(total_time, 1e-6)))
+    if coverage is not None:
+        memory = sum(stats["padding"]["memory"] for stats in all_stats)
+        fixed_memory = sum(stats["padding"]["fixed_memory"] for stats in all_stats)
+        flops = sum(stats["padding"]["flops"] for stats in all_stats)
+        fixed_flops = sum(stats["padding"]["fixed_flops"] for stats in all_stats)
+        print("Data-driven padding limits with {} coverage: input memory {:.1f}MB (fixed {:.1f}MB), "
+              "forward FLOPs per epoch {:.3g} (fixed {:.3g})".format(coverage, memory / 1e6, fixed_memory / 1e6,
+                                                                     flops, fixed_flops))
+    return all_stats
+
+
+def process_extracted_paths(path_source, split, vocabs, entity2types_filename, cvsm_data_dir, getOnlyRelation,
+                            MAX_POSSIBLE_LENGTH_PATH, NUM_ENTITY_TYPES_SLOTS, pre_padding, coverage=None,
+                            output_format="npz", entity_indexed_types=False):
+    """
+    This function vectorizes paths in memory directly to model-ready arrays, without writing paths in CVSM's input
+    format and reading them back.
+
+    input: paths extracted by :meth:`main.features.PathExtractor` or read from the path store by
+           :meth:`main.features.PathReader`
+    output: vocabs in cvsm_data_dir/vocab and vectorized data in cvsm_data_dir/data_output/<rel>/<split>/
+
+    :param path_source: a PathExtractor or PathReader with paths including entities
+    :param split: :meth:`main.data.Split`
+    :param vocabs: :meth:`main.data.Vocabs`
+    :param entity2types_filename: a json file mapping from entities to type hierarchies
+    :param cvsm_data_dir: e.g., data/wn18rr/cvsm_entity/data
+    :param getOnlyRelation: whether only use relations in paths
+    :param MAX_POSSIBLE_LENGTH_PATH: the max number of relations in a path + 1
+    :param NUM_ENTITY_TYPES_SLOTS: the max number of types for an entity + 1
+    :param pre_padding: whether use pre-padding
+    :param coverage: see :meth:`process_paths`
+    :param output_format: "npz" for one file for each number of paths or "shard" for one shard for each split
+    :param entity_indexed_types: see :meth:`process_paths`
+    :return:
+    """
+    if not path_source.include_entity:
+        raise Exception("Only paths with entities can be vectorized directly.")
+    vocab_dir = os.path.join(cvsm_data_dir, "vocab")
+    output_dir = os.path.join(cvsm_data_dir, "data_output")
+    if os.path.exists(output_dir):
+        raise Exception("Output directory already exists.")
+    if not os.path.exists(vocab_dir):
+        os.makedirs(vocab_dir)
+    write_cvsm_vocabs(vocab_dir, vocabs, entity2types_filename)
+    os.makedirs(output_dir)
+
+    encoder = PathEncoder(vocab_dir, False, getOnlyRelation, NUM_ENTITY_TYPES_SLOTS, entity_indexed_types)
+    start_time = time.time()
+    all_stats = []
+    for rel in split.relation_to_splits_to_instances:
+        rel_output_dir = os.path.join(output_dir, rel)
+        os.mkdir(rel_output_dir)
+        pairs = get_extracted_pairs(rel, path_source.relation_to_pairs_to_paths, split,
+                                    path_source.multiple_instances_per_pair)
+        # statistics and type slots are per relation
+        encoder.path_length_counts.clear()
+        if not getOnlyRelation:
+            encoder.set_num_entity_types_slots(NUM_ENTITY_TYPES_SLOTS)
+        all_stats.append(vectorize_relation(rel, pairs, rel_output_dir, encoder, MAX_POSSIBLE_LENGTH_PATH,
+                                            NUM_ENTITY_TYPES_SLOTS, pre_padding, coverage, output_format))
+        print_relation_stats(all_stats[-1], len(all_stats), len(split.relation_to_splits_to_instances))
+    total_time = time.time() - start_time
+    total_pairs = sum(stats["entity_pairs"] for stats in all_stats)
+    print("Vectorized {} entity pairs of {} relations in {:.2f}s ({:.0f} pairs/s)".format(
+        total_pairs, len(all_stats), total_time, total_pairs / max(total_time, 1e-6)))
+    return all_stats
+
+
+def print_relation_stats(stats, number_finished, number_of_relations):
+    print("Finished {} ({}/{}): {} entity pairs, {} paths, {} missed entity pairs, max length {}, "
+          "in {:.2f}s ({:.0f} pairs/s)".format(stats["relation"], number_finished, number_of_relations,
+                                              stats["entity_pairs"], stats["paths"], stats["missed_entity_pairs"],
+                                              stats["max_length"], stats["seconds"],
+                                              stats["entity_pairs"] / max(stats["seconds"], 1e-6)))
 
 
 if __name__ == "__main__":
@@ -1,11 +1,14 @@
 import time
+import resource
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 np.set_printoptions(threshold=np.inf)
 import random
 import pickle
 from tqdm import tqdm
 import os
-import json
 from collections import OrderedDict, defaultdict
 from scipy.stats import kurtosis, skew
 from scipy.interpolate import interp1d
@@ -13,9 +16,18 @@ import matplotlib.pyplot as plt
 
 import torch
 import torch.optim as optim
+import torch.distributed as dist
+import torch.multiprocessing
+from torch.nn.parallel import DistributedDataParallel
 
+from main.data.StringTable import StringTable, load_vocab
 from main.playground.model2.CompositionalVectorSpaceModel import CompositionalVectorSpaceModel
 from main.playground.BatcherFileList import BatcherFileList
+from main.playground.BucketBatcher import BucketBatcher
+from main.playground.MultiRelationBatcher import MultiRelationBatcher
+from main.playground.PathEncoder import read_entity_type_rows, read_shared_entity_type_rows, read_pre_padding
+from main.playground.device import get_device, configure_cpu, get_cpu_count, data_parallel_init_method
+from main.playground.scheduler import estimate_training_cost, schedule_largest_first
 from main.experiments.Metrics import compute_scores
 from main.playground.Logger import Logger
 from main.playground.Visualizer import Visualizer
@@ -26,7 +38,11 @@ class CompositionalVectorAlgorithm:
     def __init__(self, dataset, experiment_dir, entity_type2vec_filename, learning_rate=0.1, weight_decay=0.0001,
                  number_of_epochs=30, learning_rate_step_size=50, learning_rate_decay=0.5, visualize=False,
                  best_models=None, pooling_method="sat", attention_method="sat", early_stopping_metric="map",
-                 mid2name_filename=None, calculate_path_attn_stats=False, calculate_type_attn_stats=False):
+                 mid2name_filename=None, calculate_path_attn_stats=False, calculate_type_attn_stats=False,
+                 number_of_buckets=None, device=None, num_threads=None, batch_size=16, max_path_steps=None,
+                 mask_padded_types=False, skip_padded_steps=False, deduplicate_paths=False,
+                 relation_path_cache_size=None, precompute_type_keys=False, multi_relation=False,
+                 number_of_workers=1, world_size=1, lazy=False, max_number_batchers_on_gpu=100):
         """
         This class is used to run Attentive Path Ranking algorithm. The training progress is logged in tensorboardx.
 
@@ -47,16 +63,88 @@ class CompositionalVectorAlgorithm:
         :param mid2name_filename:
         :param calculate_path_attn_stats:
         :param calculate_type_attn_stats:
+        :param number_of_buckets: entity pairs with different numbers of paths are batched together in this many
+                                  buckets by :meth:`main.playground.BucketBatcher`, and steps that are padding in every
+                                  path of a batch are trimmed. Results differ from the default None, where entity pairs
+                                  are batched separately for each number of paths by
+                                  :meth:`main.playground.BatcherFileList`.
+        :param device: "cuda", "cpu", or a torch.device to train on. Default uses the gpu if available.
+        :param num_threads: the number of threads when running on cpu. Default uses all cpus.
+        :param batch_size: the number of entity pairs in a batch, or the max number if max_path_steps is given
+        :param max_path_steps: if given, bucketed batches are formed against this budget of path steps (entity pairs x
+                               paths x steps), so batches have different numbers of entity pairs. The loss is summed
+                               and divided by batch_size so that every entity pair has the same weight.
+        :param mask_padded_types: if true, padded type slots get no attention. See
+                                  :meth:`main.playground.model2.CompositionalVectorSpaceModel`.
+        :param skip_padded_steps: if true, the model only encodes real steps of each path. This requires bucketed batches
+                                  of files with path lengths, i.e., .npz files or shards.
+        :param deduplicate_paths: if true, identical paths in a batch are encoded once, and the ratio of unique paths is
+                                  printed for each relation.
+        :param relation_path_cache_size: if given, relation encoder outputs of up to this many relation sequences are
+                                         cached while scoring, and reused until parameters are updated.
+        :param precompute_type_keys: if true, scoring (entity_row, relation) steps gathers types of entities projected
+                                     once for type attention. See
+                                     :meth:`main.playground.model2.CompositionalVectorSpaceModel`.
+        :param multi_relation: if true, train_and_test() trains one model for all relations on interleaved batches of
+                               all relations. Encoders and embeddings are shared, and the scoring head is conditioned
+                               on the target relation. Otherwise, a model is trained for each relation.
+        :param number_of_workers: if greater than 1, train_and_test() trains relations in this many processes, starting
+                                  with the relations of the most path steps. Each process uses an equal share of cpu
+                                  threads. Results are merged into all_best_epoch_val_test.
+        :param world_size: if greater than 1, each relation is trained by this many processes with data parallelism.
+                           Every process trains on its shard of batches, gradients are averaged over processes (gloo
+                           backend), and scores are gathered on rank 0. Each process uses an equal share of cpu threads.
+        :param lazy: if true, only files of a window of max_number_batchers_on_gpu batchers are loaded at a time, so
+                     relations bigger than memory can be trained. See :meth:`main.playground.BatcherFileList`.
+        :param max_number_batchers_on_gpu: the size of the window of batchers whose batches are staged on the device
+                                           when batches are not bucketed
         """
+        # arguments are passed on to algorithms in worker processes
+        self.arguments = {name: value for name, value in locals().items() if name != "self"}
         self.dataset = dataset
         assert dataset == "wordnet" or dataset == "freebase"
 
         self.attention_method = attention_method
         self.pooling_method = pooling_method
         self.early_stopping_metric = early_stopping_metric
+        self.number_of_buckets = number_of_buckets
+        self.batch_size = batch_size
+        self.max_path_steps = max_path_steps
+        self.mask_padded_types = mask_padded_types
+        self.skip_padded_steps = skip_padded_steps
+        self.deduplicate_paths = deduplicate_paths
+        self.relation_path_cache_size = relation_path_cache_size
+        self.precompute_type_keys = precompute_type_keys
+        self.multi_relation = multi_relation
+        self.number_of_workers = number_of_workers
+        self.num_threads = num_threads
+        self.lazy = lazy
+        self.max_number_batchers_on_gpu = max_number_batchers_on_gpu
+        if multi_relation and best_models is not None:
+            raise Exception("Training best models again is not supported for multiple relations.")
+        self.world_size = world_size
+        if multi_relation and number_of_workers > 1:
+            raise Exception("A model of multiple relations is trained in one process.")
+        if world_size > 1:
+            if multi_relation or number_of_workers > 1:
+                raise Exception("Data parallel training is only supported for relations trained one at a time.")
+            if number_of_buckets is None:
+                raise Exception("Data parallel training requires bucketed batches.")
+            if visualize or calculate_path_attn_stats or calculate_type_attn_stats:
+                raise Exception("Visualizations are not supported in data parallel training.")
+            if get_device(device).type != "cpu":
+                raise Exception("Data parallel training runs on cpus.")
+        if max_path_steps is not None and number_of_buckets is None:
+            raise Exception("A budget of path steps requires bucketed batches.")
+        if lazy and number_of_buckets is not None:
+            raise Exception("Bucketed batches load all files of a split, so files cannot be loaded lazily.")
+        self.device = get_device(device)
+        if self.device.type == "cpu":
+            configure_cpu(num_threads)
 
         self.entity_type2vec_filename = entity_type2vec_filename
         self.input_dirs = []
+        self.vocab_dir = None
         self.entity_vocab = None
         self.relation_vocab = None
         self.entity_type_vocab = None
@@ -81,9 +169,9 @@ class CompositionalVectorAlgorithm:
             if not os.path.exists(self.type_weights_dir):
                 os.mkdir(self.type_weights_dir)
 
-        self.idx2entity = {v: k for k, v in self.entity_vocab.items()}
-        self.idx2entity_type = {v: k for k, v in self.entity_type_vocab.items()}
-        self.idx2relation = {v: k for k, v in self.relation_vocab.items()}
+        self.idx2entity = self.get_index(self.entity_vocab)
+        self.idx2entity_type = self.get_index(self.entity_type_vocab)
+        self.idx2relation = self.get_index(self.relation_vocab)
         self.visualizer = Visualizer(self.idx2entity, self.idx2entity_type, self.idx2relation,
                                      save_dir=os.path.join(experiment_dir, "results"),
                                      mid2name_filename=mid2name_filename)
@@ -101,22 +189,42 @@ class CompositionalVectorAlgorithm:
                     self.input_dirs.append(os.path.join(input_dir, fld))
             if "vocab" in folder:
                 vocab_dir = os.path.join(data_dir, folder)
-                for fld in os.listdir(vocab_dir):
-                    if "entity_type_vocab" in fld:
-                        entity_type_vocab_filename = os.path.join(vocab_dir, fld)
-                        entity_type_vocab = json.load(open(entity_type_vocab_filename, "r"))
-                        self.entity_type_vocab = entity_type_vocab
-                    if "entity_vocab" in fld:
-                        entity_vocab_filename = os.path.join(vocab_dir, fld)
-                        self.entity_vocab = json.load(open(entity_vocab_filename, "r"))
-                    if "relation_vocab" in fld:
-                        relation_vocab_filename = os.path.join(vocab_dir, fld)
-                        self.relation_vocab = json.load(open(relation_vocab_filename, "r"))
-
-    def train_and_test(self):
+                self.vocab_dir = vocab_dir
+                self.entity_type_vocab = self.load_vocab(vocab_dir, "entity_type_vocab")
+                self.entity_vocab = self.load_vocab(vocab_dir, "entity_vocab")
+                self.relation_vocab = self.load_vocab(vocab_dir, "relation_vocab")
+
+    @staticmethod
+    def load_vocab(vocab_dir, name):
+        return load_vocab(vocab_dir, name)
+
+    @staticmethod
+    def get_index(vocab):
+        if isinstance(vocab, StringTable):
+            return vocab.index
+        return {v: k for k, v in vocab.items()}
+
+    def train_and_test(self, baseline=None):
+        """
+        :param baseline: best scores of each relation from another run, e.g., all_best_epoch_val_test of separate models
+                         for comparing with a model of multiple relations. Test APs of both runs are printed.
+        """
         print(self.input_dirs)
-        for input_dir in self.input_dirs:
-            self.train(input_dir)
+        start = time.time()
+        if self.multi_relation:
+            self.train_multi_relation(self.input_dirs)
+        elif self.number_of_workers > 1:
+            self.train_in_parallel(self.input_dirs)
+        elif self.world_size > 1:
+            for input_dir in self.input_dirs:
+                self.train_data_parallel(input_dir)
+        else:
+            for input_dir in self.input_dirs:
+                self.train(input_dir)
+        print("Trained {} relations in {:.1f}s with peak memory of {:.0f}MB".format(
+            len(self.input_dirs), time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+        if self.device.type == "cuda":
+            print("Peak gpu memory: {:.0f}MB".format(torch.cuda.max_memory_allocated(self.device) / 1024 ** 2))
 
         # print statistics
         print(self.all_best_epoch_val_test)
@@ -126,37 +234,33 @@ class CompositionalVectorAlgorithm:
             best_model_score = self.all_best_epoch_val_test[rel]
             accs.append(best_model_score["test_acc"])
             aps.append(best_model_score["test_ap"])
+            if baseline is not None and rel in baseline:
+                print("Test AP of {}: {:.4f} (baseline {:.4f})".format(rel, best_model_score["test_ap"],
+                                                                       baseline[rel]["test_ap"]))
         print("Average Accuracy:", sum(accs)/len(accs))
         print("Mean Average Precision:", sum(aps) / len(aps))
 
     def train(self, input_dir):
-        print("Setting up model")
-        # default parameters: relation_embedding_dim=50, entity_embedding_dim=0, entity_type_embedding_dim=300,
-        #                     attention_dim = 50, relation_encoder_dim=150, full_encoder_dim=150
-
-        if self.dataset == "wordnet":
-            entity_type_embedding_dim = 300
-        else:
-            entity_type_embedding_dim = 50
-        model = CompositionalVectorSpaceModel(relation_vocab_size=len(self.relation_vocab),
-                                              entity_vocab_size=len(self.entity_vocab),
-                                              entity_type_vocab_size=len(self.entity_type_vocab),
-                                              relation_embedding_dim=50,
-                                              entity_embedding_dim=0,
-                                              entity_type_embedding_dim=entity_type_embedding_dim,
-                                              entity_type_vocab=self.entity_type_vocab,
-                                              entity_type2vec_filename=self.entity_type2vec_filename,
-                                              attention_dim=50,
-                                              relation_encoder_dim=150,
-                                              full_encoder_dim=150,
-                                              pooling_method=self.pooling_method,
-                                              attention_method=self.attention_method)
+        """
+        :param input_dir: the folder of a relation. If a process group is initialized, e.g., by
+                          :meth:`train_data_parallel`, this process trains on its shard of batches.
+        """
+        distributed = dist.is_initialized()
+        rank = dist.get_rank() if distributed else 0
+        model = self.create_model(input_dir)
+        train_model = model
+        if distributed:
+            # parameters are broadcast from rank 0, and gradients are averaged over ranks in backward
+            train_model = DistributedDataParallel(model)
 
         # self.optimizer = optim.SGD(self.model.parameters(), lr=0.01)
         # self.optimizer = optim.Adagrad(self.model.parameters(), lr=learning_rate, weight_decay=weight_decay)
         # self.scheduler = optim.lr_scheduler.StepLR(self.optimizer, step_size=learning_rate_step_size, gamma=learning_rate_decay)
         optimizer = optim.Adam(model.parameters())
-        criterion = torch.nn.BCELoss().cuda()
+        if self.max_path_steps is None:
+            criterion = torch.nn.BCELoss()
+        else:
+            criterion = torch.nn.BCELoss(reduction="sum")
 
         best_epoch_val_test = {"epoch": -1, "val_acc": -1, "val_ap": -1, "test_acc": -1, "test_ap": -1}
         rel = input_dir.split("/")[-1]
@@ -164,16 +268,9 @@ class CompositionalVectorAlgorithm:
         val_files_dir = os.path.join(input_dir, "dev")
         test_files_dir = os.path.join(input_dir, "test")
         print("Setting up train, validation, and test batcher...")
-        train_batcher = BatcherFileList(train_files_dir, batch_size=16, shuffle=True, max_number_batchers_on_gpu=100)
-        val_batcher = BatcherFileList(val_files_dir, batch_size=16, shuffle=False, max_number_batchers_on_gpu=100)
-        test_batcher = BatcherFileList(test_files_dir, batch_size=16, shuffle=True, max_number_batchers_on_gpu=100)
-
-        count = 0
-        while True:
-            data = train_batcher.get_batch()
-            if data is None:
-                break
-            count += 1
+        train_batcher = self.create_batcher(train_files_dir, shuffle=True)
+        val_batcher = self.create_batcher(val_files_dir, shuffle=False)
+        test_batcher = self.create_batcher(test_files_dir, shuffle=True)
 
         run_epochs = 0
         if self.best_models is not None:
@@ -187,22 +284,28 @@ class CompositionalVectorAlgorithm:
             total_loss = 0
             start = time.time()
 
-            # for i in tqdm(range(count + 1)):
-            for i in range(count + 1):
-                data = train_batcher.get_batch()
-                if data is not None:
-
-                    inputs, labels = data
+            # ranks may have one batch less than others. join() lets them finish the epoch together.
+            with train_model.join() if distributed else contextlib.nullcontext():
+                # for inputs, labels, path_mask, lengths in tqdm(train_batcher, total=len(train_batcher)):
+                for inputs, labels, path_mask, lengths in train_batcher:
                     model.train()
                     model.zero_grad()
-                    probs, path_weights, type_weights = model(inputs)
+                    probs, path_weights, type_weights = train_model(inputs, path_mask, lengths)
                     loss = criterion(probs, labels)
+                    if self.max_path_steps is not None:
+                        # a mean over each batch would weight entity pairs in small batches more
+                        loss = loss / self.batch_size
 
                     loss.backward()
                     # IMPORTANT: grad clipping is important if loss is large. May not be necessary for LSTM
                     torch.nn.utils.clip_grad_norm_(model.parameters(), 5)
                     optimizer.step()
                     total_loss += loss.item()
+            if distributed:
+                # all ranks have to agree on stopping early
+                total_loss_tensor = torch.tensor(total_loss)
+                dist.all_reduce(total_loss_tensor)
+                total_loss = total_loss_tensor.item()
 
             time.sleep(1)
             print("Epoch", epoch, "spent", time.time() - start, "with total loss:", total_loss)
@@ -213,26 +316,28 @@ class CompositionalVectorAlgorithm:
                 train_acc, train_ap = self.score_and_visualize(model, train_batcher, rel, "train", epoch)
                 val_acc, val_ap = self.score_and_visualize(model, val_batcher, rel, "val", epoch)
                 test_acc, test_ap = self.score_and_visualize(model, test_batcher, rel, "test", epoch)
-                # log training progress on tensorboardx
-                self.logger.log_loss(total_loss, epoch, rel)
-                self.logger.log_accuracy(train_acc, val_acc, test_acc, epoch, rel)
-                self.logger.log_ap(train_ap, val_ap, test_ap, epoch, rel)
-                for name, param in model.named_parameters():
-                    self.logger.log_param(name, param, epoch)
-
-                # selecting the best model based on performance on validation set
-                if self.early_stopping_metric == "accuracy":
-                    if val_acc > best_epoch_val_test["val_acc"]:
-                        best_epoch_val_test = {"epoch": epoch,
-                                               "val_acc": val_acc, "val_ap": val_ap,
-                                               "test_acc": test_acc, "test_ap": test_ap}
-                elif self.early_stopping_metric == "map":
-                    if val_ap > best_epoch_val_test["val_ap"]:
-                        best_epoch_val_test = {"epoch": epoch,
-                                               "val_acc": val_acc, "val_ap": val_ap,
-                                               "test_acc": test_acc, "test_ap": test_ap}
-                else:
-                    raise Exception("Early stopping metric not recognized.")
+                # scores are only gathered on rank 0
+                if rank == 0:
+                    # log training progress on tensorboardx
+                    self.logger.log_loss(total_loss, epoch, rel)
+                    self.logger.log_accuracy(train_acc, val_acc, test_acc, epoch, rel)
+                    self.logger.log_ap(train_ap, val_ap, test_ap, epoch, rel)
+                    for name, param in model.named_parameters():
+                        self.logger.log_param(name, param, epoch)
+
+                    # selecting the best model based on performance on validation set
+                    if self.early_stopping_metric == "accuracy":
+                        if val_acc > best_epoch_val_test["val_acc"]:
+                            best_epoch_val_test = {"epoch": epoch,
+                                                   "val_acc": val_acc, "val_ap": val_ap,
+                                                   "test_acc": test_acc, "test_ap": test_ap}
+                    elif self.early_stopping_metric == "map":
+                        if val_ap > best_epoch_val_test["val_ap"]:
+                            best_epoch_val_test = {"epoch": epoch,
+                                                   "val_acc": val_acc, "val_ap": val_ap,
+                                                   "test_acc": test_acc, "test_ap": test_ap}
+                    else:
+                        raise Exception("Early stopping metric not recognized.")
 
                 # Stop training if loss has reduced to zero
                 if total_loss == 0:
@@ -244,23 +349,216 @@ class CompositionalVectorAlgorithm:
                     train_acc, train_ap = self.score_and_visualize(model, train_batcher, rel, "train", epoch)
                     test_acc, test_ap = self.score_and_visualize(model, test_batcher, rel, "test", epoch)
 
+        if self.deduplicate_paths:
+            print("Encoded {} unique paths of {} paths for {} ({:.1f}% deduplicated)".format(
+                model.number_of_unique_paths, model.number_of_paths, rel,
+                100.0 * (1 - model.number_of_unique_paths / max(model.number_of_paths, 1))))
+
         # 2. save best model
-        if self.best_models is None:
+        if self.best_models is None and rank == 0:
             print("Best model", best_epoch_val_test)
             if self.visualize:
                 self.visualizer.save_space(rel, best_epoch_val_test["epoch"])
             self.all_best_epoch_val_test[rel] = best_epoch_val_test
 
+        for batcher in [train_batcher, val_batcher, test_batcher]:
+            batcher.close()
+
+    def train_in_parallel(self, input_dirs):
+        """
+        Train relations separately in a pool of processes. Relations are started in the order planned by
+        :meth:`main.playground.scheduler.schedule_largest_first` from their estimated costs, so that the largest
+        relation starts first and the last relations to finish are small ones.
+
+        :param input_dirs: folders of relations
+        """
+        costs = {input_dir: estimate_training_cost(input_dir) for input_dir in input_dirs}
+        order, makespan = schedule_largest_first(costs, self.number_of_workers)
+        print("Training {} relations in {} processes. The busiest process has {:.1f}% of {} path steps.".format(
+            len(order), self.number_of_workers, 100.0 * makespan / max(sum(costs.values()), 1), sum(costs.values())))
+
+        # threads of all processes share the cpus
+        num_threads = self.num_threads if self.num_threads is not None else get_cpu_count()
+        arguments = dict(self.arguments, number_of_workers=1,
+                         num_threads=max(num_threads // self.number_of_workers, 1))
+        # cuda and the threads of batchers do not survive fork
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.number_of_workers, mp_context=context) as executor:
+            futures = [executor.submit(train_relation, arguments, input_dir) for input_dir in order]
+            for future in futures:
+                rel, best_epoch_val_test = future.result()
+                if best_epoch_val_test is not None:
+                    self.all_best_epoch_val_test[rel] = best_epoch_val_test
+
+    def train_data_parallel(self, input_dir):
+        """
+        Train a relation in world_size processes with data parallelism. Processes are connected by the gloo backend
+        on this host, see :meth:`main.playground.device.data_parallel_init_method`, and the best scores of rank 0 are merged into all_best_epoch_val_test.
+
+        :param input_dir: the folder of a relation
+        """
+        num_threads = self.num_threads if self.num_threads is not None else get_cpu_count()
+        arguments = dict(self.arguments, num_threads=max(num_threads // self.world_size, 1))
+        result_queue = multiprocessing.get_context("spawn").SimpleQueue()
+        with data_parallel_init_method() as init_method:
+            torch.multiprocessing.spawn(train_relation_on_rank, args=(arguments, input_dir, init_method, result_queue),
+                                        nprocs=self.world_size)
+        rel, best_epoch_val_test = result_queue.get()
+        if best_epoch_val_test is not None:
+            self.all_best_epoch_val_test[rel] = best_epoch_val_test
+
+    def train_multi_relation(self, input_dirs):
+        """
+        Train one model for all relations on interleaved batches of all relations. Best epochs are selected for each
+        relation as if relations were trained separately.
+
+        :param input_dirs: folders of relations
+        """
+        model = self.create_model(input_dirs[0], input_dirs)
+        optimizer = optim.Adam(model.parameters())
+        if self.max_path_steps is None:
+            criterion = torch.nn.BCELoss()
+        else:
+            criterion = torch.nn.BCELoss(reduction="sum")
+
+        rels = [input_dir.split("/")[-1] for input_dir in input_dirs]
+        best_epoch_val_tests = {rel: {"epoch": -1, "val_acc": -1, "val_ap": -1, "test_acc": -1, "test_ap": -1}
+                                for rel in rels}
+        print("Setting up train, validation, and test batchers for {} relations...".format(len(input_dirs)))
+        train_batcher = MultiRelationBatcher([self.create_batcher(os.path.join(input_dir, "train"), shuffle=True)
+                                              for input_dir in input_dirs], shuffle=True)
+        val_batchers = [self.create_batcher(os.path.join(input_dir, "dev"), shuffle=False) for input_dir in input_dirs]
+        test_batchers = [self.create_batcher(os.path.join(input_dir, "test"), shuffle=True)
+                         for input_dir in input_dirs]
+
+        for epoch in range(self.number_of_epochs):
+            total_loss = 0
+            start = time.time()
+            for inputs, labels, path_mask, lengths, target_relations in train_batcher:
+                model.train()
+                model.zero_grad()
+                probs, path_weights, type_weights = model(inputs, path_mask, lengths, target_relations)
+                loss = criterion(probs, labels)
+                if self.max_path_steps is not None:
+                    loss = loss / self.batch_size
+
+                loss.backward()
+                torch.nn.utils.clip_grad_norm_(model.parameters(), 5)
+                optimizer.step()
+                total_loss += loss.item()
+
+            print("Epoch", epoch, "spent", time.time() - start, "with total loss:", total_loss)
+
+            # scores are computed and logged for each relation as when relations are trained separately
+            for target_relation, rel in enumerate(rels):
+                train_acc, train_ap = self.score_and_visualize(model, train_batcher.batchers[target_relation], rel,
+                                                               "train", epoch, target_relation)
+                val_acc, val_ap = self.score_and_visualize(model, val_batchers[target_relation], rel, "val", epoch,
+                                                           target_relation)
+                test_acc, test_ap = self.score_and_visualize(model, test_batchers[target_relation], rel, "test", epoch,
+                                                             target_relation)
+                self.logger.log_accuracy(train_acc, val_acc, test_acc, epoch, rel)
+                self.logger.log_ap(train_ap, val_ap, test_ap, epoch, rel)
+                best_epoch_val_test = best_epoch_val_tests[rel]
+                if self.early_stopping_metric == "accuracy":
+                    is_best = val_acc > best_epoch_val_test["val_acc"]
+                elif self.early_stopping_metric == "map":
+                    is_best = val_ap > best_epoch_val_test["val_ap"]
+                else:
+                    raise Exception("Early stopping metric not recognized.")
+                if is_best:
+                    best_epoch_val_tests[rel] = {"epoch": epoch, "val_acc": val_acc, "val_ap": val_ap,
+                                                 "test_acc": test_acc, "test_ap": test_ap}
+            self.logger.log_loss(total_loss, epoch, "all")
+
+            if total_loss == 0:
+                break
+
+        for rel in rels:
+            print("Best model of", rel, best_epoch_val_tests[rel])
+            self.all_best_epoch_val_test[rel] = best_epoch_val_tests[rel]
+
+        train_batcher.close()
+        for batcher in val_batchers + test_batchers:
+            batcher.close()
+
+    def create_model(self, input_dir, input_dirs=None):
+        """
+        :param input_dir: the folder of a relation
+        :param input_dirs: if given, the model scores all these relations. input_dir is the first one.
+        :return: :meth:`main.playground.model2.CompositionalVectorSpaceModel`
+        """
+        print("Setting up model")
+        # default parameters: relation_embedding_dim=50, entity_embedding_dim=0, entity_type_embedding_dim=300,
+        #                     attention_dim = 50, relation_encoder_dim=150, full_encoder_dim=150
+
+        number_of_target_relations = len(input_dirs) if input_dirs is not None else None
+        if self.dataset == "wordnet":
+            entity_type_embedding_dim = 300
+        else:
+            entity_type_embedding_dim = 50
+        # types of entities are looked up by the model if steps only store entities and relations
+        if number_of_target_relations is None:
+            entity_type_rows = read_entity_type_rows(input_dir, self.vocab_dir)
+        else:
+            # the input format of all relations has to be the same
+            entity_type_rows = read_shared_entity_type_rows(input_dirs, self.vocab_dir)
+        # padded steps are skipped on the same side as the batcher trims them
+        pre_padding = read_pre_padding(input_dir)
+        if number_of_target_relations is not None:
+            for relation_dir in input_dirs[1:]:
+                if read_pre_padding(relation_dir) != pre_padding:
+                    raise Exception("Relations have different padding:", input_dir, relation_dir)
+        model = CompositionalVectorSpaceModel(relation_vocab_size=len(self.relation_vocab),
+                                              entity_vocab_size=len(self.entity_vocab),
+                                              entity_type_vocab_size=len(self.entity_type_vocab),
+                                              relation_embedding_dim=50,
+                                              entity_embedding_dim=0,
+                                              entity_type_embedding_dim=entity_type_embedding_dim,
+                                              entity_type_vocab=self.entity_type_vocab,
+                                              entity_type2vec_filename=self.entity_type2vec_filename,
+                                              attention_dim=50,
+                                              relation_encoder_dim=150,
+                                              full_encoder_dim=150,
+                                              pooling_method=self.pooling_method,
+                                              attention_method=self.attention_method,
+                                              entity_type_rows=entity_type_rows,
+                                              mask_padded_types=self.mask_padded_types,
+                                              skip_padded_steps=self.skip_padded_steps,
+                                              # batches only have path lengths if the padding is recorded
+                                              pre_padding=pre_padding if pre_padding is not None else True,
+                                              deduplicate_paths=self.deduplicate_paths,
+                                              relation_path_cache_size=self.relation_path_cache_size,
+                                              precompute_type_keys=self.precompute_type_keys,
+                                              number_of_target_relations=number_of_target_relations).to(self.device)
+        return model
+
+    def create_batcher(self, files_dir, shuffle):
+        if self.number_of_buckets is None:
+            return BatcherFileList(files_dir, batch_size=self.batch_size, shuffle=shuffle,
+                                   max_number_batchers_on_gpu=self.max_number_batchers_on_gpu, device=self.device,
+                                   lazy=self.lazy)
+        rank = 0
+        world_size = 1
+        if dist.is_initialized():
+            # each rank gets its shard of batches
+            rank = dist.get_rank()
+            world_size = dist.get_world_size()
+        return BucketBatcher(files_dir, batch_size=self.batch_size, shuffle=shuffle,
+                             number_of_buckets=self.number_of_buckets, device=self.device,
+                             max_path_steps=self.max_path_steps, rank=rank, world_size=world_size)
+
     def test(self, input_dir):
         test_files_dir = os.path.join(input_dir, "test")
         print("Setting up test batcher")
-        batcher = BatcherFileList(test_files_dir, batch_size=16, shuffle=True, max_number_batchers_on_gpu=100)
+        batcher = self.create_batcher(test_files_dir, shuffle=True)
 
         acc, ap = self.score_and_visualize(batcher)
+        batcher.close()
         print("Total accuracy for testing set:", acc)
         print("AP for this relation:", ap)
 
-    def score_and_visualize(self, model, batcher, rel, split, epoch):
+    def score_and_visualize(self, model, batcher, rel, split, epoch, target_relation=None):
         # store groundtruths and predictions
         score_instances = []
         # store various path stats for all entity pairs
@@ -273,12 +571,12 @@ class CompositionalVectorAlgorithm:
         with torch.no_grad():
             model.eval()
             batcher.reset()
-            while True:
-                data = batcher.get_batch()
-                if data is None:
-                    break
-                inputs, labels = data
-                probs, path_weights, type_weights = model(inputs)
+            for inputs, labels, path_mask, lengths in batcher:
+                target_relations = None
+                if target_relation is not None:
+                    target_relations = torch.full((len(labels),), target_relation, dtype=torch.long,
+                                                  device=labels.device)
+                probs, path_weights, type_weights = model(inputs, path_mask, lengths, target_relations)
 
                 if self.visualize and split == "test":
                     if (self.best_models is None) or (epoch == self.best_models[rel]["epoch"]):
@@ -375,6 +673,14 @@ class CompositionalVectorAlgorithm:
                 # print("accuracy for this batch of", inputs.shape[0], "examples is", num_correct / inputs.shape[0])
                 # print("Total accuracy for training set:", total_num_correct / total_pairs)
 
+        if dist.is_initialized():
+            # every rank has scored its shard of the split
+            all_score_instances = [None] * dist.get_world_size() if dist.get_rank() == 0 else None
+            dist.gather_object(score_instances, all_score_instances, dst=0)
+            if dist.get_rank() != 0:
+                return None, None
+            score_instances = [instance for instances in all_score_instances for instance in instances]
+
         # summarize scores and stats
         ap, rr, acc = compute_scores(score_instances)
         # print("AP for this relation:", ap)
@@ -429,4 +735,37 @@ class CompositionalVectorAlgorithm:
                 path_weights_file = os.path.join(self.path_weights_dir, "{}_{}.csv".format(rel, split))
                 np.savetxt(path_weights_file, all_path_weights, delimiter=",", fmt='%.6e')
 
-        return acc, ap
\ No newline at end of file
+        return acc, ap
+
+
+def train_relation(arguments, input_dir):
+    """
+    Train a relation in a worker process of :meth:`CompositionalVectorAlgorithm.train_in_parallel`.
+
+    :param arguments: arguments of :meth:`CompositionalVectorAlgorithm`
+    :param input_dir: the folder of the relation
+    :return: the relation and its best scores, or None if best models are trained again
+    """
+    algorithm = CompositionalVectorAlgorithm(**arguments)
+    algorithm.train(input_dir)
+    rel = input_dir.split("/")[-1]
+    return rel, algorithm.all_best_epoch_val_test.get(rel)
+
+
+def train_relation_on_rank(rank, arguments, input_dir, init_method, result_queue):
+    """
+    Train a relation in a process of :meth:`CompositionalVectorAlgorithm.train_data_parallel`.
+
+    :param rank: the rank of this process
+    :param arguments: arguments of :meth:`CompositionalVectorAlgorithm`
+    :param input_dir: the folder of the relation
+    :param init_method: the init_method of torch.distributed
+    :param result_queue: rank 0 puts the relation and its best scores, or None if best models are trained again
+    """
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=arguments["world_size"])
+    algorithm = CompositionalVectorAlgorithm(**arguments)
+    algorithm.train(input_dir)
+    if rank == 0:
+        rel = input_dir.split("/")[-1]
+        result_queue.put((rel, algorithm.all_best_epoch_val_test.get(rel)))
+    dist.destroy_process_group()
@@ -2,6 +2,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as functional
 import torch.optim as optim
+from torch.nn.utils.rnn import pack_padded_sequence
 
 import collections
 import os
@@ -11,6 +12,7 @@ import numpy as np
 import json
 
 from main.playground.model2.FeatureEmbedding import FeatureEmbedding
+from main.playground.model2.RelationPathCache import RelationPathCache
 
 torch.manual_seed(1)
 
@@ -19,26 +21,51 @@ def print_sum(module, grad_input, grad_output):
     return print(grad_output[0].flatten().sum())
 
 
+def get_active_paths(lengths, num_steps, pre_padding):
+    """
+    Count the paths whose steps are real at each step. If paths are sorted by length in descending order, the paths
+    with a real step are always the first ones.
+
+    :param lengths: [num_paths] the number of real steps of each path
+    :param num_steps:
+    :param pre_padding: whether paths are pre-padded
+    :return: a list of the number of paths with a real step at each step
+    """
+    steps = torch.arange(num_steps, device=lengths.device).unsqueeze(1)
+    if pre_padding:
+        active = lengths.unsqueeze(0) >= num_steps - steps
+    else:
+        active = lengths.unsqueeze(0) > steps
+    return active.sum(dim=1).tolist()
+
+
 class RelationEncoder(nn.Module):
     def __init__(self, relation_embedding_dim, rnn_hidden_dim):
         super(RelationEncoder, self).__init__()
 
         self.rnn_hidden_dim = rnn_hidden_dim
-        self.lstm = nn.LSTM(relation_embedding_dim, rnn_hidden_dim, batch_first=True).cuda()
+        self.lstm = nn.LSTM(relation_embedding_dim, rnn_hidden_dim, batch_first=True)
 
-    def init_hidden(self, batch_size):
+    def init_hidden(self, batch_size, device):
         # Hidden state axes semantics are (seq_len, batch, rnn_hidden_dim), even when LSTM is set to batch first
-        hidden_state = torch.cuda.FloatTensor(1, batch_size, self.rnn_hidden_dim)
-        hidden_state.copy_(torch.zeros(1, batch_size, self.rnn_hidden_dim))
-        cell_state = torch.cuda.FloatTensor(1, batch_size, self.rnn_hidden_dim)
-        cell_state.copy_(torch.zeros(1, batch_size, self.rnn_hidden_dim))
+        hidden_state = torch.zeros(1, batch_size, self.rnn_hidden_dim, device=device)
+        cell_state = torch.zeros(1, batch_size, self.rnn_hidden_dim, device=device)
         return (hidden_state, cell_state)
 
-    def forward(self, relation_embeds):
+    def forward(self, relation_embeds, lengths=None, pre_padding=True):
         # relation_embeds: [num_ent_pairs x num_paths, num_steps, num_feats]
+        # lengths: [num_ent_pairs x num_paths] in descending order. If given, padded steps are skipped.
         reshaped_batch_size, num_steps, num_feats = relation_embeds.shape
-
-        _, (last_hidden, _) = self.lstm(relation_embeds, self.init_hidden(reshaped_batch_size))
+        hidden = self.init_hidden(reshaped_batch_size, relation_embeds.device)
+
+        if lengths is not None:
+            if pre_padding:
+                # move real steps to the front of each path
+                steps = torch.arange(num_steps, device=lengths.device).unsqueeze(0)
+                index = (steps + (num_steps - lengths).unsqueeze(1)) % num_steps
+                relation_embeds = relation_embeds.gather(1, index.unsqueeze(2).expand(-1, -1, num_feats))
+            relation_embeds = pack_padded_sequence(relation_embeds, lengths.cpu(), batch_first=True)
+        _, (last_hidden, _) = self.lstm(relation_embeds, hidden)
         last_hidden = last_hidden.squeeze(dim=0)
         # last_hidden: [num_ent_pairs x num_paths, rnn_hidden_dim]
         return last_hidden
@@ -50,63 +77,97 @@ class Attention(nn.Module):
         super(Attention, self).__init__()
         self.attention_method = attention_method
         if self.attention_method == "sat":
-            self.type_encoder_att = nn.Linear(types_embedding_dim, attention_dim).cuda()
-            self.full_encoder_att = nn.Linear(full_encoder_dim, attention_dim).cuda()
-            self.full_att = nn.Linear(attention_dim, 1).cuda()
-            self.relu = nn.ReLU().cuda()
-            self.softmax = nn.Softmax(dim=1).cuda()
+            self.type_encoder_att = nn.Linear(types_embedding_dim, attention_dim)
+            self.full_encoder_att = nn.Linear(full_encoder_dim, attention_dim)
+            self.full_att = nn.Linear(attention_dim, 1)
+            self.relu = nn.ReLU()
+            self.softmax = nn.Softmax(dim=1)
         elif self.attention_method == "general":
             self.full_encoder_dim = full_encoder_dim
-            self.linear_in = nn.Linear(types_embedding_dim, full_encoder_dim, bias=False).cuda()
-            self.softmax = nn.Softmax(dim=1).cuda()
+            self.linear_in = nn.Linear(types_embedding_dim, full_encoder_dim, bias=False)
+            self.softmax = nn.Softmax(dim=1)
         elif self.attention_method == "abstract" or self.attention_method == "specific" or self.attention_method == "random":
-            self.type_encoder_att = nn.Linear(types_embedding_dim, attention_dim).cuda()
-
-    def forward(self, types_embeds, full_encoder_hidden):
+            self.type_encoder_att = nn.Linear(types_embedding_dim, attention_dim)
+
+    def project_types(self, types_embeds, type_mask=None):
+        """
+        Apply the projection of types, which does not depend on the hidden state of the full encoder. The model
+        projects types of all steps at once before running the full encoder step by step.
+
+        :param types_embeds: [..., num_types, type_encoder_dim]
+        :param type_mask: [..., num_types] or None. Padded types are not projected.
+        :return: [..., num_types, attention_dim], or [..., num_types, full_encoder_dim] for "general" attention
+        """
+        projection = self.linear_in if self.attention_method == "general" else self.type_encoder_att
+        if type_mask is None:
+            return projection(types_embeds)
+        # only real types are projected
+        projected_types = types_embeds.new_zeros(types_embeds.shape[:-1] + (projection.out_features,))
+        projected_types[type_mask] = projection(types_embeds[type_mask])
+        return projected_types
+
+    def forward(self, types_embeds, full_encoder_hidden, type_mask=None, projected_types=None):
+        """
+        :param types_embeds: [num_ent_pairs x num_paths, num_types, type_encoder_dim]. Only used by "general" attention
+                             if projected_types is given.
+        :param full_encoder_hidden: [num_ent_pairs x num_paths, full_encoder_dim]
+        :param type_mask: [num_ent_pairs x num_paths, num_types], False for padded types, which are not projected and
+                          get no attention in "sat" and "general" attention. Steps without types get zero attention.
+        :param projected_types: types_embeds projected by :meth:`project_types`. Computed if not given.
+        """
+        if projected_types is None:
+            projected_types = self.project_types(types_embeds, type_mask)
 
         if self.attention_method == "abstract":
-            reshaped_batch_size, num_types, _ = types_embeds.shape
-            types_embeds = self.type_encoder_att(types_embeds)
+            reshaped_batch_size, num_types, _ = projected_types.shape
+            types_embeds = projected_types
             attention_weighted_type_embeds = types_embeds[:, -1, :]
-            alpha = torch.cuda.FloatTensor(reshaped_batch_size, num_types).fill_(0)
+            alpha = torch.zeros(reshaped_batch_size, num_types, device=types_embeds.device)
             alpha[:, -1] = 1.0
         elif self.attention_method == "specific":
-            reshaped_batch_size, num_types, _ = types_embeds.shape
-            types_embeds = self.type_encoder_att(types_embeds)
+            reshaped_batch_size, num_types, _ = projected_types.shape
+            types_embeds = projected_types
             attention_weighted_type_embeds = types_embeds[:, 0, :]
-            alpha = torch.cuda.FloatTensor(reshaped_batch_size, num_types).fill_(0)
+            alpha = torch.zeros(reshaped_batch_size, num_types, device=types_embeds.device)
             alpha[:, 0] = 1.0
         elif self.attention_method == "random":
-            reshaped_batch_size, num_types, types_embedding_dim = types_embeds.shape
-            types_embeds = self.type_encoder_att(types_embeds)
-            dim1 = torch.cuda.LongTensor(list(range(reshaped_batch_size)))
-            dim2 = torch.cuda.LongTensor(np.random.randint(0, num_types, size=reshaped_batch_size))
+            reshaped_batch_size, num_types, _ = projected_types.shape
+            types_embeds = projected_types
+            dim1 = torch.arange(reshaped_batch_size, device=types_embeds.device)
+            dim2 = torch.as_tensor(np.random.randint(0, num_types, size=reshaped_batch_size), device=types_embeds.device)
             attention_weighted_type_embeds = types_embeds[dim1, dim2, :]
-            alpha = torch.cuda.FloatTensor(reshaped_batch_size, num_types).fill_(0)
+            alpha = torch.zeros(reshaped_batch_size, num_types, device=types_embeds.device)
             alpha[dim1, dim2] = 1.0
         elif self.attention_method == "sat":
             # type_embeds: [num_ent_pairs x num_paths, num_types, type_encoder_dim]
-            att1 = self.type_encoder_att(types_embeds)
+            att1 = projected_types
             # full_encoder_hidden: [num_ent_pairs x num_paths, full_encoder_dim]
             att2 = self.full_encoder_att(full_encoder_hidden)
             att = self.full_att(self.relu(att1 + att2.unsqueeze(1))).squeeze(2)
             # att: [num_ent_pairs x num_paths, num_types]
-            alpha = self.softmax(att)
+            alpha = self.masked_softmax(att, type_mask)
             attention_weighted_type_embeds = (att1 * alpha.unsqueeze(2)).sum(dim=1)
         elif self.attention_method == "general":
             # type_embeds: [num_ent_pairs x num_paths, num_types, type_encoder_dim]
             # full_encoder_hidden: [num_ent_pairs x num_paths, full_encoder_dim]
-            context = self.linear_in(types_embeds)
+            context = projected_types
             # context: [num_ent_pairs x num_paths, num_types, full_encoder_dim]
             full_encoder_hidden = full_encoder_hidden.unsqueeze(dim=1)
             # full_encoder_hidden: [num_ent_pairs x num_paths, 1, full_encoder_dim]
             attention_scores = torch.matmul(full_encoder_hidden, context.transpose(1, 2).contiguous())
             # attention_scores: [num_ent_pairs x num_paths, 1, num_types]
-            alpha = self.softmax(attention_scores.squeeze(dim=1))
+            alpha = self.masked_softmax(attention_scores.squeeze(dim=1), type_mask)
             attention_weighted_type_embeds = (types_embeds * alpha.unsqueeze(2)).sum(dim=1)
 
         return attention_weighted_type_embeds, alpha
 
+    def masked_softmax(self, att, type_mask):
+        if type_mask is None:
+            return self.softmax(att)
+        alpha = self.softmax(att.masked_fill(~type_mask, float("-inf")))
+        # rows without types are all nan after softmax
+        return alpha.masked_fill(~type_mask, 0)
+
 
 class CompositionalVectorSpaceModel(nn.Module):
 
@@ -114,7 +175,31 @@ class CompositionalVectorSpaceModel(nn.Module):
                  relation_embedding_dim, entity_embedding_dim, entity_type_embedding_dim,
                  entity_type_vocab, entity_type2vec_filename,
                  attention_dim, relation_encoder_dim, full_encoder_dim,
-                 pooling_method="sat", attention_method="sat"):
+                 pooling_method="sat", attention_method="sat", entity_type_rows=None, mask_padded_types=False,
+                 skip_padded_steps=False, pre_padding=True, deduplicate_paths=False, relation_path_cache_size=None,
+                 precompute_type_keys=False, number_of_target_relations=None):
+        """
+        :param entity_type_rows: see :meth:`main.playground.model2.FeatureEmbedding`
+        :param mask_padded_types: if true, padded type slots are excluded from "sat" and "general" type attention, and
+                                  type slots padded in every step of a batch are trimmed
+        :param skip_padded_steps: if true and path lengths are given to forward(), the relation encoder and the full
+                                  encoder only run on real steps of each path. Otherwise, padded steps are encoded too.
+        :param pre_padding: whether paths are pre-padded, i.e., padded steps come before real steps
+        :param deduplicate_paths: if true, identical paths of a batch are encoded once. The numbers of paths and unique
+                                  paths are counted in number_of_paths and number_of_unique_paths.
+        :param relation_path_cache_size: if given, the relation encoder output of up to this many relation sequences is
+                                         cached in eval mode without gradients, see
+                                         :meth:`main.playground.model2.RelationPathCache`
+        :param precompute_type_keys: if true, types of every entity row in entity_type_rows are projected for type
+                                     attention once, and inference on (entity_row, relation) steps gathers the projected
+                                     types of entities instead of embedding and projecting types in every step. Only
+                                     "sat", "abstract", and "specific" attention use projected types alone. Projected
+                                     types are computed again if the type embeddings or the projection change, so they
+                                     are computed once after training if type embeddings are pretrained and frozen.
+        :param number_of_target_relations: if given, one model scores entity pairs of this many target relations. The
+                                           encoders are shared, and the scoring head is conditioned on the target
+                                           relation of each entity pair, which is given to forward().
+        """
 
         super(CompositionalVectorSpaceModel, self).__init__()
 
@@ -131,49 +216,95 @@ class CompositionalVectorSpaceModel(nn.Module):
         self.feature_embeddings = FeatureEmbedding(relation_vocab_size, relation_embedding_dim,
                                                    entity_vocab_size, entity_embedding_dim,
                                                    entity_type_vocab_size, entity_type_embedding_dim,
-                                                   entity_type_vocab, entity_type2vec_filename)
+                                                   entity_type_vocab, entity_type2vec_filename, entity_type_rows)
 
         self.relation_encoder = RelationEncoder(relation_embedding_dim, relation_encoder_dim)
-
+        self.skip_padded_steps = skip_padded_steps
+        self.pre_padding = pre_padding
+        self.deduplicate_paths = deduplicate_paths
+        self.number_of_paths = 0
+        self.number_of_unique_paths = 0
+        self.relation_path_cache = None
+        if relation_path_cache_size is not None:
+            self.relation_path_cache = RelationPathCache(relation_path_cache_size)
+
+        self.mask_padded_types = mask_padded_types and attention_method in ("sat", "general")
+        self.precompute_type_keys = (precompute_type_keys and entity_type_rows is not None
+                                     and attention_method in ("sat", "abstract", "specific"))
+        self.type_keys = None
+        self.type_key_versions = None
         self.attention = Attention(entity_type_embedding_dim, full_encoder_dim, attention_dim,
                                    attention_method=attention_method)
 
-        self.full_encoder_step = nn.LSTMCell(attention_dim, full_encoder_dim).cuda()
+        self.full_encoder_step = nn.LSTMCell(attention_dim, full_encoder_dim)
 
         # predict initial state for second encoder
-        self.init_h = nn.Linear(relation_encoder_dim, full_encoder_dim).cuda()
-        self.init_c = nn.Linear(relation_encoder_dim, full_encoder_dim).cuda()
+        self.init_h = nn.Linear(relation_encoder_dim, full_encoder_dim)
+        self.init_c = nn.Linear(relation_encoder_dim, full_encoder_dim)
 
         # attention gate
-        self.f_beta = nn.Linear(full_encoder_dim, attention_dim).cuda()
+        self.f_beta = nn.Linear(full_encoder_dim, attention_dim)
 
-        self.sigmoid = nn.Sigmoid().cuda()
+        self.sigmoid = nn.Sigmoid()
 
         self.pooling_method = pooling_method
         if self.pooling_method == "lse":
-            self.fc = nn.Linear(full_encoder_dim + relation_encoder_dim, label_dim).cuda()
+            self.fc = nn.Linear(full_encoder_dim + relation_encoder_dim, label_dim)
         elif self.pooling_method == "hat":
             path_hidden_dim = 100
-            self.path_projector = nn.Linear(full_encoder_dim, path_hidden_dim).cuda()
-            self.tanh = nn.Tanh().cuda()
-            self.path_context = nn.Parameter(torch.cuda.FloatTensor(path_hidden_dim))
+            self.path_projector = nn.Linear(full_encoder_dim, path_hidden_dim)
+            self.tanh = nn.Tanh()
+            self.path_context = nn.Parameter(torch.empty(path_hidden_dim))
             torch.nn.init.normal_(self.path_context)
-            self.softmax = nn.Softmax(dim=1).cuda()
-            self.fc = nn.Linear(full_encoder_dim, label_dim).cuda()
+            self.softmax = nn.Softmax(dim=1)
+            self.fc = nn.Linear(full_encoder_dim, label_dim)
         elif self.pooling_method == "sat":
             path_hidden_dim = 100
-            self.path_context = nn.Parameter(torch.cuda.FloatTensor(path_hidden_dim))
+            self.path_context = nn.Parameter(torch.empty(path_hidden_dim))
             torch.nn.init.normal_(self.path_context)
-            self.path_att = nn.Linear(full_encoder_dim + relation_encoder_dim, path_hidden_dim).cuda()
-            self.att = nn.Linear(path_hidden_dim, 1).cuda()
-            self.relu = nn.ReLU().cuda()
-            self.softmax = nn.Softmax(dim=1).cuda()
-            self.fc = nn.Linear(full_encoder_dim + relation_encoder_dim, label_dim).cuda()
+            self.path_att = nn.Linear(full_encoder_dim + relation_encoder_dim, path_hidden_dim)
+            self.att = nn.Linear(path_hidden_dim, 1)
+            self.relu = nn.ReLU()
+            self.softmax = nn.Softmax(dim=1)
+            self.fc = nn.Linear(full_encoder_dim + relation_encoder_dim, label_dim)
             # self.dropout = nn.Dropout(p=0.5)
         elif self.pooling_method == "max":
-            self.fc = nn.Linear(full_encoder_dim + relation_encoder_dim, label_dim).cuda()
+            self.fc = nn.Linear(full_encoder_dim + relation_encoder_dim, label_dim)
         elif self.pooling_method == "avg":
-            self.fc = nn.Linear(full_encoder_dim + relation_encoder_dim, label_dim).cuda()
+            self.fc = nn.Linear(full_encoder_dim + relation_encoder_dim, label_dim)
+
+        self.number_of_target_relations = number_of_target_relations
+        if number_of_target_relations is not None:
+            # each target relation adjusts the shared head. Adjustments start at zero, so all target relations start
+            # with the same head.
+            self.target_fc_weights = nn.Embedding(number_of_target_relations, self.fc.in_features)
+            self.target_fc_biases = nn.Embedding(number_of_target_relations, label_dim)
+            torch.nn.init.zeros_(self.target_fc_weights.weight)
+            torch.nn.init.zeros_(self.target_fc_biases.weight)
+            if self.pooling_method in ("sat", "hat"):
+                self.target_path_contexts = nn.Embedding(number_of_target_relations, len(self.path_context))
+                torch.nn.init.zeros_(self.target_path_contexts.weight)
+
+    def score(self, features, targets=None):
+        """
+        :param features: [number of rows, fc input dim]
+        :param targets: [number of rows], the target relation of each row if the model has target relations
+        :return: scores [number of rows, label_dim]
+        """
+        scores = self.fc(features)
+        if targets is not None:
+            scores = scores + (features * self.target_fc_weights(targets)).sum(dim=1, keepdim=True) + \
+                     self.target_fc_biases(targets)
+        return scores
+
+    def get_path_context(self, targets=None):
+        """
+        :return: the context vector of path attention [path_hidden_dim], or [number of rows, path_hidden_dim] for the
+                 target relation of each row
+        """
+        if targets is None:
+            return self.path_context
+        return self.path_context + self.target_path_contexts(targets)
 
     def init_hidden(self, relation_encoder_out):
         # relation_encoder_out: [num_ent_pairs x num_paths, relation_encoder_dim]
@@ -181,98 +312,228 @@ class CompositionalVectorSpaceModel(nn.Module):
         c = self.init_c(relation_encoder_out)
         return h, c
 
-    def forward(self, x):
-        # x: [num_ent_pairs, num_paths, num_steps, num_feats]
-        num_ent_pairs, num_paths, num_steps, num_feats = x.shape
-        # collide dim 0 and dim 1
-        reshaped_batch_size = num_ent_pairs * num_paths
-        x = x.view(reshaped_batch_size, num_steps, num_feats)
-        # x: [num_ent_pairs x num_paths, num_steps, num_feats]
-
-        relation_embeds, types_embeds = self.feature_embeddings(x)
-        # relation_embeds: [num_ent_pairs x num_paths, num_steps, relation_embedding_dim]
-        # types_embeds: [num_ent_pairs x num_paths, num_steps, num_types, entity_type_embedding_dim]
-
-        relation_encoder_out = self.relation_encoder(relation_embeds)
-        # relation_encoder_out: [num_ent_pairs x num_paths, relation_encoder_dim]
-
-        h, c = self.init_hidden(relation_encoder_out)
+    def get_type_keys(self):
+        """
+        :return: types of every entity row projected for type attention [num_rows, num_types, attention_dim]. Padded
+                 type slots are zero if they are masked.
+        """
+        feature_embeddings = self.feature_embeddings
+        parameters = list(feature_embeddings.entity_types_embeddings.parameters()) + \
+            list(self.attention.type_encoder_att.parameters())
+        versions = tuple((parameter.data_ptr(), parameter._version) for parameter in parameters)
+        if self.type_keys is None or versions != self.type_key_versions:
+            with torch.no_grad():
+                type_ids = feature_embeddings.entity_type_rows
+                type_mask = type_ids != feature_embeddings.type_pad_index if self.mask_padded_types else None
+                self.type_keys = self.attention.project_types(feature_embeddings.entity_types_embeddings(type_ids),
+                                                              type_mask)
+            self.type_key_versions = versions
+        return self.type_keys
+
+    def encode_paths(self, x, lengths=None):
+        """
+        Encode paths with the relation encoder and the full encoder.
+
+        :param x: [number of paths, num_steps, num_feats]
+        :param lengths: [number of paths], the number of real steps of each path, used if skip_padded_steps
+        :return: encoded paths [number of paths, full_encoder_dim + relation_encoder_dim] and type attention weights
+                 [number of paths, num_steps, num_types]
+        """
+        reshaped_batch_size, num_steps, num_feats = x.shape
+
+        order = None
+        active_paths = [reshaped_batch_size] * num_steps
+        if self.skip_padded_steps and lengths is not None:
+            # paths are sorted by length, so paths with a real step at each step are the first ones
+            lengths = lengths.clamp(min=1, max=num_steps)
+            lengths, order = torch.sort(lengths, descending=True)
+            x = x[order]
+            active_paths = get_active_paths(lengths, num_steps, self.pre_padding)
+        else:
+            lengths = None
+
+        projected_types = None
+        if self.precompute_type_keys and num_feats == 2 and not self.training and not torch.is_grad_enabled():
+            # projected types of entities are gathered instead of embedding and projecting types of every step
+            entity_rows = x[:, :, 0]
+            relation_embeds = self.feature_embeddings.relation_embeddings(x[:, :, -1])
+            types_embeds = None
+            type_mask = self.feature_embeddings.entity_type_rows[entity_rows] != self.feature_embeddings.type_pad_index
+            projected_types = self.get_type_keys()[entity_rows]
+            num_types = projected_types.shape[2]
+        else:
+            relation_embeds, types_embeds, type_mask = self.feature_embeddings(x)
+            # relation_embeds: [num_ent_pairs x num_paths, num_steps, relation_embedding_dim]
+            # types_embeds: [num_ent_pairs x num_paths, num_steps, num_types, entity_type_embedding_dim]
+            # type_mask: [num_ent_pairs x num_paths, num_steps, num_types]
+            num_types = types_embeds.shape[2]
+        if self.mask_padded_types:
+            # type slots are post-padded, so slots after the deepest type hierarchy of the batch are all padding
+            num_real_types = max(int(type_mask.sum(dim=2).max()), 1)
+            type_mask = type_mask[:, :, :num_real_types]
+            if types_embeds is not None:
+                types_embeds = types_embeds[:, :, :num_real_types]
+            if projected_types is not None:
+                projected_types = projected_types[:, :, :num_real_types]
+        else:
+            type_mask = None
+
+        if self.relation_path_cache is not None and not self.training and not torch.is_grad_enabled():
+            relation_encoder_out, h, c = self.relation_path_cache.encode(self, x[:, :, -1], relation_embeds, lengths)
+        else:
+            relation_encoder_out = self.relation_encoder(relation_embeds, lengths, self.pre_padding)
+            # relation_encoder_out: [num_ent_pairs x num_paths, relation_encoder_dim]
+
+            h, c = self.init_hidden(relation_encoder_out)
         # h or c: [num_ent_pairs x num_paths, full_encoder_dim]
 
-        num_types = types_embeds.shape[2]
-        alphas = torch.cuda.FloatTensor(reshaped_batch_size, num_steps, num_types)
+        # type projections do not depend on h, so they are computed for all steps at once
+        if projected_types is None:
+            projected_types = self.attention.project_types(types_embeds, type_mask)
+        # projected_types: [num_ent_pairs x num_paths, num_steps, num_types, attention_dim]
+
+        # trimmed type slots get zero attention
+        alphas = torch.zeros(reshaped_batch_size, num_steps, num_types, device=x.device)
+        # tensors are split into steps once, so backward stacks gradients of steps instead of filling a full-size
+        # gradient for each step
+        types_embeds_steps = types_embeds.unbind(dim=1) if types_embeds is not None else None
+        projected_types_steps = projected_types.unbind(dim=1)
+        type_mask_steps = type_mask.unbind(dim=1) if type_mask is not None else None
+        # only the first n paths have a real step at each step. Pre-padded paths start with the initial states when
+        # their real steps begin, and post-padded paths keep their states after their real steps end.
+        h_init, c_init = h, c
+        h, c = h[:0], c[:0]
+        finished_h = []
         for t in range(num_steps):
-            types_embeds_t = types_embeds[:, t, :, :]
-            # types_embeds_t: [num_ent_pairs x num_paths, num_types, entity_type_embedding_dim]
-            attention_weighted_encoding, alpha = self.attention(types_embeds_t, h)
-            # alpha: [num_ent_pairs x num_paths, num_types]
+            n = active_paths[t]
+            if n > len(h) == 0:
+                h, c = h_init[:n], c_init[:n]
+            elif n > len(h):
+                h = torch.cat((h, h_init[len(h):n]))
+                c = torch.cat((c, c_init[len(c):n]))
+            elif n < len(h):
+                finished_h.append(h[n:])
+                h, c = h[:n], c[:n]
+            if n == 0:
+                continue
+            types_embeds_t = types_embeds_steps[t][:n] if types_embeds is not None else None
+            # types_embeds_t: [n, num_types, entity_type_embedding_dim]
+            type_mask_t = type_mask_steps[t][:n] if type_mask is not None else None
+            attention_weighted_encoding, alpha = self.attention(types_embeds_t, h, type_mask_t,
+                                                                projected_types_steps[t][:n])
+            # alpha: [n, num_types]
             gate = self.sigmoid(self.f_beta(h))
             attention_weighted_encoding = gate * attention_weighted_encoding
-            # attention_weighted_encoding: [num_ent_pairs x num_paths, entity_type_embedding_dim]
+            # attention_weighted_encoding: [n, entity_type_embedding_dim]
 
             feats_t = attention_weighted_encoding
 
             h, c = self.full_encoder_step(feats_t, (h, c))
-            alphas[:, t, :] = alpha
+            alphas[:n, t, :alpha.shape[1]] = alpha
+        # paths that finished later come first
+        h = torch.cat([h] + finished_h[::-1] + [h_init[len(h) + sum(len(f) for f in finished_h):]])
 
         h = torch.cat((h, relation_encoder_out), dim=1)
-
-        path_weights = torch.cuda.FloatTensor(num_ent_pairs, num_paths)
+        if order is not None:
+            # restore the order of paths
+            inverse_order = torch.argsort(order)
+            h = h[inverse_order]
+            alphas = alphas[inverse_order]
+        return h, alphas
+
+    def forward(self, x, path_mask=None, lengths=None, target_relations=None):
+        # x: [num_ent_pairs, num_paths, num_steps, num_feats]
+        # path_mask: [num_ent_pairs, num_paths], False for paths padded by BucketBatcher, which are excluded in pooling
+        # lengths: [num_ent_pairs, num_paths], the number of real steps of each path, used if skip_padded_steps
+        # target_relations: [num_ent_pairs], the target relation of each entity pair if number_of_target_relations
+        num_ent_pairs, num_paths, num_steps, num_feats = x.shape
+        # collide dim 0 and dim 1
+        reshaped_batch_size = num_ent_pairs * num_paths
+        x = x.view(reshaped_batch_size, num_steps, num_feats)
+        # x: [num_ent_pairs x num_paths, num_steps, num_feats]
+        if lengths is not None:
+            lengths = lengths.reshape(reshaped_batch_size)
+
+        if self.deduplicate_paths:
+            # identical paths, e.g., paths shared by entity pairs and paths padded by BucketBatcher, are encoded once
+            x, inverse = torch.unique(x.view(reshaped_batch_size, -1), dim=0, return_inverse=True)
+            x = x.view(-1, num_steps, num_feats)
+            if lengths is not None:
+                lengths = lengths.new_empty(len(x)).scatter_(0, inverse, lengths)
+            self.number_of_paths += reshaped_batch_size
+            self.number_of_unique_paths += len(x)
+            h, alphas = self.encode_paths(x, lengths)
+            h = h[inverse]
+            alphas = alphas[inverse]
+        else:
+            h, alphas = self.encode_paths(x, lengths)
+        num_types = alphas.shape[2]
+
+        if self.number_of_target_relations is None:
+            target_relations = None
+        elif target_relations is None:
+            raise Exception("Target relations of entity pairs are required by a model of multiple relations.")
+        path_targets = target_relations.repeat_interleave(num_paths) if target_relations is not None else None
+
+        path_weights = torch.empty(num_ent_pairs, num_paths, device=x.device)
         if self.pooling_method == "lse":
-            path_scores = self.fc(h)
+            path_scores = self.score(h, path_targets)
             # path_scores: [num_ent_pairs x num_paths, label_dim]
             path_scores = path_scores.view(num_ent_pairs, num_paths, -1)
             # path_scores: [num_ent_pairs, num_paths, label_dim]
+            if path_mask is not None:
+                path_scores = path_scores.masked_fill(~path_mask.unsqueeze(2), float("-inf"))
             # LogSumExp
-            maxes, max_indices = torch.max(path_scores, dim=1, keepdim=True)
-            # print(maxes.squeeze())
-            score_minus_maxes = torch.add(path_scores, -1, maxes.expand_as(path_scores))
-            exp_score_minus_max = torch.exp(score_minus_maxes)
-            sum_exp_score_minus_max = torch.sum(exp_score_minus_max, dim=1)
-            lse_scores = torch.log(sum_exp_score_minus_max)
-            lse_scores = lse_scores + maxes.squeeze(dim=2)
-            # print("lse scores shape", lse_scores.shape)
-            # print("maxes shape", maxes.shape)
+            lse_scores = torch.logsumexp(path_scores, dim=1)
+            # lse_scores: [num_ent_pairs, label_dim]
             probs = self.sigmoid(lse_scores).squeeze(dim=1)
             # probs: [num_ent_pairs, 1]
         elif self.pooling_method == "max":
-            path_scores = self.fc(h)
+            path_scores = self.score(h, path_targets)
             # path_scores: [num_ent_pairs x num_paths, label_dim]
             path_scores = path_scores.view(num_ent_pairs, num_paths, -1)
             # path_scores: [num_ent_pairs, num_paths, label_dim]
+            if path_mask is not None:
+                path_scores = path_scores.masked_fill(~path_mask.unsqueeze(2), float("-inf"))
             max_path_score, _ = torch.max(path_scores, dim=1)
             probs = self.sigmoid(max_path_score).squeeze(dim=1)
         elif self.pooling_method == "avg":
-            path_scores = self.fc(h)
+            path_scores = self.score(h, path_targets)
             # path_scores: [num_ent_pairs x num_paths, label_dim]
             path_scores = path_scores.view(num_ent_pairs, num_paths, -1)
             # path_scores: [num_ent_pairs, num_paths, label_dim]
+            if path_mask is not None:
+                path_scores = path_scores.masked_fill(~path_mask.unsqueeze(2), 0)
             path_score_sum = torch.sum(path_scores, dim=1)
             probs = self.sigmoid(path_score_sum).squeeze(dim=1)
         elif self.pooling_method == "hat":
             # h: [num_ent_pairs x num_paths, full_encoder_dim]
             paths_projected = self.tanh(self.path_projector(h))
-            path_sims = paths_projected.matmul(self.path_context)
+            path_sims = (paths_projected * self.get_path_context(path_targets)).sum(dim=-1)
             path_sims = path_sims.view(num_ent_pairs, num_paths, -1)
+            if path_mask is not None:
+                path_sims = path_sims.masked_fill(~path_mask.unsqueeze(2), float("-inf"))
             path_weights = self.softmax(path_sims)
             # path_weights: [num_ent_pairs, num_paths, 1]
             paths_feats = h.view(num_ent_pairs, num_paths, -1)
             paths_weighted_sum = (paths_feats * path_weights).sum(dim=1)
             # paths_weighted_sum: [num_ent_pairs, full_encoder_dim]
-            scores = self.fc(paths_weighted_sum)
+            scores = self.score(paths_weighted_sum, target_relations)
             probs = self.sigmoid(scores).squeeze(dim=1)
         elif self.pooling_method == "sat":
             # h: [num_ent_pairs x num_paths, full_encoder_dim]
             path_hiddens = self.path_att(h)
             # path_hiddens: [num_ent_pairs x num_paths, path_hidden_dim]
-            att = self.att(self.relu(path_hiddens + self.path_context))
+            att = self.att(self.relu(path_hiddens + self.get_path_context(path_targets)))
             # att: [num_ent_pairs x num_paths, 1]
             att = att.view(num_ent_pairs, num_paths, -1)
+            if path_mask is not None:
+                att = att.masked_fill(~path_mask.unsqueeze(2), float("-inf"))
             path_weights = self.softmax(att)
             paths_feats = h.view(num_ent_pairs, num_paths, -1)
             paths_weighted_sum = (paths_feats * path_weights).sum(dim=1)
             # paths_weighted_sum: [num_ent_pairs, full_encoder_dim]
-            scores = self.fc(paths_weighted_sum)
+            scores = self.score(paths_weighted_sum, target_relations)
             probs = self.sigmoid(scores).squeeze(dim=1)
 
         # visualization
@@ -10,10 +10,24 @@ class FeatureEmbedding(nn.Module):
     def __init__(self, relation_vocab_size, relation_embedding_dim,
                  entity_vocab_size, entity_embedding_dim,
                  entity_type_vocab_size, entity_type_embedding_dim,
-                 entity_type_vocab=None, entity_type2vec_filename=None):
+                 entity_type_vocab=None, entity_type2vec_filename=None, entity_type_rows=None):
+        """
+        :param entity_type_rows: [num_rows, num_types] type ids of all entities. If given, inputs can be
+                                 (entity_row, relation) steps, whose types are looked up in this table on the device
+                                 instead of being stored in every step.
+        """
         super(FeatureEmbedding, self).__init__()
 
-        self.relation_embeddings = nn.Embedding(relation_vocab_size, relation_embedding_dim).cuda()
+        # not saved in state dicts, so that models trained on either input format can be loaded
+        if entity_type_rows is not None:
+            self.register_buffer("entity_type_rows", torch.as_tensor(entity_type_rows, dtype=torch.long),
+                                 persistent=False)
+        else:
+            self.entity_type_rows = None
+
+        self.relation_embeddings = nn.Embedding(relation_vocab_size, relation_embedding_dim)
+        # types padding type hierarchies of entities
+        self.type_pad_index = entity_type_vocab["#PAD_TOKEN"]
 
         if entity_type2vec_filename is not None and entity_type_vocab is not None:
             self.entity_types_embeddings = None
@@ -22,7 +36,7 @@ class FeatureEmbedding(nn.Module):
             for entity_type in entity_type_vocab:
                 if entity_type == "#PAD_TOKEN":
                     pad_index = entity_type_vocab[entity_type]
-            self.entity_types_embeddings = nn.Embedding(entity_type_vocab_size, entity_type_embedding_dim, padding_idx=pad_index).cuda()
+            self.entity_types_embeddings = nn.Embedding(entity_type_vocab_size, entity_type_embedding_dim, padding_idx=pad_index)
 
     def load_pretrained_entity_types_embeddings(self, entity_type_vocab, entity_type2vec_filename):
         print("loading entity_type2vec from pickle file:", entity_type2vec_filename)
@@ -46,12 +60,18 @@ class FeatureEmbedding(nn.Module):
                 matrix[index, :] = torch.FloatTensor(entity_type2vec[entity_type])
 
         # initialize embedding with the matrix. Turn off training
-        self.entity_types_embeddings = torch.nn.Embedding.from_pretrained(matrix, freeze=True).cuda()
+        self.entity_types_embeddings = torch.nn.Embedding.from_pretrained(matrix, freeze=True)
 
     def forward(self, x):
         # the input dimension is #paths x #steps x #feats
-        # for each feature, num_entity_types type, 1 entity, 1 relation in order
+        # for each feature, num_entity_types type, 1 entity, 1 relation in order, or 1 entity row, 1 relation
         relation_embeds = self.relation_embeddings(x[:, :, -1])
-        types_embeds = self.entity_types_embeddings(x[:, :, :-2])
+        if x.shape[2] == 2 and self.entity_type_rows is not None:
+            type_ids = self.entity_type_rows[x[:, :, 0]]
+        else:
+            type_ids = x[:, :, :-2]
+        types_embeds = self.entity_types_embeddings(type_ids)
+        # type_mask is False for padded type slots
+        type_mask = type_ids != self.type_pad_index
 
-        return relation_embeds, types_embeds
+        return relation_embeds, types_embeds, type_mask
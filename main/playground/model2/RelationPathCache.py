@@ -0,0 +1,124 @@
+import collections
+import torch
+
+
+class RelationPathCache:
+    """
+    This class caches the relation encoder output of relation sequences and the initial states of the full encoder
+    derived from it, so that scoring paths with known relation sequences skips the relation encoder. It is used by
+    :meth:`main.playground.model2.CompositionalVectorSpaceModel` when the model is in eval mode and gradients are
+    disabled.
+
+    Entries are stored in rows of one tensor and evicted in least recently used order when the cache is full. The cache
+    is cleared when parameters it depends on are updated, e.g., by an optimizer step or by loading a state dict.
+
+    :ivar hits: the number of paths found in the cache since it was last cleared
+    :ivar misses: the number of paths encoded since it was last cleared
+    """
+
+    def __init__(self, max_size=100000):
+        """
+        :param max_size: the max number of relation sequences cached
+        """
+        self.max_size = max_size
+        # relation sequence -> row of the cached tensor, in least recently used order
+        self.rows = collections.OrderedDict()
+        self.cached = None
+        self.parameter_versions = None
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.rows = collections.OrderedDict()
+        self.cached = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_parameter_versions(model):
+        """
+        :return: the storage and in-place version of every parameter used to encode relation sequences
+        """
+        modules = [model.feature_embeddings.relation_embeddings, model.relation_encoder, model.init_h, model.init_c]
+        return tuple((parameter.data_ptr(), parameter._version)
+                     for module in modules for parameter in module.parameters())
+
+    def encode(self, model, relations, relation_embeds, lengths=None):
+        """
+        :param model: :meth:`main.playground.model2.CompositionalVectorSpaceModel`
+        :param relations: [number of paths, num_steps], relation ids of paths
+        :param relation_embeds: [number of paths, num_steps, relation_embedding_dim]
+        :param lengths: [number of paths] in descending order if padded steps are skipped, otherwise None
+        :return: relation_encoder_out [number of paths, relation_encoder_dim], and initial h and c of the full encoder
+                 [number of paths, full_encoder_dim]
+        """
+        versions = self.get_parameter_versions(model)
+        if versions != self.parameter_versions:
+            self.clear()
+            self.parameter_versions = versions
+
+        # if padded steps are skipped, paths with the same real steps have the same encoding regardless of padding
+        keys = [tuple(row) for row in relations.tolist()]
+        if lengths is not None:
+            if model.pre_padding:
+                keys = [(True,) + key[len(key) - length:] for key, length in zip(keys, lengths.tolist())]
+            else:
+                keys = [(True,) + key[:length] for key, length in zip(keys, lengths.tolist())]
+
+        hit_paths = []
+        hit_rows = []
+        # relation sequence -> paths
+        missed_paths = collections.OrderedDict()
+        for path, key in enumerate(keys):
+            row = self.rows.get(key)
+            if row is None:
+                missed_paths.setdefault(key, []).append(path)
+            else:
+                self.rows.move_to_end(key)
+                hit_paths.append(path)
+                hit_rows.append(row)
+        self.hits += len(hit_paths)
+        self.misses += len(keys) - len(hit_paths)
+
+        device = relation_embeds.device
+        relation_encoder_dim = model.relation_encoder.rnn_hidden_dim
+        full_encoder_dim = model.init_h.out_features
+        outputs = relation_embeds.new_empty(len(keys), relation_encoder_dim + 2 * full_encoder_dim)
+        if hit_paths:
+            outputs[torch.tensor(hit_paths, device=device)] = self.cached[torch.tensor(hit_rows, device=device)]
+        if missed_paths:
+            # each missed relation sequence is encoded once. Paths keep their order, so lengths stay sorted.
+            first_paths = torch.tensor([paths[0] for paths in missed_paths.values()], device=device)
+            relation_encoder_out = model.relation_encoder(relation_embeds[first_paths],
+                                                          lengths[first_paths] if lengths is not None else None,
+                                                          model.pre_padding)
+            h, c = model.init_hidden(relation_encoder_out)
+            encoded = torch.cat((relation_encoder_out, h, c), dim=1)
+            paths = [path for paths in missed_paths.values() for path in paths]
+            sequences = [sequence for sequence, paths in enumerate(missed_paths.values()) for _ in paths]
+            outputs[torch.tensor(paths, device=device)] = encoded[torch.tensor(sequences, device=device)]
+            self.insert(list(missed_paths.keys()), encoded)
+
+        return outputs.split([relation_encoder_dim, full_encoder_dim, full_encoder_dim], dim=1)
+
+    def insert(self, keys, encoded):
+        # only the last max_size sequences fit
+        keys = keys[-self.max_size:]
+        encoded = encoded[-self.max_size:]
+        if self.cached is None:
+            self.cached = encoded.new_empty(min(max(2 * len(keys), 1024), self.max_size), encoded.shape[1])
+        rows = []
+        for key in keys:
+            if len(self.rows) < self.max_size:
+                row = len(self.rows)
+            else:
+                _, row = self.rows.popitem(last=False)
+            self.rows[key] = row
+            rows.append(row)
+        if len(self.rows) > len(self.cached):
+            # grow the cached tensor by doubling
+            grown = self.cached.new_empty(min(max(2 * len(self.cached), len(self.rows)), self.max_size),
+                                          self.cached.shape[1])
+            grown[:len(self.cached)] = self.cached
+            self.cached = grown
+        self.cached[torch.tensor(rows, device=encoded.device)] = encoded
@@ -0,0 +1,288 @@
+from typing import List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.rnn import pack_padded_sequence
+
+
+class SatAttention(nn.Module):
+    """
+    "sat" type attention of :meth:`main.playground.model2.CompositionalVectorSpaceModel.Attention`.
+    """
+
+    def __init__(self, attention):
+        super(SatAttention, self).__init__()
+        self.type_encoder_att = attention.type_encoder_att
+        self.full_encoder_att = attention.full_encoder_att
+        self.full_att = attention.full_att
+
+    def project_types(self, types_embeds: torch.Tensor, type_mask: Optional[torch.Tensor]) -> torch.Tensor:
+        if type_mask is None:
+            return self.type_encoder_att(types_embeds)
+        projected_types = torch.zeros(types_embeds.shape[:-1] + (self.type_encoder_att.out_features,),
+                                      dtype=types_embeds.dtype, device=types_embeds.device)
+        projected_types[type_mask] = self.type_encoder_att(types_embeds[type_mask])
+        return projected_types
+
+    def forward(self, projected_types: torch.Tensor, full_encoder_hidden: torch.Tensor,
+                type_mask: Optional[torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+        att2 = self.full_encoder_att(full_encoder_hidden)
+        att = self.full_att(torch.relu(projected_types + att2.unsqueeze(1))).squeeze(2)
+        if type_mask is None:
+            alpha = torch.softmax(att, dim=1)
+        else:
+            alpha = torch.softmax(att.masked_fill(~type_mask, float("-inf")), dim=1).masked_fill(~type_mask, 0.0)
+        return (projected_types * alpha.unsqueeze(2)).sum(dim=1), alpha
+
+
+class SlotAttention(nn.Module):
+    """
+    "abstract" (the last type slot) and "specific" (the first type slot) attention of
+    :meth:`main.playground.model2.CompositionalVectorSpaceModel.Attention`.
+    """
+
+    def __init__(self, attention, slot):
+        super(SlotAttention, self).__init__()
+        self.type_encoder_att = attention.type_encoder_att
+        self.slot = slot
+
+    def project_types(self, types_embeds: torch.Tensor, type_mask: Optional[torch.Tensor]) -> torch.Tensor:
+        return self.type_encoder_att(types_embeds)
+
+    def forward(self, projected_types: torch.Tensor, full_encoder_hidden: torch.Tensor,
+                type_mask: Optional[torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+        alpha = torch.zeros(projected_types.shape[:2], device=projected_types.device)
+        alpha[:, self.slot] = 1.0
+        return projected_types[:, self.slot, :], alpha
+
+
+class SatPooling(nn.Module):
+
+    def __init__(self, model):
+        super(SatPooling, self).__init__()
+        self.path_att = model.path_att
+        self.att = model.att
+        self.path_context = model.path_context
+        self.fc = model.fc
+
+    def forward(self, h: torch.Tensor, path_mask: Optional[torch.Tensor], num_ent_pairs: int,
+                num_paths: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        att = self.att(torch.relu(self.path_att(h) + self.path_context)).view(num_ent_pairs, num_paths, -1)
+        if path_mask is not None:
+            att = att.masked_fill(~path_mask.unsqueeze(2), float("-inf"))
+        path_weights = torch.softmax(att, dim=1)
+        paths_weighted_sum = (h.view(num_ent_pairs, num_paths, -1) * path_weights).sum(dim=1)
+        probs = torch.sigmoid(self.fc(paths_weighted_sum)).squeeze(1)
+        return probs, path_weights.view(num_ent_pairs, num_paths)
+
+
+class ScorePooling(nn.Module):
+    """
+    "lse", "max", and "avg" pooling of path scores.
+    """
+
+    def __init__(self, model):
+        super(ScorePooling, self).__init__()
+        self.fc = model.fc
+        self.pooling_method = model.pooling_method
+
+    def forward(self, h: torch.Tensor, path_mask: Optional[torch.Tensor], num_ent_pairs: int,
+                num_paths: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        path_scores = self.fc(h).view(num_ent_pairs, num_paths, -1)
+        if self.pooling_method == "avg":
+            if path_mask is not None:
+                path_scores = path_scores.masked_fill(~path_mask.unsqueeze(2), 0.0)
+            scores = path_scores.sum(dim=1)
+        else:
+            if path_mask is not None:
+                path_scores = path_scores.masked_fill(~path_mask.unsqueeze(2), float("-inf"))
+            if self.pooling_method == "lse":
+                scores = torch.logsumexp(path_scores, dim=1)
+            else:
+                scores = path_scores.max(dim=1)[0]
+        # these methods do not weight paths
+        path_weights = torch.empty(num_ent_pairs, num_paths, device=h.device)
+        return torch.sigmoid(scores).squeeze(1), path_weights
+
+
+class ScriptableCompositionalVectorSpaceModel(nn.Module):
+    """
+    This class runs a trained :meth:`main.playground.model2.CompositionalVectorSpaceModel` for inference in a form
+    that can be compiled by TorchScript. Pooling and attention methods are resolved to submodules at construction
+    instead of being compared as strings in forward(), and parameters are shared with the model.
+
+    Compiled models run the step loop without the Python interpreter, and can be saved with
+    :meth:`export_torchscript` and served with torch.jit.load() without this repository.
+
+    Supported pooling methods are "sat", "lse", "max", and "avg". Supported attention methods are "sat", "abstract",
+    and "specific".
+    """
+
+    def __init__(self, model):
+        """
+        :param model: :meth:`main.playground.model2.CompositionalVectorSpaceModel`
+        """
+        super(ScriptableCompositionalVectorSpaceModel, self).__init__()
+        feature_embeddings = model.feature_embeddings
+        self.relation_embeddings = feature_embeddings.relation_embeddings
+        self.entity_types_embeddings = feature_embeddings.entity_types_embeddings
+        self.type_pad_index = feature_embeddings.type_pad_index
+        self.has_entity_type_rows = feature_embeddings.entity_type_rows is not None
+        if self.has_entity_type_rows:
+            self.register_buffer("entity_type_rows", feature_embeddings.entity_type_rows, persistent=False)
+        else:
+            self.register_buffer("entity_type_rows", torch.zeros(0, 0, dtype=torch.long), persistent=False)
+        self.mask_padded_types = model.mask_padded_types
+        self.skip_padded_steps = model.skip_padded_steps
+        self.pre_padding = model.pre_padding
+        self.deduplicate_paths = model.deduplicate_paths
+        # projected types of entities are computed when the model is exported
+        self.has_type_keys = self.has_entity_type_rows and model.precompute_type_keys
+        if self.has_type_keys:
+            self.register_buffer("type_keys", model.get_type_keys(), persistent=False)
+        else:
+            self.register_buffer("type_keys", torch.zeros(0, 0, 0), persistent=False)
+
+        self.lstm = model.relation_encoder.lstm
+        self.init_h = model.init_h
+        self.init_c = model.init_c
+        self.f_beta = model.f_beta
+        self.full_encoder_step = model.full_encoder_step
+
+        attention_method = model.attention.attention_method
+        if attention_method == "sat":
+            self.attention = SatAttention(model.attention)
+        elif attention_method == "abstract":
+            self.attention = SlotAttention(model.attention, -1)
+        elif attention_method == "specific":
+            self.attention = SlotAttention(model.attention, 0)
+        else:
+            raise Exception("Attention method not supported by TorchScript:", attention_method)
+
+        if model.number_of_target_relations is not None:
+            raise Exception("Models of multiple target relations are not supported by TorchScript.")
+        if model.pooling_method == "sat":
+            self.pooling = SatPooling(model)
+        elif model.pooling_method in ("lse", "max", "avg"):
+            self.pooling = ScorePooling(model)
+        else:
+            raise Exception("Pooling method not supported by TorchScript:", model.pooling_method)
+
+    def forward(self, x: torch.Tensor, path_mask: Optional[torch.Tensor] = None,
+                lengths: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        # see CompositionalVectorSpaceModel.forward()
+        num_ent_pairs, num_paths, num_steps, num_feats = x.shape
+        reshaped_batch_size = num_ent_pairs * num_paths
+        x = x.reshape(reshaped_batch_size, num_steps, num_feats)
+        if lengths is not None:
+            lengths = lengths.reshape(reshaped_batch_size)
+
+        if self.deduplicate_paths:
+            unique_x, inverse = torch.unique(x.reshape(reshaped_batch_size, -1), return_inverse=True, dim=0)
+            unique_x = unique_x.reshape(-1, num_steps, num_feats)
+            if lengths is not None:
+                lengths = lengths.new_empty(unique_x.shape[0]).scatter_(0, inverse, lengths)
+            h, alphas = self.encode_paths(unique_x, lengths)
+            h = h[inverse]
+            alphas = alphas[inverse]
+        else:
+            h, alphas = self.encode_paths(x, lengths)
+        probs, path_weights = self.pooling(h, path_mask, num_ent_pairs, num_paths)
+        return probs, path_weights, alphas.view(num_ent_pairs, num_paths, num_steps, alphas.shape[2])
+
+    def encode_paths(self, x: torch.Tensor, lengths: Optional[torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+        # see CompositionalVectorSpaceModel.encode_paths()
+        reshaped_batch_size, num_steps, num_feats = x.shape
+
+        order: Optional[torch.Tensor] = None
+        sorted_lengths: Optional[torch.Tensor] = None
+        active_paths: List[int] = [reshaped_batch_size] * num_steps
+        if self.skip_padded_steps and lengths is not None:
+            sorted_lengths, order = torch.sort(lengths.clamp(min=1, max=num_steps), descending=True)
+            x = x[order]
+            steps = torch.arange(num_steps, device=x.device).unsqueeze(1)
+            if self.pre_padding:
+                active = sorted_lengths.unsqueeze(0) >= num_steps - steps
+            else:
+                active = sorted_lengths.unsqueeze(0) > steps
+            active_paths = torch.jit.annotate(List[int], active.sum(dim=1).tolist())
+
+        relation_embeds = self.relation_embeddings(x[:, :, -1])
+        if self.has_entity_type_rows and num_feats == 2:
+            type_ids = self.entity_type_rows[x[:, :, 0]]
+        else:
+            type_ids = x[:, :, :-2]
+        projected_types: Optional[torch.Tensor] = None
+        types_embeds: Optional[torch.Tensor] = None
+        if self.has_type_keys and num_feats == 2:
+            projected_types = self.type_keys[x[:, :, 0]]
+            num_types = self.type_keys.shape[1]
+        else:
+            types_embeds = self.entity_types_embeddings(type_ids)
+            num_types = type_ids.shape[2]
+        type_mask: Optional[torch.Tensor] = None
+        if self.mask_padded_types:
+            real_types = type_ids != self.type_pad_index
+            num_real_types = max(int(real_types.sum(dim=2).max()), 1)
+            type_mask = real_types[:, :, :num_real_types]
+            if types_embeds is not None:
+                types_embeds = types_embeds[:, :, :num_real_types]
+            if projected_types is not None:
+                projected_types = projected_types[:, :, :num_real_types]
+
+        hidden_state = torch.zeros(1, reshaped_batch_size, self.lstm.hidden_size, device=x.device)
+        if sorted_lengths is not None:
+            if self.pre_padding:
+                steps = torch.arange(num_steps, device=x.device).unsqueeze(0)
+                index = (steps + (num_steps - sorted_lengths).unsqueeze(1)) % num_steps
+                relation_embeds = relation_embeds.gather(1, index.unsqueeze(2).expand(-1, -1, relation_embeds.shape[2]))
+            packed = pack_padded_sequence(relation_embeds, sorted_lengths.cpu(), batch_first=True)
+            _, (last_hidden, _) = self.lstm(packed, (hidden_state, torch.zeros_like(hidden_state)))
+        else:
+            _, (last_hidden, _) = self.lstm(relation_embeds, (hidden_state, torch.zeros_like(hidden_state)))
+        relation_encoder_out = last_hidden.squeeze(0)
+
+        h = self.init_h(relation_encoder_out)
+        c = self.init_c(relation_encoder_out)
+        if projected_types is None:
+            assert types_embeds is not None
+            projected_types = self.attention.project_types(types_embeds, type_mask)
+        alphas = torch.zeros(reshaped_batch_size, num_steps, num_types, device=x.device)
+        for t in range(num_steps):
+            n = active_paths[t]
+            if n == 0:
+                continue
+            type_mask_t: Optional[torch.Tensor] = None
+            if type_mask is not None:
+                type_mask_t = type_mask[:n, t, :]
+            h_t = h[:n]
+            attention_weighted_encoding, alpha = self.attention(projected_types[:n, t], h_t, type_mask_t)
+            gate = torch.sigmoid(self.f_beta(h_t))
+            h_t, c_t = self.full_encoder_step(gate * attention_weighted_encoding, (h_t, c[:n]))
+            if n == reshaped_batch_size:
+                h, c = h_t, c_t
+            else:
+                h = torch.cat((h_t, h[n:]))
+                c = torch.cat((c_t, c[n:]))
+            alphas[:n, t, :alpha.shape[1]] = alpha
+
+        h = torch.cat((h, relation_encoder_out), dim=1)
+        if order is not None:
+            inverse_order = torch.argsort(order)
+            h = h[inverse_order]
+            alphas = alphas[inverse_order]
+        return h, alphas
+
+
+def export_torchscript(model, filename=None):
+    """
+    Compile a trained model with TorchScript for inference.
+
+    :param model: :meth:`main.playground.model2.CompositionalVectorSpaceModel`
+    :param filename: if given, the compiled model is saved to this file, which can be loaded by torch.jit.load()
+    :return: the compiled model
+    """
+    scripted_model = torch.jit.script(ScriptableCompositionalVectorSpaceModel(model).eval())
+    if filename is not None:
+        scripted_model.save(filename)
+    return scripted_model
@@ -0,0 +1,102 @@
+import numpy as np
+
+# Default dimensions of the APR model (see CompositionalVectorAlgorithm.train), used to estimate FLOPs.
+RELATION_EMBEDDING_DIM = 50
+ENTITY_TYPE_EMBEDDING_DIM = 300
+ATTENTION_DIM = 50
+RELATION_ENCODER_DIM = 150
+FULL_ENCODER_DIM = 150
+
+
+def choose_limit(counts, coverage, upper_limit):
+    """
+    Choose the smallest limit so that at least a coverage fraction of the counted values are no greater than the limit.
+
+    :param counts: a dict mapping from a value (e.g., path length or type depth) to its count
+    :param coverage: e.g., 0.995 to keep 99.5% of values untruncated
+    :param upper_limit: the limit will not exceed this value
+    :return:
+    """
+    total = sum(counts.values())
+    if total == 0:
+        return upper_limit
+    covered = 0
+    for value in sorted(counts):
+        covered += counts[value]
+        if covered >= coverage * total:
+            return max(1, min(value, upper_limit))
+    return upper_limit
+
+
+def count_type_depths(steps, entity_type_table):
+    """
+    Count the number of types of the entity at each step.
+
+    :param steps: [total_steps, 3] steps in the intermediate form of :meth:`main.playground.PathEncoder.encode_paths`
+    :param entity_type_table: :meth:`main.data.EntityTypeTable`
+    :return: a dict mapping from a type depth to its count
+    """
+    depth_counts = np.bincount(entity_type_table.type_depths[steps[:, 0]])
+    return {depth: int(count) for depth, count in enumerate(depth_counts) if count > 0}
+
+
+def estimate_flops_per_path(num_steps, num_types, entity_type_embedding_dim=ENTITY_TYPE_EMBEDDING_DIM):
+    """
+    Estimate the FLOPs of the forward pass of APR for one path, counting multiply-adds as 2 FLOPs. Pooling over paths
+    is ignored because it does not depend on padding.
+
+    :param num_steps: the number of steps the path is padded to
+    :param num_types: the number of type slots of each step
+    :param entity_type_embedding_dim:
+    :return:
+    """
+    relation_encoder = 8 * RELATION_ENCODER_DIM * (RELATION_EMBEDDING_DIM + RELATION_ENCODER_DIM)
+    full_encoder = 8 * FULL_ENCODER_DIM * (ATTENTION_DIM + FULL_ENCODER_DIM)
+    # full_encoder_att and f_beta
+    attention_per_step = 2 * 2 * FULL_ENCODER_DIM * ATTENTION_DIM
+    # type_encoder_att and full_att
+    attention_per_type = 2 * entity_type_embedding_dim * ATTENTION_DIM + 2 * ATTENTION_DIM
+    return num_steps * (relation_encoder + full_encoder + attention_per_step + num_types * attention_per_type)
+
+
+def report_padding_savings(rel, path_length_counts, type_depth_counts, fixed_length, fixed_slots, length, slots,
+                           include_types=True):
+    """
+    Report how many paths and types are truncated by the chosen limits and the memory and FLOPs saved compared with
+    the fixed limits.
+
+    :param rel: the name of the relation
+    :param path_length_counts: a dict mapping from a path length (number of steps) to the number of paths
+    :param type_depth_counts: a dict mapping from a type depth to the number of steps
+    :param fixed_length: the number of steps paths are padded to with fixed limits
+    :param fixed_slots: the number of type slots with fixed limits
+    :param length: the chosen number of steps
+    :param slots: the chosen number of type slots
+    :param include_types: whether steps have type features
+    :return: a dict of statistics
+    """
+    fixed_paths = sum(count for path_len, count in path_length_counts.items() if path_len <= fixed_length)
+    paths = sum(count for path_len, count in path_length_counts.items() if path_len <= length)
+    total_steps = sum(type_depth_counts.values())
+    truncated_steps = sum(count for depth, count in type_depth_counts.items() if depth > slots)
+    if not include_types:
+        fixed_slots = slots = 0
+    # each step has type features, one entity, and one relation stored as int64
+    fixed_memory = fixed_paths * fixed_length * (fixed_slots + 2) * 8
+    memory = paths * length * (slots + 2) * 8
+    fixed_flops = fixed_paths * estimate_flops_per_path(fixed_length, fixed_slots)
+    flops = paths * estimate_flops_per_path(length, slots)
+
+    stats = {"max_length": length, "num_entity_types_slots": slots,
+             "fixed_max_length": fixed_length, "fixed_num_entity_types_slots": fixed_slots,
+             "truncated_paths": fixed_paths - paths, "paths": paths,
+             "steps_with_truncated_types": truncated_steps, "steps": total_steps,
+             "memory": memory, "fixed_memory": fixed_memory, "flops": flops, "fixed_flops": fixed_flops}
+    print("[{}] Padding limits: {} steps (fixed {}), {} type slots (fixed {})".format(
+        rel, length, fixed_length, slots, fixed_slots))
+    print("[{}] Truncated {}/{} paths and types of {}/{} steps".format(
+        rel, fixed_paths - paths, fixed_paths, truncated_steps, total_steps))
+    print("[{}] Input memory {:.1f}MB (fixed {:.1f}MB, {:.1f}% saved), forward FLOPs {:.3g} (fixed {:.3g}, {:.1f}% saved)"
+          .format(rel, memory / 1e6, fixed_memory / 1e6, 100.0 * (1 - memory / max(fixed_memory, 1)),
+                  flops, fixed_flops, 100.0 * (1 - flops / max(fixed_flops, 1))))
+    return stats
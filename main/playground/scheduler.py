@@ -0,0 +1,125 @@
+import heapq
+import os
+import numpy as np
+
+from main.playground.Batcher import Batcher
+from main.playground.PathEncoder import SHARD_INDEX_SUFFIX
+
+
+def estimate_training_cost(relation_dir, split="train"):
+    """
+    Estimate the cost of training a relation by the number of path steps in its training split. Only sizes of files
+    are read, e.g., from shard indices and .npz headers, so no data is loaded.
+
+    :param relation_dir: the folder of a relation with train, dev, and test folders
+    :param split:
+    :return: the number of path steps (entity pairs x paths x steps)
+    """
+    files_dir = os.path.join(relation_dir, split)
+    files = os.listdir(files_dir)
+    sizes = []
+    shard_index_files = [file for file in files if file.endswith(SHARD_INDEX_SUFFIX)]
+    if shard_index_files:
+        for file in shard_index_files:
+            filename = os.path.join(files_dir, file)
+            for group in range(len(np.load(filename)) - 1):
+                sizes.append(Batcher.read_size(filename, group))
+    else:
+        for file in files:
+            if file[-3:] == "int" or file[-3:] == "npz":
+                sizes.append(Batcher.read_size(os.path.join(files_dir, file)))
+    return sum(int(number_entity_pairs) * int(number_of_paths) * int(path_length)
+               for number_entity_pairs, number_of_paths, path_length, _ in sizes)
+
+
+def schedule_largest_first(costs, number_of_workers):
+    """
+    Order jobs for a pool of workers in which the worker that becomes free first takes the next job. Jobs are first
+    assigned to workers from the largest cost to the smallest, and the assignment is improved by moving or swapping
+    jobs of the busiest worker. Each worker then runs its jobs from the largest to the smallest, so the largest job is
+    started first and a large job does not end up running alone.
+
+    :param costs: a dict of job to cost
+    :param number_of_workers:
+    :return: jobs in the order they should be started, and the predicted total cost of the busiest worker
+    """
+    largest_first = sorted(costs, key=lambda job: costs[job], reverse=True)
+    number_of_workers = max(min(number_of_workers, len(largest_first)), 1)
+    assignment = [[] for _ in range(number_of_workers)]
+    loads = [0] * number_of_workers
+    for job in largest_first:
+        worker = loads.index(min(loads))
+        assignment[worker].append(job)
+        loads[worker] += costs[job]
+    improve_assignment(costs, assignment, loads)
+
+    # replay the pool: the worker that becomes free first starts its next job. The worker with the largest job starts
+    # first.
+    assignment = [sorted(jobs, key=lambda job: costs[job], reverse=True) for jobs in assignment]
+    assignment.sort(key=lambda jobs: costs[jobs[0]] if jobs else 0, reverse=True)
+    order = []
+    next_jobs = [0] * number_of_workers
+    workers = [(0, worker) for worker in range(number_of_workers)]
+    while workers:
+        time, worker = heapq.heappop(workers)
+        if next_jobs[worker] < len(assignment[worker]):
+            order.append(assignment[worker][next_jobs[worker]])
+            next_jobs[worker] += 1
+            heapq.heappush(workers, (time + costs[order[-1]], worker))
+
+    # the pool may give a job to a worker other than the planned one, e.g., when a worker runs out of planned jobs
+    makespan = simulate_pool(costs, order, number_of_workers)
+    largest_first_makespan = simulate_pool(costs, largest_first, number_of_workers)
+    if largest_first_makespan <= makespan:
+        return largest_first, largest_first_makespan
+    return order, makespan
+
+
+def improve_assignment(costs, assignment, loads):
+    """
+    Move a job from the busiest worker to another worker, or swap it with a smaller job of another worker, while this
+    makes both workers less busy than the busiest worker was. Every change lowers the sum of squared loads, so this
+    stops.
+
+    :param costs: a dict of job to cost
+    :param assignment: a list of jobs of each worker, changed in place
+    :param loads: the total cost of each worker, changed in place
+    """
+    improved = True
+    while improved:
+        improved = False
+        busiest = loads.index(max(loads))
+        for job in assignment[busiest]:
+            for worker in range(len(assignment)):
+                if worker == busiest:
+                    continue
+                # None moves the job without a job in return
+                for other_job in [None] + assignment[worker]:
+                    difference = costs[job] - (0 if other_job is None else costs[other_job])
+                    if difference > 0 and loads[worker] + difference < loads[busiest]:
+                        assignment[busiest].remove(job)
+                        assignment[worker].append(job)
+                        if other_job is not None:
+                            assignment[worker].remove(other_job)
+                            assignment[busiest].append(other_job)
+                        loads[busiest] -= difference
+                        loads[worker] += difference
+                        improved = True
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+
+
+def simulate_pool(costs, order, number_of_workers):
+    """
+    :param costs: a dict of job to cost
+    :param order: jobs in the order they are started
+    :param number_of_workers:
+    :return: the total cost of the busiest worker when the worker that becomes free first takes the next job
+    """
+    workers = [0] * max(min(number_of_workers, len(order)), 1)
+    for job in order:
+        heapq.heappush(workers, heapq.heappop(workers) + costs[job])
+    return max(workers)
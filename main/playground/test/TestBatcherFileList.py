@@ -1,12 +1,39 @@
 import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
 from main.playground.BatcherFileList import BatcherFileList
-from tqdm import tqdm
+from main.playground.PathEncoder import write_int_file, write_npz_file
+
+
+def write_files(files_dir, extension, number_of_steps=4, number_of_features=3, seed=0):
+    """
+    Write random pre-padded entity pairs with 1 to 4 paths to one .int or .npz file for each number of paths.
+    """
+    rng = np.random.RandomState(seed)
+    os.makedirs(files_dir)
+    for number_of_paths, number_of_pairs in ((1, 70), (2, 45), (3, 33), (4, 9)):
+        labels = rng.randint(0, 2, number_of_pairs)
+        inputs = rng.randint(1, 50, (number_of_pairs, number_of_paths, number_of_steps, number_of_features))
+        lengths = np.full((number_of_pairs, number_of_paths), number_of_steps)
+        filename = os.path.join(files_dir, "dev.{}.{}".format(number_of_paths, extension))
+        if extension == "int":
+            write_int_file(filename, labels, inputs, lengths, True)
+        else:
+            write_npz_file(filename, labels, inputs, lengths)
 
 
 class TestBatcherFileList(unittest.TestCase):
     def setUp(self):
-        # need to specify correct absolute path to data
-        self.files_dir = "data/wordnet18rr/cvsm_entity/data/auto_generated_data_output/also_see/dev"
+        self.dir = tempfile.mkdtemp()
+        self.files_dir = os.path.join(self.dir, "int")
+        write_files(self.files_dir, "int")
+        self.npz_files_dir = os.path.join(self.dir, "npz")
+        write_files(self.npz_files_dir, "npz")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
 
     def test_shuffled_iterations(self):
         batcher = BatcherFileList(self.files_dir, batch_size=32, shuffle=True, max_number_batchers_on_gpu=100)
@@ -18,7 +45,7 @@ class TestBatcherFileList(unittest.TestCase):
             count += 1
 
         count1 = 0
-        for i in tqdm(range(0, count)):
+        for i in range(0, count):
             data = batcher.get_batch()
             count1 += 1
 
@@ -43,9 +70,22 @@ class TestBatcherFileList(unittest.TestCase):
             list_path_numbers1.append(data[0].shape[1])
         assert list_path_numbers == list_path_numbers1
 
+    def test_lazy_iterations(self):
+        for files_dir in (self.files_dir, self.npz_files_dir):
+            batcher = BatcherFileList(files_dir, batch_size=32, shuffle=False, max_number_batchers_on_gpu=2)
+            lazy_batcher = BatcherFileList(files_dir, batch_size=32, shuffle=False, max_number_batchers_on_gpu=2,
+                                           lazy=True)
+            assert len(batcher) == len(lazy_batcher)
+            number_of_pairs = 0
+            for (inputs, labels, _, _), (lazy_inputs, lazy_labels, _, _) in zip(batcher, lazy_batcher):
+                assert inputs.equal(lazy_inputs)
+                assert labels.equal(lazy_labels)
+                number_of_pairs += len(labels)
+                # only batchers in the current window are loaded
+                assert sum(b is not None for b in lazy_batcher.batchers) <= 2
+            assert number_of_pairs == 157
+            lazy_batcher.close()
 
 
-
-
-
-
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+import unittest
+import tempfile
+import shutil
+import os
+import json
+import numpy as np
+from main.playground.BucketBatcher import BucketBatcher
+from main.playground.PathEncoder import write_npz_file
+
+PAD = 99
+
+
+def write_relation(relation_dir, pre_padding, number_of_steps=5, number_of_features=3, seed=0):
+    """
+    Write random entity pairs with 1 to 4 paths of 1 to number_of_steps steps to .npz files of the train split, and
+    record the padding in statistics.json.
+
+    :return: a dict from the number of paths to (labels, inputs, lengths) of the entity pairs
+    """
+    rng = np.random.RandomState(seed)
+    split_dir = os.path.join(relation_dir, "train")
+    os.makedirs(split_dir)
+    groups = {}
+    for number_of_paths, number_of_pairs in ((1, 7), (2, 5), (3, 6), (4, 3)):
+        labels = rng.randint(0, 2, number_of_pairs)
+        lengths = rng.randint(1, number_of_steps + 1, (number_of_pairs, number_of_paths))
+        inputs = np.full((number_of_pairs, number_of_paths, number_of_steps, number_of_features), PAD, dtype=np.int64)
+        for pair in range(number_of_pairs):
+            for path in range(number_of_paths):
+                length = lengths[pair, path]
+                steps = rng.randint(0, PAD, (length, number_of_features))
+                if pre_padding:
+                    inputs[pair, path, number_of_steps - length:] = steps
+                else:
+                    inputs[pair, path, :length] = steps
+        write_npz_file(os.path.join(split_dir, "train.{}.npz".format(number_of_paths)), labels, inputs, lengths)
+        groups[number_of_paths] = (labels, inputs, lengths)
+    with open(os.path.join(relation_dir, "statistics.json"), "w") as fh:
+        json.dump({"pre_padding": pre_padding}, fh)
+    return groups
+
+
+def get_real_steps(path, length, pre_padding):
+    return path[len(path) - length:] if pre_padding else path[:length]
+
+
+class TestBucketBatcher(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_buckets(self):
+        relation_dir = os.path.join(self.dir, "rel")
+        groups = write_relation(relation_dir, True)
+        expected = sorted((labels[pair], inputs[pair].tobytes()) for labels, inputs, _ in groups.values()
+                          for pair in range(len(labels)))
+
+        batcher = BucketBatcher(os.path.join(relation_dir, "train"), batch_size=4, shuffle=True, number_of_buckets=2,
+                                trim_steps=False, queue_depth=0, device="cpu")
+        pairs = []
+        numbers_of_paths = set()
+        for inputs, labels, path_mask, lengths in batcher:
+            self.assertLessEqual(len(labels), 4)
+            self.assertIsNone(lengths)
+            numbers_of_paths.add(inputs.shape[1])
+            for pair in range(len(labels)):
+                number_of_paths = path_mask[pair].sum().item()
+                # real paths come first, and padded paths copy the first path
+                self.assertTrue(path_mask[pair, :number_of_paths].all())
+                self.assertTrue((inputs[pair, number_of_paths:] == inputs[pair, :1]).all())
+                pairs.append((labels[pair].item(), inputs[pair, :number_of_paths].numpy().tobytes()))
+        # groups of 1 and 2 paths and groups of 3 and 4 paths are bucketed together
+        self.assertEqual(numbers_of_paths, {2, 4})
+        # every entity pair is batched once
+        self.assertEqual(sorted(pairs), expected)
+
+    def test_trim_steps(self):
+        for pre_padding in (True, False):
+            relation_dir = os.path.join(self.dir, "pre" if pre_padding else "post")
+            groups = write_relation(relation_dir, pre_padding)
+            expected = sorted(tuple(map(tuple, get_real_steps(inputs[pair, path], lengths[pair, path],
+                                                              pre_padding).tolist()))
+                              for _, inputs, lengths in groups.values()
+                              for pair in range(len(inputs)) for path in range(inputs.shape[1]))
+
+            # the padding is read from statistics.json
+            batcher = BucketBatcher(os.path.join(relation_dir, "train"), batch_size=4, shuffle=False,
+                                    number_of_buckets=2, queue_depth=0, device="cpu")
+            self.assertEqual(batcher.pre_padding, pre_padding)
+            real_steps = []
+            for inputs, labels, path_mask, lengths in batcher:
+                # steps are trimmed to the longest path of the batch
+                self.assertEqual(inputs.shape[2], lengths.max().item())
+                for pair in range(len(labels)):
+                    for path in path_mask[pair].nonzero().squeeze(1).tolist():
+                        steps = get_real_steps(inputs[pair, path], lengths[pair, path].item(), pre_padding)
+                        # no real step is trimmed
+                        self.assertTrue((steps != PAD).all())
+                        real_steps.append(tuple(map(tuple, steps.tolist())))
+            self.assertEqual(sorted(real_steps), expected)
+
+    def test_max_path_steps(self):
+        relation_dir = os.path.join(self.dir, "rel")
+        write_relation(relation_dir, False)
+        for trim_steps in (True, False):
+            batcher = BucketBatcher(os.path.join(relation_dir, "train"), batch_size=6, shuffle=True,
+                                    number_of_buckets=2, trim_steps=trim_steps, queue_depth=0, device="cpu",
+                                    max_path_steps=30)
+            numbers_of_pairs = []
+            for inputs, labels, _, _ in batcher:
+                self.assertLessEqual(len(labels), 6)
+                # only a pair over the budget is batched alone
+                if len(labels) > 1:
+                    self.assertLessEqual(inputs.shape[0] * inputs.shape[1] * inputs.shape[2], 30)
+                numbers_of_pairs.append(len(labels))
+            self.assertEqual(sum(numbers_of_pairs), 21)
+            # pairs with fewer paths are batched in larger batches
+            self.assertGreater(max(numbers_of_pairs), min(numbers_of_pairs))
+
+    def test_ranks(self):
+        relation_dir = os.path.join(self.dir, "rel")
+        groups = write_relation(relation_dir, True)
+        expected = sorted(inputs[pair, :, -1].tobytes() for _, inputs, _ in groups.values()
+                          for pair in range(len(inputs)))
+        batchers = [BucketBatcher(os.path.join(relation_dir, "train"), batch_size=2, shuffle=True, number_of_buckets=2,
+                                  queue_depth=0, device="cpu", rank=rank, world_size=3, seed=7) for rank in range(3)]
+        numbers_of_batches = [len(batcher) for batcher in batchers]
+        self.assertLessEqual(max(numbers_of_batches) - min(numbers_of_batches), 1)
+        for _ in range(2):
+            # ranks have disjoint batches that cover all entity pairs in every epoch
+            pairs = []
+            for batcher in batchers:
+                for inputs, _, path_mask, _ in batcher:
+                    for pair in range(len(inputs)):
+                        pairs.append(inputs[pair, path_mask[pair], -1].numpy().tobytes())
+            self.assertEqual(sorted(pairs), expected)
+
+    def test_unknown_padding(self):
+        relation_dir = os.path.join(self.dir, "rel")
+        write_relation(relation_dir, True)
+        os.remove(os.path.join(relation_dir, "statistics.json"))
+        with self.assertRaises(Exception):
+            BucketBatcher(os.path.join(relation_dir, "train"), batch_size=4, shuffle=False, queue_depth=0,
+                          device="cpu")
+        # the padding can be given if it is not recorded
+        batcher = BucketBatcher(os.path.join(relation_dir, "train"), batch_size=4, shuffle=False, queue_depth=0,
+                                device="cpu", pre_padding=True)
+        self.assertEqual(sum(len(labels) for _, labels, _, _ in batcher), 21)
+
+    def test_prefetch_failure(self):
+        relation_dir = os.path.join(self.dir, "rel")
+        write_relation(relation_dir, True)
+        batcher = BucketBatcher(os.path.join(relation_dir, "train"), batch_size=4, shuffle=False, queue_depth=2,
+                                device="cpu")
+        assemble_batch = batcher.assemble_batch
+
+        def fail(batch_index):
+            raise ValueError("batch {}".format(batch_index))
+
+        batcher.assemble_batch = fail
+        batcher.reset()
+        # the error is raised again instead of waiting for batches of the stopped thread
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                batcher.get_batch()
+        batcher.assemble_batch = assemble_batch
+        batcher.reset()
+        self.assertEqual(sum(len(labels) for _, labels, _, _ in batcher), 21)
+
+        # the thread stops without putting anything in the queue
+        batcher.put = lambda batch_queue, stop_event, item: False
+        batcher.reset()
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                batcher.get_batch()
+        del batcher.put
+        batcher.reset()
+        self.assertEqual(sum(len(labels) for _, labels, _, _ in batcher), 21)
+        batcher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
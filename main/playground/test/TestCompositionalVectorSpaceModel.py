@@ -0,0 +1,177 @@
+import unittest
+import torch
+from main.playground.model2.CompositionalVectorSpaceModel import CompositionalVectorSpaceModel
+
+NUMBER_OF_TYPES = 6
+NUMBER_OF_ENTITIES = 8
+NUMBER_OF_RELATIONS = 5
+
+
+def create_model(**kwargs):
+    entity_type_vocab = {"#PAD_TOKEN": 0}
+    entity_type_vocab.update(("type{}".format(i), i) for i in range(1, NUMBER_OF_TYPES))
+    torch.manual_seed(0)
+    model = CompositionalVectorSpaceModel(relation_vocab_size=NUMBER_OF_RELATIONS,
+                                          entity_vocab_size=NUMBER_OF_ENTITIES,
+                                          entity_type_vocab_size=NUMBER_OF_TYPES,
+                                          relation_embedding_dim=4,
+                                          entity_embedding_dim=4,
+                                          entity_type_embedding_dim=6,
+                                          entity_type_vocab=entity_type_vocab,
+                                          entity_type2vec_filename=None,
+                                          attention_dim=6,
+                                          relation_encoder_dim=5,
+                                          full_encoder_dim=5,
+                                          **kwargs)
+    model.eval()
+    return model
+
+
+def create_paths(lengths, number_of_steps, pre_padding, number_of_types=2, seed=0):
+    """
+    :param lengths: [number of paths], the number of real steps of each path
+    :return: paths [number of paths, number_of_steps, number_of_types + 2] of (types, entity, relation) steps, padded
+             with 0
+    """
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.zeros(len(lengths), number_of_steps, number_of_types + 2, dtype=torch.long)
+    for path, length in enumerate(lengths.tolist()):
+        steps = torch.cat((torch.randint(1, NUMBER_OF_TYPES, (length, number_of_types), generator=generator),
+                           torch.randint(1, NUMBER_OF_ENTITIES, (length, 1), generator=generator),
+                           torch.randint(1, NUMBER_OF_RELATIONS, (length, 1), generator=generator)), dim=1)
+        if pre_padding:
+            x[path, number_of_steps - length:] = steps
+        else:
+            x[path, :length] = steps
+    return x
+
+
+def get_real_steps(path, length, pre_padding):
+    return path[len(path) - length:] if pre_padding else path[:length]
+
+
+class TestCompositionalVectorSpaceModel(unittest.TestCase):
+    def test_masked_pooling(self):
+        numbers_of_paths = [3, 1, 2]
+        x = create_paths(torch.full((3 * 3,), 4), 4, True).view(3, 3, 4, -1)
+        path_mask = torch.arange(3).unsqueeze(0) < torch.tensor(numbers_of_paths).unsqueeze(1)
+        # padded paths copy the first path as in BucketBatcher
+        x[~path_mask] = x[:, :1].expand_as(x)[~path_mask]
+        for pooling_method in ("sat", "lse", "max", "avg"):
+            model = create_model(pooling_method=pooling_method)
+            with torch.no_grad():
+                probs, path_weights, _ = model(x, path_mask)
+                for pair, number_of_paths in enumerate(numbers_of_paths):
+                    # an entity pair scored alone with only its own paths
+                    expected_probs, expected_path_weights, _ = model(x[pair:pair + 1, :number_of_paths])
+                    self.assertTrue(torch.allclose(probs[pair], expected_probs[0], atol=1e-6))
+                    if pooling_method == "sat":
+                        self.assertTrue(torch.allclose(path_weights[pair, :number_of_paths], expected_path_weights[0],
+                                                       atol=1e-6))
+                        self.assertTrue((path_weights[pair, number_of_paths:] == 0).all())
+
+    def test_mask_padded_types(self):
+        # each path has 1 to 3 real type slots in every step, followed by padded slots
+        numbers_of_types = [3, 1, 2, 1, 3, 2]
+        x = create_paths(torch.full((6,), 4), 4, True, number_of_types=4)
+        for path, number_of_types in enumerate(numbers_of_types):
+            x[path, :, number_of_types:4] = 0
+        for attention_method in ("sat", "general"):
+            model = create_model(attention_method=attention_method, mask_padded_types=True)
+            unmasked_model = create_model(attention_method=attention_method)
+            with torch.no_grad():
+                h, alphas = model.encode_paths(x)
+                # the last type slot is padding in every path, so it is trimmed
+                self.assertTrue((alphas[:, :, 3] == 0).all())
+                for path, number_of_types in enumerate(numbers_of_types):
+                    # a path encoded alone without its padded type slots
+                    path_x = torch.cat((x[path:path + 1, :, :number_of_types], x[path:path + 1, :, 4:]), dim=2)
+                    expected_h, expected_alphas = unmasked_model.encode_paths(path_x)
+                    self.assertTrue(torch.allclose(h[path], expected_h[0], atol=1e-6))
+                    self.assertTrue(torch.allclose(alphas[path, :, :number_of_types], expected_alphas[0], atol=1e-6))
+                    self.assertTrue((alphas[path, :, number_of_types:] == 0).all())
+
+    def test_skip_padded_steps(self):
+        lengths = torch.tensor([2, 5, 1, 3, 5, 2, 4, 1])
+        for pre_padding in (True, False):
+            x = create_paths(lengths, 5, pre_padding)
+            model = create_model(skip_padded_steps=True, pre_padding=pre_padding)
+            with torch.no_grad():
+                h, alphas = model.encode_paths(x, lengths)
+                for path, length in enumerate(lengths.tolist()):
+                    # a path encoded alone without padded steps
+                    expected_h, expected_alphas = model.encode_paths(
+                        get_real_steps(x[path], length, pre_padding).unsqueeze(0))
+                    self.assertTrue(torch.allclose(h[path], expected_h[0], atol=1e-6))
+                    self.assertTrue(torch.allclose(get_real_steps(alphas[path], length, pre_padding),
+                                                   expected_alphas[0], atol=1e-6))
+                    # padded steps get no attention
+                    padded_alphas = alphas[path, :5 - length] if pre_padding else alphas[path, length:]
+                    self.assertTrue((padded_alphas == 0).all())
+
+    def test_deduplicate_paths(self):
+        lengths = torch.tensor([[2, 4, 1], [3, 2, 2], [4, 1, 1]])
+        x = create_paths(lengths.view(-1), 4, True).view(3, 3, 4, -1)
+        # the second pair shares a path with the first pair, and the third pair has a padded path
+        x[1, 1], lengths[1, 1] = x[0, 0], lengths[0, 0]
+        x[2, 2], lengths[2, 2] = x[2, 0], lengths[2, 0]
+        path_mask = torch.tensor([[True, True, True], [True, True, True], [True, True, False]])
+        for skip_padded_steps in (True, False):
+            model = create_model(skip_padded_steps=skip_padded_steps)
+            deduplicating_model = create_model(skip_padded_steps=skip_padded_steps, deduplicate_paths=True)
+            with torch.no_grad():
+                probs, path_weights, type_weights = model(x, path_mask, lengths)
+                deduplicated_probs, deduplicated_path_weights, deduplicated_type_weights = deduplicating_model(
+                    x, path_mask, lengths)
+            self.assertTrue(torch.allclose(deduplicated_probs, probs, atol=1e-6))
+            self.assertTrue(torch.allclose(deduplicated_path_weights, path_weights, atol=1e-6))
+            self.assertTrue(torch.allclose(deduplicated_type_weights, type_weights, atol=1e-6))
+            self.assertEqual(deduplicating_model.number_of_paths, 9)
+            self.assertEqual(deduplicating_model.number_of_unique_paths, 7)
+
+    def test_precompute_type_keys(self):
+        generator = torch.Generator().manual_seed(0)
+        entity_type_rows = torch.randint(1, NUMBER_OF_TYPES, (NUMBER_OF_ENTITIES, 3), generator=generator)
+        entity_type_rows[::2, 2] = 0
+        entity_type_rows[::3, 1:] = 0
+        # (entity row, relation) steps
+        x = torch.stack((torch.randint(0, NUMBER_OF_ENTITIES, (2, 3, 4), generator=generator),
+                         torch.randint(1, NUMBER_OF_RELATIONS, (2, 3, 4), generator=generator)), dim=3)
+        for attention_method in ("sat", "abstract", "specific"):
+            for mask_padded_types in (True, False):
+                model = create_model(attention_method=attention_method, mask_padded_types=mask_padded_types,
+                                     entity_type_rows=entity_type_rows)
+                precomputing_model = create_model(attention_method=attention_method,
+                                                  mask_padded_types=mask_padded_types,
+                                                  entity_type_rows=entity_type_rows, precompute_type_keys=True)
+                for _ in range(2):
+                    with torch.no_grad():
+                        expected = model(x)
+                        scores = precomputing_model(x)
+                    for tensor, expected_tensor in zip(scores, expected):
+                        self.assertTrue(torch.allclose(tensor, expected_tensor, atol=1e-6))
+                    # projected types are computed again after type embeddings change
+                    with torch.no_grad():
+                        for weight in (model.feature_embeddings.entity_types_embeddings.weight,
+                                       precomputing_model.feature_embeddings.entity_types_embeddings.weight):
+                            weight.mul_(2)
+
+    def test_target_relations(self):
+        x = create_paths(torch.full((3 * 2,), 4), 4, True).view(3, 2, 4, -1)
+        target_relations = torch.tensor([0, 2, 1])
+        for pooling_method in ("sat", "lse"):
+            model = create_model(pooling_method=pooling_method)
+            multi_relation_model = create_model(pooling_method=pooling_method, number_of_target_relations=3)
+            with torch.no_grad():
+                expected_probs, expected_path_weights, _ = model(x)
+                probs, path_weights, _ = multi_relation_model(x, target_relations=target_relations)
+            # adjustments of target relations start at zero, so every relation starts with the shared head
+            self.assertTrue(torch.allclose(probs, expected_probs, atol=1e-6))
+            if pooling_method == "sat":
+                self.assertTrue(torch.allclose(path_weights, expected_path_weights, atol=1e-6))
+            with self.assertRaises(Exception):
+                multi_relation_model(x)
+
+
+if __name__ == "__main__":
+    unittest.main()
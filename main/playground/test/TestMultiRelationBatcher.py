@@ -0,0 +1,49 @@
+import unittest
+import tempfile
+import shutil
+import os
+from main.playground.BucketBatcher import BucketBatcher
+from main.playground.MultiRelationBatcher import MultiRelationBatcher
+from main.playground.test.TestBucketBatcher import write_relation
+
+
+def get_batch_key(data):
+    inputs, labels, path_mask, lengths = data[:4]
+    return inputs.numpy().tobytes(), labels.numpy().tobytes(), path_mask.numpy().tobytes(), lengths.numpy().tobytes()
+
+
+class TestMultiRelationBatcher(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_epochs(self):
+        batchers = []
+        for relation in range(3):
+            relation_dir = os.path.join(self.dir, "rel{}".format(relation))
+            write_relation(relation_dir, True, seed=relation)
+            batchers.append(BucketBatcher(os.path.join(relation_dir, "train"), batch_size=2 + relation, shuffle=False,
+                                          number_of_buckets=2, queue_depth=0, device="cpu"))
+        # batches of each relation in one epoch of its own batcher
+        expected = sorted((relation, get_batch_key(data)) for relation, batcher in enumerate(batchers)
+                          for data in batcher)
+
+        multi_relation_batcher = MultiRelationBatcher(batchers, shuffle=True)
+        self.assertEqual(len(multi_relation_batcher), len(expected))
+        for _ in range(2):
+            batches = []
+            for data in multi_relation_batcher:
+                target_relations = data[4]
+                self.assertEqual(len(target_relations), len(data[1]))
+                relation = target_relations[0].item()
+                self.assertTrue((target_relations == relation).all())
+                batches.append((relation, get_batch_key(data)))
+            # every batch of every relation once, tagged with its relation
+            self.assertEqual(sorted(batches), expected)
+        multi_relation_batcher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
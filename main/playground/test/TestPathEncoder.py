@@ -0,0 +1,97 @@
+import unittest
+import tempfile
+import shutil
+import os
+import json
+import numpy as np
+from main.playground.PathEncoder import PathEncoder, write_int_file, read_int_file, open_shard, read_shard, \
+    read_entity_type_rows, read_shared_entity_type_rows
+
+
+class TestPathEncoder(unittest.TestCase):
+    def setUp(self):
+        self.vocab_dir = tempfile.mkdtemp()
+        vocabs = {"entity_vocab.txt": {"a": 0, "b": 1, "c": 2, "#PAD_TOKEN": 3},
+                  "relation_vocab.txt": {"r": 0, "_r": 1, "#PAD_TOKEN": 2, "#END_RELATION": 3},
+                  "entity_type_vocab.txt": {"t0": 0, "t1": 1, "t2": 2, "#PAD_TOKEN": 3},
+                  "entity_to_list_type.json": {"a": ["t2", "t0"], "b": ["t1", "t2", "t0"], "c": []},
+                  "domain-label": {"domain": {"1": 1, "-1": 0}, "name": "label"}}
+        for filename in vocabs:
+            with open(os.path.join(self.vocab_dir, filename), "w") as fh:
+                json.dump(vocabs[filename], fh)
+
+    def tearDown(self):
+        shutil.rmtree(self.vocab_dir)
+
+    def test_encode_pair(self):
+        encoder = PathEncoder(self.vocab_dir, False, False, 2)
+        inputs, lengths = encoder.encode_pair("a", "c", ["r-b-_r", "r", "r-b-r-a-r"], 3, True)
+        # the last path is longer than max length
+        self.assertEqual(inputs.shape, (2, 3, 4))
+        self.assertEqual(lengths.tolist(), [3, 2])
+        self.assertEqual(inputs[0].tolist(), [[2, 0, 0, 0], [1, 0, 1, 1], [3, 3, 2, 3]])
+        self.assertEqual(inputs[1].tolist(), [[3, 3, 3, 2], [2, 0, 0, 0], [3, 3, 2, 3]])
+
+    def test_entity_indexed_types(self):
+        encoder = PathEncoder(self.vocab_dir, False, False, 2)
+        indexed_encoder = PathEncoder(self.vocab_dir, False, False, 2, entity_indexed_types=True)
+        inputs, _ = encoder.encode_pair("a", "c", ["r-b-_r", "r"], 3, True)
+        indexed_inputs, _ = indexed_encoder.encode_pair("a", "c", ["r-b-_r", "r"], 3, True)
+        self.assertEqual(indexed_inputs.shape, (2, 3, 2))
+        # types are gathered from the entity rows
+        rows = indexed_encoder.entity_type_rows
+        self.assertEqual(rows[indexed_inputs[..., 0]].tolist(), inputs[..., :2].tolist())
+        self.assertEqual(indexed_inputs[..., 1].tolist(), inputs[..., 3].tolist())
+
+    def test_write_int_file(self):
+        encoder = PathEncoder(self.vocab_dir, False, True, 2)
+        inputs, lengths = encoder.encode_pair("a", "c", ["r-b-_r", "r"], 3, False)
+        filename = os.path.join(self.vocab_dir, "train.txt.2.int")
+        write_int_file(filename, np.array([1]), inputs[np.newaxis], lengths[np.newaxis], False)
+        with open(filename) as fh:
+            self.assertEqual(fh.read(), "1\t2 0 1 2;1 0 2 2\n")
+
+        labels, inputs, lengths = read_int_file(filename, False, 2)
+        self.assertEqual(inputs.tolist(), [[[[0], [1], [2]], [[0], [2], [2]]]])
+        self.assertEqual(lengths.tolist(), [[2, 1]])
+
+    def test_shard(self):
+        encoder = PathEncoder(self.vocab_dir, False, False, 2)
+        pair1 = encoder.encode_pair("a", "c", ["r-b-_r", "r"], 3, True)
+        pair2 = encoder.encode_pair("b", "a", ["_r"], 3, True)
+        prefix = os.path.join(self.vocab_dir, "train")
+        labels, inputs, lengths, index = open_shard(prefix, [(1, 1), (2, 1)], 3, 4, encoder.get_max_feature_value())
+        self.assertEqual(inputs.dtype, np.int8)
+        labels[:] = [0, 1]
+        inputs[:1], lengths[:1] = pair2
+        inputs[1:], lengths[1:] = pair1
+        del labels, inputs, lengths
+
+        labels, inputs, lengths = read_shard(prefix + ".index.npy", 1)
+        self.assertEqual(labels.tolist(), [1])
+        self.assertEqual(inputs.tolist(), pair1[0][np.newaxis].tolist())
+        self.assertEqual(lengths.tolist(), [[3, 2]])
+
+    def test_shared_entity_type_rows(self):
+        relation_dirs = []
+        for rel, stats in (("rel1", {"entity_indexed_types": True, "num_entity_types_slots": 2}),
+                           ("rel2", {"entity_indexed_types": True, "num_entity_types_slots": 3}),
+                           ("rel3", {"entity_indexed_types": False, "num_entity_types_slots": 3})):
+            relation_dir = os.path.join(self.vocab_dir, rel)
+            os.mkdir(relation_dir)
+            with open(os.path.join(relation_dir, "statistics.json"), "w") as fh:
+                json.dump(stats, fh)
+            relation_dirs.append(relation_dir)
+
+        # a relation alone uses its own number of slots
+        self.assertEqual(read_entity_type_rows(relation_dirs[0], self.vocab_dir)[1].tolist(), [1, 0])
+        self.assertEqual(read_shared_entity_type_rows(relation_dirs[:1], self.vocab_dir)[1].tolist(), [1, 0])
+        # rows of relations with different numbers of slots keep all types of the deepest relation
+        rows = read_shared_entity_type_rows(relation_dirs[:2], self.vocab_dir)
+        self.assertEqual(rows.tolist(), read_entity_type_rows(relation_dirs[1], self.vocab_dir).tolist())
+        self.assertEqual(rows[1].tolist(), [2, 1, 0])
+        self.assertEqual(rows[0].tolist(), [2, 0, 3])
+        # steps of other relations store type features
+        self.assertIsNone(read_shared_entity_type_rows(relation_dirs[2:], self.vocab_dir))
+        with self.assertRaises(Exception):
+            read_shared_entity_type_rows(relation_dirs, self.vocab_dir)
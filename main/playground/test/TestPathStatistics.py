@@ -0,0 +1,79 @@
+import unittest
+import tempfile
+import shutil
+import os
+import json
+from main.playground.path_statistics import choose_limit, report_padding_savings
+from main.playground.make_data_format import vectorize_relation
+from main.playground.PathEncoder import PathEncoder
+
+
+class TestPathStatistics(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_choose_limit(self):
+        counts = {1: 50, 2: 30, 3: 15, 4: 5}
+        # exactly the coverage fraction of values are no greater than the limit
+        self.assertEqual(choose_limit(counts, 0.8, 10), 2)
+        self.assertEqual(choose_limit(counts, 0.81, 10), 3)
+        self.assertEqual(choose_limit(counts, 1.0, 10), 4)
+        # the limit does not exceed the upper limit
+        self.assertEqual(choose_limit(counts, 1.0, 3), 3)
+        self.assertEqual(choose_limit({}, 0.9, 3), 3)
+        self.assertEqual(choose_limit({0: 10}, 0.9, 3), 1)
+
+    def test_report_padding_savings(self):
+        path_length_counts = {1: 2, 2: 3, 3: 1, 5: 4}
+        type_depth_counts = {1: 10, 2: 5, 3: 1}
+        stats = report_padding_savings("rel", path_length_counts, type_depth_counts, 4, 3, 2, 2)
+        # paths longer than the fixed length are dropped with both limits
+        self.assertEqual(stats["truncated_paths"], 1)
+        self.assertEqual(stats["paths"], 5)
+        self.assertEqual(stats["steps_with_truncated_types"], 1)
+        self.assertEqual(stats["steps"], 16)
+        self.assertEqual(stats["memory"], 5 * 2 * (2 + 2) * 8)
+        self.assertEqual(stats["fixed_memory"], 6 * 4 * (3 + 2) * 8)
+        self.assertLess(stats["flops"], stats["fixed_flops"])
+        stats = report_padding_savings("rel", path_length_counts, type_depth_counts, 4, 3, 2, 2, include_types=False)
+        self.assertEqual(stats["memory"], 5 * 2 * 2 * 8)
+
+    def test_vectorize_relation(self):
+        vocab_dir = os.path.join(self.dir, "vocab")
+        os.mkdir(vocab_dir)
+        vocabs = {"entity_vocab.txt": {"a": 0, "b": 1, "c": 2, "#PAD_TOKEN": 3},
+                  "relation_vocab.txt": {"r": 0, "_r": 1, "#PAD_TOKEN": 2, "#END_RELATION": 3},
+                  "entity_type_vocab.txt": {"t0": 0, "t1": 1, "t2": 2, "#PAD_TOKEN": 3},
+                  "entity_to_list_type.json": {"a": ["t2", "t0"], "b": ["t1", "t2", "t0"], "c": []},
+                  "domain-label": {"domain": {"1": 1, "-1": 0}, "name": "label"}}
+        for filename in vocabs:
+            with open(os.path.join(vocab_dir, filename), "w") as fh:
+                json.dump(vocabs[filename], fh)
+        # 5 paths of 2 steps, 2 paths of 3 steps, and 4 paths of 4 steps, which are longer than the upper limit
+        pairs = [(0, "a", "c", "1", ["r", "r", "r-b-r-a-r"]),
+                 (1, "b", "a", "-1", ["r", "r-b-_r", "r-b-r-a-r"]),
+                 (2, "a", "b", "1", ["r", "r-b-r-a-r"]),
+                 (3, "c", "a", "1", ["r", "r-b-_r", "r-b-r-a-r"])]
+        out_dir = os.path.join(self.dir, "rel")
+        encoder = PathEncoder(vocab_dir, False, False, 3)
+        vectorize_relation("rel", pairs, out_dir, encoder, 3, 3, True, coverage=0.7, output_format="npz")
+
+        with open(os.path.join(out_dir, "statistics.json")) as fh:
+            stats = json.load(fh)
+        padding = stats["padding"]
+        # 5 of the 7 paths that can be kept have 2 steps. Counting paths of 4 steps would choose 3 steps.
+        self.assertEqual(stats["max_length"], 2)
+        self.assertEqual(padding["fixed_max_length"], 3)
+        self.assertEqual(padding["truncated_paths"], 2)
+        self.assertEqual(padding["paths"], 5)
+        self.assertEqual(stats["paths"], 5)
+        slots = stats["num_entity_types_slots"]
+        self.assertEqual(padding["memory"], 5 * 2 * (slots + 2) * 8)
+        self.assertEqual(padding["fixed_memory"], 7 * 3 * (3 + 2) * 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
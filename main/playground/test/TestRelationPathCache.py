@@ -0,0 +1,55 @@
+import unittest
+import torch
+from main.playground.test.TestCompositionalVectorSpaceModel import create_model, create_paths
+
+
+class TestRelationPathCache(unittest.TestCase):
+    def setUp(self):
+        self.lengths = torch.tensor([[2, 4, 1], [3, 2, 2], [4, 1, 3]])
+        self.x = create_paths(self.lengths.view(-1), 4, True).view(3, 3, 4, -1)
+
+    def assert_same_scores(self, model, cached_model):
+        with torch.no_grad():
+            expected = model(self.x, lengths=self.lengths)
+            scores = cached_model(self.x, lengths=self.lengths)
+        for tensor, expected_tensor in zip(scores, expected):
+            self.assertTrue(torch.allclose(tensor, expected_tensor, atol=1e-6))
+
+    def test_hits(self):
+        for skip_padded_steps in (True, False):
+            for max_size in (100, 4):
+                model = create_model(skip_padded_steps=skip_padded_steps)
+                cached_model = create_model(skip_padded_steps=skip_padded_steps, relation_path_cache_size=max_size)
+                cache = cached_model.relation_path_cache
+                self.assert_same_scores(model, cached_model)
+                self.assertEqual((cache.hits, cache.misses), (0, 9))
+                # relation sequences of the second batch are cached if they fit
+                self.assert_same_scores(model, cached_model)
+                if max_size == 100:
+                    self.assertEqual((cache.hits, cache.misses), (9, 9))
+                self.assertLessEqual(len(cache.rows), max_size)
+
+    def test_invalidation(self):
+        model = create_model()
+        cached_model = create_model(relation_path_cache_size=100)
+        self.assert_same_scores(model, cached_model)
+
+        # an optimizer step updates parameters in place
+        cached_model.train()
+        optimizer = torch.optim.SGD(cached_model.parameters(), lr=1.0)
+        probs, _, _ = cached_model(self.x, lengths=self.lengths)
+        probs.sum().backward()
+        optimizer.step()
+        cached_model.eval()
+        model.load_state_dict(cached_model.state_dict())
+        self.assert_same_scores(model, cached_model)
+        self.assertEqual(cached_model.relation_path_cache.hits, 0)
+
+        # loading a state dict replaces parameters
+        cached_model.load_state_dict(create_model().state_dict())
+        self.assert_same_scores(create_model(), cached_model)
+        self.assertEqual(cached_model.relation_path_cache.hits, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
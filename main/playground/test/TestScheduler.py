@@ -0,0 +1,68 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+from main.playground.scheduler import estimate_training_cost, schedule_largest_first
+from main.playground.PathEncoder import write_int_file, write_npz_file, open_shard
+
+
+def write_pairs(filename, number_of_pairs, number_of_paths, number_of_steps, number_of_features=4):
+    labels = np.ones(number_of_pairs, dtype=np.int64)
+    inputs = np.ones((number_of_pairs, number_of_paths, number_of_steps, number_of_features), dtype=np.int64)
+    lengths = np.full((number_of_pairs, number_of_paths), number_of_steps, dtype=np.int64)
+    if filename.endswith(".npz"):
+        write_npz_file(filename, labels, inputs, lengths)
+    else:
+        write_int_file(filename, labels, inputs, lengths, True)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_split_dir(self, rel):
+        split_dir = os.path.join(self.dir, rel, "train")
+        os.makedirs(split_dir)
+        return split_dir
+
+    def test_estimate_training_cost(self):
+        split_dir = self.make_split_dir("npz")
+        write_pairs(os.path.join(split_dir, "train.1.npz"), 3, 1, 4)
+        write_pairs(os.path.join(split_dir, "train.3.npz"), 2, 3, 4)
+        self.assertEqual(estimate_training_cost(os.path.join(self.dir, "npz")), 3 * 1 * 4 + 2 * 3 * 4)
+
+        split_dir = self.make_split_dir("int")
+        write_pairs(os.path.join(split_dir, "train.2.int"), 2, 2, 3)
+        write_pairs(os.path.join(split_dir, "train.4.int"), 1, 4, 3)
+        # other files are not counted
+        with open(os.path.join(split_dir, "README"), "w") as fh:
+            fh.write("not data")
+        self.assertEqual(estimate_training_cost(os.path.join(self.dir, "int")), 2 * 2 * 3 + 1 * 4 * 3)
+
+        split_dir = self.make_split_dir("shard")
+        open_shard(os.path.join(split_dir, "train"), [(1, 3), (2, 2)], 5, 4, 10)
+        self.assertEqual(estimate_training_cost(os.path.join(self.dir, "shard")), 3 * 1 * 5 + 2 * 2 * 5)
+
+    def test_schedule_largest_first(self):
+        costs = {"a": 3, "b": 5, "c": 3, "d": 4, "e": 3}
+        order, makespan = schedule_largest_first(costs, 2)
+        self.assertEqual(sorted(order), sorted(costs))
+        self.assertEqual(order[0], "b")
+        # the jobs of 5 and 4 run on one worker and the jobs of 3 on the other
+        self.assertEqual(makespan, 9)
+
+        order, makespan = schedule_largest_first(costs, 8)
+        self.assertEqual([costs[job] for job in order], [5, 4, 3, 3, 3])
+        self.assertEqual(makespan, 5)
+        order, makespan = schedule_largest_first(costs, 1)
+        self.assertEqual(order[0], "b")
+        self.assertEqual(makespan, 18)
+        self.assertEqual(schedule_largest_first({}, 2), ([], 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+import torch
+from main.playground.model2.ScriptableModel import export_torchscript
+from main.playground.test.TestCompositionalVectorSpaceModel import create_model, create_paths
+
+
+class TestScriptableModel(unittest.TestCase):
+    def test_scripted_model(self):
+        num_ent_pairs, num_paths, num_steps = 3, 4, 5
+        lengths = torch.tensor([[2, 5, 1, 3], [5, 2, 4, 1], [3, 3, 1, 4]])
+        path_mask = torch.tensor([[True, True, True, True], [True, True, False, False], [True, True, True, False]])
+        for pre_padding in (True, False):
+            x = create_paths(lengths.view(-1), num_steps, pre_padding)
+            # the second type slot is padded in some steps
+            x[:, :, 1] = x[:, :, 1] * (x[:, :, 0] % 2)
+            x = x.view(num_ent_pairs, num_paths, num_steps, -1)
+            for pooling_method in ("sat", "lse", "max", "avg"):
+                model = create_model(pooling_method=pooling_method, mask_padded_types=True, skip_padded_steps=True,
+                                     pre_padding=pre_padding)
+                scripted_model = export_torchscript(model)
+                with torch.no_grad():
+                    probs, path_weights, type_weights = model(x, path_mask, lengths)
+                    scripted_probs, scripted_path_weights, scripted_type_weights = scripted_model(x, path_mask, lengths)
+                self.assertTrue(torch.allclose(scripted_probs, probs, atol=1e-6))
+                self.assertTrue(torch.allclose(scripted_type_weights, type_weights, atol=1e-6))
+                if pooling_method == "sat":
+                    self.assertTrue(torch.allclose(scripted_path_weights, path_weights, atol=1e-6))
+
+
+if __name__ == "__main__":
+    unittest.main()
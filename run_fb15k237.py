@@ -208,6 +208,19 @@ if __name__ == "__main__":
         #cvsm = CompositionalVectorAlgorithm(CVSM_RET_DIR, None, attention_method="abstract", early_stopping_metric="map")
         #cvsm.train_and_test()
 
+        # Uncomment to batch entity pairs with different numbers of paths together in buckets, which is faster but
+        # gives different results than batching each number of paths separately
+        # cvsm = CompositionalVectorAlgorithm("freebase", CVSM_RET_DIR, None, attention_method="sat", early_stopping_metric="map", number_of_buckets=4)
+        # cvsm.train_and_test()
+
+        # Uncomment to train each relation with 8 processes of data parallelism on cpus
+        # cvsm = CompositionalVectorAlgorithm("freebase", CVSM_RET_DIR, None, attention_method="sat", early_stopping_metric="map", device="cpu", number_of_buckets=4, world_size=8)
+        # cvsm.train_and_test()
+
+        # Uncomment to load files of a relation lazily in windows of batchers, for relations bigger than memory
+        # cvsm = CompositionalVectorAlgorithm("freebase", CVSM_RET_DIR, None, attention_method="sat", early_stopping_metric="map", lazy=True)
+        # cvsm.train_and_test()
+
         # Uncomment if need to train only one relation
         # cvsm.train("/home/weiyu/Research/ChainsOfReasoningWithAbstractEntities/data/fb15k237/cvsm_entity/data/data_output/|food|food|nutrients.|food|nutrition_fact|nutrient")
 
@@ -189,6 +189,17 @@ if __name__ == "__main__":
         # Not using pretrained word embeddings decreases performance
         # cvsm = CompositionalVectorAlgorithm("wordnet", CVSM_RET_DIR, None)
 
+        # Uncomment to batch entity pairs with different numbers of paths together in buckets, which is faster but
+        # gives different results than batching each number of paths separately
+        # cvsm = CompositionalVectorAlgorithm("wordnet", CVSM_RET_DIR, ENTITY_TYPE2VEC_FILENAME, number_of_buckets=4)
+
+        # Uncomment to train one model for all relations. Pass all_best_epoch_val_test of separate models as baseline
+        # to train_and_test() to compare test APs of relations.
+        # cvsm = CompositionalVectorAlgorithm("wordnet", CVSM_RET_DIR, ENTITY_TYPE2VEC_FILENAME, multi_relation=True)
+
+        # Uncomment to load files of a relation lazily in windows of batchers, for relations bigger than memory
+        # cvsm = CompositionalVectorAlgorithm("wordnet", CVSM_RET_DIR, ENTITY_TYPE2VEC_FILENAME, lazy=True)
+
         cvsm.train_and_test()
 
         # Uncomment if need to train only one relation